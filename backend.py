@@ -1,11 +1,13 @@
 from readgssi import readgssi as r
 import numpy as np
-from scipy.ndimage.filters import uniform_filter1d
-from scipy.signal import firwin, lfilter, hilbert2
-from scipy import fft as scipyfft
-from PyEMD import EMD
+import os
+# scipy.signal, scipy.fft and pywt are imported inside the filters that
+# use them: together they are most of the GUI's start-up time
 # import emd
-import pywt
+import kernels
+import executors
+import instrument
+import decoded
 from datetime import datetime
 
 
@@ -14,49 +16,148 @@ def dzt_func(file_paths):
     data = list()
     headers = list()
     for file in file_paths:
-        read = r.readgssi(file)
+        with instrument.stage('read', os.path.basename(file), file) as s:
+            # a decode cache left by the watch command of batch.py opens without decoding
+            read = decoded.open_decoded(file) or r.readgssi(file)
+            s.out(read[0])
         data.append(read[0])
         headers.append(read[1])
     return data, headers
 
 
 #------------- FILTERING ------------------#
-def dzt_filters(data, headers, active_filters):
+def dzt_filters(data, headers, active_filters, tile=None, workers=1, processes=1):
+    """
+    Apply the active filters, in order, to every array. Each array goes through :py:func:`executors.run_tiled`, which runs consecutive stages tile by tile so temporaries scale with the tile size rather than the line length. With more than one file, :code:`processes > 1` and at least :py:data:`executors.PROCESS_MIN_BYTES` of data, files are filtered in parallel worker processes through shared memory (:py:func:`executors.run_files_shared`).
+
+    :param list data: The radar arrays
+    :param list headers: The matching header dictionaries
+    :param dict active_filters: Filter names mapped to their parameter lists, as built by the GUI
+    :param int tile: Traces per tile. Defaults to None, which resolves to :py:data:`executors.DEFAULT_TILE`.
+    :param int workers: Number of threads to run tiles on
+    :param int processes: Number of worker processes to spread files over
+    :rtype: list of :py:class:`numpy.ndarray`
+    """
+    if (processes > 1) and (len(data) > 1) and (sum(ar.nbytes for ar in data) >= executors.PROCESS_MIN_BYTES):
+        # the workers' own stages happen in other processes, so the pool is timed as one stage
+        with instrument.stage('filter', ', '.join(active_filters), list(data), processes=min(processes, len(data))) as s:
+            s.out(executors.run_files_shared(data, headers, active_filters, workers=min(processes, len(data)), tile=tile))
+        return data
     for i in range(len(data)):
-        for filt_active in active_filters:
-            if filt_active == 'Horizontal background removal':
-                data[i] = bgr(data[i], headers[i], win=float(active_filters[filt_active][0].split('=')[1]))
-            elif filt_active == 'Vertical triangular FIR bandpass':
-                data[i] = triangular(data[i], headers[i], float(active_filters[filt_active][0].split('=')[1]), float(active_filters[filt_active][1].split('=')[1]))
-            elif filt_active == 'Fast Fourier Transform':
-                data[i] = scipyfft.rfft2(data[i]).real
-            elif filt_active == 'Hilbert Huang Transform':
-                # print(datetime.now().strftime("%H:%M:%S"))
-                x = 0
-                emd = EMD()
-                # NEED TO DO MORE RESEARCH INTO THESE ATRIBUTES
-                emd.FIXE = 15
-                emd.FIXE_H = 0
-                for chan in data[i]:
-                    # imfs = emd(chan)
-                    imfs = emd(chan)
-                    chan = imfs[len(imfs)-1]
-                    x += 1
-                data[i] = hilbert2(data[i]).real
-                # print(datetime.now().strftime("%H:%M:%S"))
-            elif filt_active == 'Wavelets':
-                w = pywt.Wavelet(active_filters[filt_active][0])
-                if w.name in pywt.wavelist(kind='discrete'):
-                    for chan in data[i]:
-                        chan, cD = pywt.dwt(chan, w)
-                elif w.name in pywt.wavelist(kind='continuous'):
-                    for chan in data[i]:
-                        chan, cD = pywt.ContinuousWavelet(chan, w)
-                else:
-                    print("not implemented")
+        data[i] = executors.run_tiled(data[i], headers[i], active_filters, tile=tile, workers=workers)
     return data
 
 
+def filter_args(params):
+    """
+    Parse a GUI parameter list such as :code:`['freqmin=70', 'freqmax=130']` into floats.
+
+    :param list params: The parameter strings
+    :rtype: list of float
+    """
+    return [float(p.split('=')[1]) for p in params]
+
+
+def filter_support(filt, params, shape):
+    """
+    Horizontal support of a filter stage, used to plan tiled execution.
+
+    :param str filt: The filter name
+    :param list params: The filter parameter list
+    :param tuple shape: Shape of the array the stage will run on
+    :rtype: halo (:py:class:`int` number of neighbouring traces needed on each side of a tile, or None if the stage needs the whole array), reduce (:py:class:`bool`, whether :py:func:`prepare_filter` must first run over the whole stage input)
+    """
+    if filt == 'Horizontal background removal':
+        return bgr_window(filter_args(params)[0], shape[1]) // 2, True
+    elif filt == 'Automatic time-zero':
+        return 0, True
+    elif filt in ('Vertical triangular FIR bandpass', 'Automatic gain control', 'Median despike'):
+        return 0, False
+    return None, False
+
+
+def prepare_filter(ar, header, filt, params, tile=2048):
+    """
+    Whole-array pass for stages that need a reduction of their input before they can run on tiles (see :py:func:`filter_support`). Header changes made by the stage are applied here, once.
+
+    :param numpy.ndarray ar: The stage input
+    :param dict header: The file header dictionary
+    :param str filt: The filter name
+    :param list params: The filter parameter list
+    :param int tile: Traces per block for reductions that are computed block-wise
+    :rtype: state to pass to :py:func:`run_filter`
+    """
+    if filt == 'Horizontal background removal':
+        return {'means': ar.mean(axis=1), 'window': bgr_window(filter_args(params)[0], ar.shape[1])}
+    elif filt == 'Automatic time-zero':
+        thresh = filter_args(params)[0]
+        picks = np.concatenate([pick_timezero(ar[:, a:a + tile], header, thresh=thresh)
+                                for a in range(0, ar.shape[1], tile)])
+        tz = int(round(float(np.median(picks))))
+        record_crop(header, tz)
+        return {'picks': picks, 'tz': tz}
+    return None
+
+
+def run_filter(ar, header, filt, params, state=None, cols=slice(None)):
+    """
+    Run one filter stage on an array or on a tile of it.
+
+    :param numpy.ndarray ar: The radar array (or a tile of it, including halo traces)
+    :param dict header: The file header dictionary
+    :param str filt: The filter name
+    :param list params: The filter parameter list, as in :code:`active_filters`
+    :param state: Output of :py:func:`prepare_filter` for the full array, or None to run the stage on :code:`ar` alone
+    :param slice cols: The columns of the full array that :code:`ar` covers
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    if filt == 'Horizontal background removal':
+        if state is None:
+            return bgr(ar, header, win=filter_args(params)[0])
+        return kernels.bgr(ar, state['window'], means=state['means'])
+    elif filt == 'Vertical triangular FIR bandpass':
+        freqmin, freqmax = filter_args(params)
+        return triangular(ar, header, freqmin, freqmax)
+    elif filt == 'Automatic gain control':
+        return agc(ar, header, win=filter_args(params)[0])
+    elif filt == 'Median despike':
+        win, thresh = filter_args(params)
+        return despike(ar, header, win=win, thresh=thresh)
+    elif filt == 'Automatic time-zero':
+        thresh, statics = filter_args(params)
+        if state is None:
+            return auto_timezero(ar, header, thresh=thresh, statics=bool(statics))
+        if statics:
+            ar = shift_traces(ar, state['picks'][cols] - state['tz'])
+        return ar[state['tz']:]
+    elif filt == 'Fast Fourier Transform':
+        from scipy import fft as scipyfft
+        return scipyfft.rfft2(ar).real
+    elif filt == 'Hilbert Huang Transform':
+        from scipy.signal import hilbert2
+        # the PyEMD sifting this stage used to run discarded its result, so its output
+        # has always been hilbert2 of the input; kept as is for saved recipes
+        return hilbert2(ar).real
+    elif filt == 'EMD Hilbert Huang Transform':
+        from scipy.signal import hilbert2
+        siftings, imfs = filter_args(params)
+        # each trace is replaced by its last EMD component
+        return hilbert2(kernels.emd(ar, siftings=int(siftings), max_imf=int(imfs))).real
+    elif filt == 'Wavelets':
+        import pywt
+        w = pywt.Wavelet(params[0])
+        if w.name in pywt.wavelist(kind='discrete'):
+            for chan in ar:
+                chan, cD = pywt.dwt(chan, w)
+        elif w.name in pywt.wavelist(kind='continuous'):
+            for chan in ar:
+                chan, cD = pywt.ContinuousWavelet(chan, w)
+        else:
+            print("not implemented")
+        return ar
+    return ar
+
+
 #========= FILTERING FUNCTIONS FROM READGSSI==================#
 def bgr(ar, header, win=0):
     """
@@ -66,24 +167,42 @@ def bgr(ar, header, win=0):
     :param dict header: The file header dictionary
     :param int win: The window length to process. 0 resolves to full-width, whereas positive integers dictate the window size in post-stack traces.
     :rtype: :py:class:`numpy.ndarray`
+
+    The row loop runs in :py:mod:`kernels` (Numba when available) and returns a new float array instead of writing into the input.
+    """
+    return kernels.bgr(ar, bgr_window(win, ar.shape[1]))
+
+
+def bgr_window(win, ntraces):
+    """
+    Resolve a BGR window parameter to the odd boxcar length actually used, or 0 for full-width only.
+
+    :param int win: The requested window length in traces
+    :param int ntraces: The number of traces in the line
+    :rtype: int
     """
-    if (int(win) > 1) & (int(win) < ar.shape[1]):
+    if (int(win) > 1) & (int(win) < ntraces):
         window = int(win)
-        how = 'boxcar (%s trace window)' % window
-    else:
-        how = 'full only'
-    i = 0
-    for row in ar:          # each row
-        mean = np.mean(row)
-        ar[i] = row - mean
-        i += 1
-    if how != 'full only':
         if window < 3:
             window = 3
         elif (window / 2. == int(window / 2)):
             window = window + 1
-        ar -= uniform_filter1d(ar, size=window, mode='constant', cval=0, axis=1)
-    return ar
+        return window
+    return 0
+
+
+def triangular_taps(header, freqmin, freqmax, numtaps=25):
+    """
+    Coefficients of the triangular FIR bandpass, designed by :py:func:`scipy.signal.firwin` for the sampling frequency of the file.
+
+    :param dict header: The file header dictionary
+    :param float freqmin: The lower corner of the bandpass in MHz
+    :param float freqmax: The upper corner of the bandpass in MHz
+    :param int numtaps: Filter length
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    from scipy.signal import firwin
+    return firwin(numtaps=numtaps, cutoff=[freqmin * 10 ** 6, freqmax * 10 ** 6], window='triangle', pass_zero='bandpass', fs=header['samp_freq'])
 
 
 def triangular(ar, header, freqmin, freqmax, zerophase=True):
@@ -101,15 +220,130 @@ def triangular(ar, header, freqmin, freqmax, zerophase=True):
     :param bool zerophase: Whether to run the filter forwards and backwards in order to counteract the phase shift
     :rtype: :py:class:`numpy.ndarray`
     """
-    samp_freq = header['samp_freq']
-    freqmin = freqmin * 10 ** 6
-    freqmax = freqmax * 10 ** 6
-    
-    numtaps = 25
-
-    filt = firwin(numtaps=numtaps, cutoff=[freqmin, freqmax], window='triangle', pass_zero='bandpass', fs=samp_freq)
+    from scipy.signal import lfilter
+    filt = triangular_taps(header, freqmin, freqmax)
 
     far = lfilter(filt, 1.0, ar, axis=0).copy()
     if zerophase:
         far = lfilter(filt, 1.0, far[::-1], axis=0)[::-1]
     return far
+
+
+def agc(ar, header, win=25):
+    """
+    Automatic gain control. Each sample is divided by the mean absolute amplitude of a vertical window centred on it, which balances weak late arrivals against the direct wave.
+
+    :param numpy.ndarray ar: The radar array
+    :param dict header: The file header dictionary
+    :param int win: The window length in samples
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return kernels.agc(ar, max(int(win), 1))
+
+
+def despike(ar, header, win=5, thresh=5):
+    """
+    Median despiking. Samples that differ from a vertical running median by more than :code:`thresh` robust standard deviations of their trace are replaced by the median.
+
+    :param numpy.ndarray ar: The radar array
+    :param dict header: The file header dictionary
+    :param int win: The running median length in samples
+    :param float thresh: The rejection threshold in robust standard deviations
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return kernels.despike(ar, max(int(win), 1), thresh)
+
+
+#================= TIME ZERO ==================#
+def pick_timezero(ar, header, thresh=0, maxsamp=None, skip=2):
+    """
+    Automatic first-break picking of the direct wave on every trace at once. The demeaned top of each trace is converted to an amplitude envelope using :py:func:`scipy.signal.hilbert` along the sample axis, then either the envelope peak (:code:`thresh=0`) or the first sample where the envelope crosses :code:`thresh` times its per-trace maximum is picked. Picks are refined to fractional samples (parabolic interpolation of the peak, linear interpolation of the crossing).
+
+    :param numpy.ndarray ar: The radar array
+    :param dict header: The file header dictionary
+    :param float thresh: Fraction of the per-trace envelope maximum to use as a first-break threshold. 0 picks the envelope peak instead.
+    :param int maxsamp: Last sample of the search window. Defaults to None, which resolves to a quarter of the trace length.
+    :param int skip: Number of samples at the top of each trace to ignore. Defaults to 2, since the first two rows of a DZT array hold the trace number and user marks.
+    :rtype: :py:class:`numpy.ndarray` of fractional sample picks, one per trace
+    """
+    from scipy.signal import hilbert
+    if maxsamp is None:
+        maxsamp = max(ar.shape[0] // 4, skip + 3)
+    win = ar[skip:maxsamp].astype(np.float64)
+    win -= win.mean(axis=0)
+    env = np.abs(hilbert(win, axis=0))
+    cols = np.arange(env.shape[1])
+    peak = np.argmax(env, axis=0)
+    if thresh > 0:
+        # first sample per trace where the envelope exceeds the threshold
+        level = thresh * env[peak, cols]
+        idx = np.argmax(env >= level, axis=0)
+        prev = env[np.maximum(idx - 1, 0), cols]
+        step = env[idx, cols] - prev
+        frac = np.where((idx > 0) & (step > 0), (level - prev) / np.where(step > 0, step, 1), 1.)
+        picks = idx - 1 + frac
+    else:
+        # parabolic interpolation around the envelope maximum
+        inner = np.clip(peak, 1, env.shape[0] - 2)
+        y0, y1, y2 = env[inner - 1, cols], env[inner, cols], env[inner + 1, cols]
+        denom = y0 - 2 * y1 + y2
+        offset = np.where(denom != 0, 0.5 * (y0 - y2) / np.where(denom != 0, denom, 1), 0.)
+        picks = np.where(inner == peak, peak + np.clip(offset, -0.5, 0.5), peak)
+    return picks + skip
+
+
+def shift_traces(ar, shifts):
+    """
+    Fractional-sample static shift. Each trace is moved up by its shift value (output sample :code:`t` is read from input sample :code:`t + shift`) using linear interpolation, through :py:func:`kernels.shift`. Samples shifted in from outside the trace are set to zero.
+
+    :param numpy.ndarray ar: The radar array
+    :param numpy.ndarray shifts: Shift in (fractional) samples for each trace
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    return kernels.shift(ar, shifts)
+
+
+def auto_timezero(ar, header, thresh=0, statics=False, maxsamp=None, skip=2):
+    """
+    Automatic time-zero correction. Picks the direct wave on every trace with :py:func:`pick_timezero`, optionally aligns all traces to the median pick using :py:func:`shift_traces`, then removes the samples above the median pick (the air gap). The crop is recorded in the header with :py:func:`record_crop`.
+
+    :param numpy.ndarray ar: The radar array
+    :param dict header: The file header dictionary
+    :param float thresh: Threshold passed to :py:func:`pick_timezero`. 0 picks the envelope peak.
+    :param bool statics: Whether to apply per-trace static shifts before cropping
+    :param int maxsamp: Last sample of the picking window, see :py:func:`pick_timezero`
+    :param int skip: Number of header samples at the top of each trace to ignore
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    picks = pick_timezero(ar, header, thresh=thresh, maxsamp=maxsamp, skip=skip)
+    tz = int(round(float(np.median(picks))))
+    if statics:
+        ar = shift_traces(ar, picks - tz)
+    record_crop(header, tz)
+    return ar[tz:]
+
+
+def record_crop(header, rows):
+    """
+    Record in a header that :code:`rows` samples were removed from the top of every trace, with time zero now on the first remaining sample.
+
+    Headers follow one convention for cropped arrays: :code:`rh_nsamp` and :code:`rhf_range` keep describing the trace as recorded, :code:`cropped` counts the samples removed from its top since the file was read (0 if the key is missing), and :code:`timezero[0]` is the time-zero sample counted from the top of the recorded trace. Cropping twice adds up. :py:func:`readgssi.translate.dzt` restores :code:`cropped` zero rows, so an exported file has :code:`rh_nsamp` samples and its range matches them.
+
+    :param dict header: The file header dictionary
+    :param int rows: Samples removed from the top
+    """
+    header['cropped'] = int(header.get('cropped') or 0) + int(rows)
+    header['timezero'] = [header['cropped']] + list(header['timezero'][1:])
+
+
+def current_zero(header):
+    """
+    Time-zero sample of an array read with :code:`header`, taking any crop into account (see :py:func:`record_crop`).
+
+    :param dict header: The file header dictionary
+    :rtype: int
+    """
+    zero = header['timezero'][0]
+    if zero is None:
+        zero = header.get('rh_zero') or 0
+    return max(0, int(zero) - int(header.get('cropped') or 0))
@@ -0,0 +1,398 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+from recipes import load_recipe, recipe_filters, recipe_hash
+
+# Headless processing of whole survey folders. No Qt is imported here or in
+# the workers; figures are drawn on the Agg canvas (see plotting.py).
+
+DZT_PATTERNS = ('*.DZT', '*.dzt')
+MANIFEST = 'manifest.json'
+EXPORTS = {'csv': '.csv', 'hdf5': '.h5', 'dzt': '.DZT', 'segy': '.sgy'} # process command formats and their extensions
+
+
+#------------- INPUTS ------------------#
+def find_inputs(patterns):
+    """
+    Expand directories and glob patterns into a sorted list of DZT files.
+
+    :param list patterns: Directories (searched for .DZT files) and/or glob patterns
+    :rtype: list of str
+    """
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for ext in DZT_PATTERNS:
+                found.update(glob.glob(os.path.join(pattern, ext)))
+        else:
+            found.update(glob.glob(pattern))
+    return sorted(os.path.abspath(f) for f in found if os.path.isfile(f))
+
+
+def output_path(infile, out_dir, ext):
+    """
+    Output file for an input, named after it.
+
+    :param str infile: The DZT file location
+    :param str out_dir: The output directory
+    :param str ext: The output extension, including the dot
+    :rtype: str
+    """
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(infile))[0] + ext)
+
+
+def overwrites_input(infile, outfile):
+    """
+    Whether writing :code:`outfile` would replace :code:`infile`, as a DZT export into the input folder would.
+
+    :param str infile: The DZT file location
+    :param str outfile: The output file
+    :rtype: bool
+    """
+    if os.path.normcase(os.path.abspath(outfile)) == os.path.normcase(os.path.abspath(infile)):
+        return True
+    # e.g. FILE.dzt and FILE.DZT on a case-insensitive file system
+    return os.path.exists(outfile) and os.path.samefile(outfile, infile)
+
+
+#------------- MANIFEST ------------------#
+class Manifest(object):
+    """
+    Record of the outputs in a directory and what they were made from (input size and modification time, recipe hash), so reruns only redo what changed. The file is rewritten after every finished output, so an interrupted run resumes where it stopped.
+
+    :param str out_dir: The output directory; the manifest is :py:data:`MANIFEST` inside it
+    """
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, MANIFEST)
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def source_entry(infile, rhash):
+        st = os.stat(infile)
+        return {'source': infile, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'recipe': rhash}
+
+    def is_current(self, outfile, infile, rhash):
+        """
+        Whether :code:`outfile` exists and was made from the current :code:`infile` with the recipe hashed as :code:`rhash`.
+
+        :rtype: bool
+        """
+        entry = self.entries.get(os.path.basename(outfile))
+        if (entry is None) or not os.path.isfile(outfile):
+            return False
+        return {k: entry.get(k) for k in ('source', 'size', 'mtime_ns', 'recipe')} == self.source_entry(infile, rhash)
+
+    def record(self, outfile, infile, rhash, **extra):
+        entry = self.source_entry(infile, rhash)
+        entry.update(extra)
+        self.entries[os.path.basename(outfile)] = entry
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+#------------- WORKERS ------------------#
+def load_profile(infile, recipe):
+    """
+    Read a file and run a recipe's filter chain on it. Unfiltered files with an up-to-date overview are not decoded at all; their stored pyramid and statistics are used.
+
+    :param str infile: The DZT file location
+    :param dict recipe: The recipe
+    :rtype: header (:py:class:`dict`), pyramid (:py:class:`pyramid.DisplayPyramid`), statistics (:py:class:`dict`)
+    """
+    import overview
+    from backend import dzt_func, dzt_filters
+    from pyramid import DisplayPyramid
+    from stats import display_stats
+    filters = recipe_filters(recipe)
+    if not filters:
+        ov = overview.open_overview(infile)
+        if ov is not None:
+            return ov.header, ov.pyramid, ov.stats
+    data, headers = dzt_func([infile])
+    data = dzt_filters(data, headers, filters)
+    return headers[0], DisplayPyramid(data[0]), display_stats(data[0])
+
+
+def render_file(infile, outfile, recipe, figsize=(12, 4), dpi=150):
+    """
+    Worker for the :code:`render` command: filter one file and save its quick-look image.
+
+    :param str infile: The DZT file location
+    :param str outfile: The output image
+    :param dict recipe: The recipe
+    :param tuple figsize: Figure size in inches
+    :param int dpi: Dots per inch
+    :rtype: seconds taken (float)
+    """
+    from plotting import render_profile
+    from stats import clim
+    start = time.perf_counter()
+    header, pyramid, stats = load_profile(infile, recipe)
+    render_profile(outfile, pyramid, header, os.path.basename(infile), clim(stats, mode=recipe['contrast']),
+                   cmap=recipe['cmap'], figsize=figsize, dpi=dpi)
+    return time.perf_counter() - start
+
+
+def process_file(infile, outfile, recipe, fmt):
+    """
+    Worker for the :code:`process` command: filter one file and write it in an export format.
+
+    :param str infile: The DZT file location
+    :param str outfile: The output file, with the extension of :code:`fmt` (see :py:data:`EXPORTS`)
+    :param dict recipe: The recipe
+    :param str fmt: The export format. SEG-Y export takes single-channel files only.
+    :rtype: seconds taken (float)
+    """
+    from backend import dzt_func, dzt_filters
+    from readgssi import translate
+    start = time.perf_counter()
+    data, headers = dzt_func([infile])
+    if (fmt == 'segy') and (headers[0]['rh_nchan'] > 1):
+        # the channels come stacked in one array, and a SEG-Y trace holds one channel
+        raise ValueError('SEG-Y export takes single-channel files; %s has %d channels' % (os.path.basename(infile), headers[0]['rh_nchan']))
+    ar = dzt_filters(data, headers, recipe_filters(recipe))[0]
+    base = os.path.splitext(outfile)[0]
+    if fmt == 'csv':
+        translate.csv(ar, base)
+    elif fmt == 'hdf5':
+        translate.h5(ar, base, headers[0], filters=recipe['filters'])
+    elif fmt == 'dzt':
+        translate.dzt(ar, outfile, headers[0])
+    elif fmt == 'segy':
+        translate.segy(ar, outfile, headers[0])
+    return time.perf_counter() - start
+
+
+def ingest_file(infile, recipe=None, outfile=None, fmt=None):
+    """
+    Worker for the :code:`watch` command: decode a new or changed file once, then write its decode cache and overview file next to it (so the GUI opens it at once) and, with a recipe, its processed export.
+
+    :param str infile: The DZT file location
+    :param dict recipe: The recipe, or None to only cache the file
+    :param str outfile: The processed output file (see :py:func:`process_file`)
+    :param str fmt: The export format
+    :rtype: dict with the catalog summary, the files written and the seconds taken
+    """
+    import decoded
+    import overview
+    from catalog import summarize
+    from readgssi import readgssi as r
+    start = time.perf_counter()
+    ar, header = r.readgssi(infile)
+    outputs = [decoded.decoded_path(infile)]
+    decoded.write_decoded(infile, ar, header)
+    ovr = overview.write_overview(infile, ar, header)
+    if ovr is not None:
+        outputs.append(ovr)
+    summary = summarize(header)
+    del ar
+    if recipe is not None:
+        # reads the decode cache just written
+        process_file(infile, outfile, recipe, fmt)
+        outputs.append(os.path.abspath(outfile))
+    return {'summary': summary, 'outputs': outputs, 'seconds': time.perf_counter() - start}
+
+
+def run_jobs(jobs, manifest, rhash, workers=None):
+    """
+    Run :code:`(func, infile, outfile, kwargs)` jobs on a process pool, recording each finished output in the manifest as it completes.
+
+    :param list jobs: The jobs
+    :param Manifest manifest: The output manifest
+    :param str rhash: Hash of the recipe the jobs use
+    :param int workers: Number of worker processes. Defaults to None, which uses one per CPU.
+    :rtype: int (number of failed jobs)
+    """
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(func, infile, outfile, **kwargs): (infile, outfile) for func, infile, outfile, kwargs in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            infile, outfile = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                failed += 1
+                print('FAILED %s: %s' % (os.path.basename(infile), e))
+                continue
+            manifest.record(outfile, infile, rhash, seconds=round(seconds, 3))
+            print('%s -> %s (%.2f s)' % (os.path.basename(infile), os.path.basename(outfile), seconds))
+    return failed
+
+
+#------------- COMMANDS ------------------#
+def cmd_render(args):
+    recipe = load_recipe(args.recipe)
+    rhash = recipe_hash(recipe)
+    inputs = find_inputs(args.inputs)
+    os.makedirs(args.out, exist_ok=True)
+    manifest = Manifest(args.out)
+    jobs = []
+    for infile in inputs:
+        outfile = output_path(infile, args.out, '.' + args.format)
+        if args.force or not manifest.is_current(outfile, infile, rhash):
+            jobs.append((render_file, infile, outfile, {'recipe': recipe, 'figsize': (args.width, args.height), 'dpi': args.dpi}))
+    print('%d file(s), %d up to date, %d to render' % (len(inputs), len(inputs) - len(jobs), len(jobs)))
+    if not jobs:
+        return 0
+    return 1 if run_jobs(jobs, manifest, rhash, workers=args.workers) else 0
+
+
+def cmd_process(args):
+    recipe = load_recipe(args.recipe)
+    rhash = recipe_hash(recipe)
+    inputs = find_inputs(args.inputs)
+    os.makedirs(args.out, exist_ok=True)
+    manifest = Manifest(args.out)
+    jobs = []
+    for infile in inputs:
+        outfile = output_path(infile, args.out, EXPORTS[args.format])
+        if overwrites_input(infile, outfile):
+            print('SKIPPED %s: the output would overwrite it' % os.path.basename(infile))
+            continue
+        if args.force or not manifest.is_current(outfile, infile, rhash):
+            jobs.append((process_file, infile, outfile, {'recipe': recipe, 'fmt': args.format}))
+    print('%d file(s), %d up to date, %d to process' % (len(inputs), len(inputs) - len(jobs), len(jobs)))
+    if not jobs:
+        return 0
+    return 1 if run_jobs(jobs, manifest, rhash, workers=args.workers) else 0
+
+
+def settled_files(patterns, seen, settle):
+    """
+    Poll the inputs and return the files that have stopped changing. A file is settled once the size and modification time of it and its DZX and DZG have stayed the same for :code:`settle` seconds, so lines still being recorded or copied are left alone.
+
+    :param list patterns: Directories and/or glob patterns
+    :param dict seen: Each file's last signature and when it was first seen, updated in place
+    :param float settle: Seconds a file must stay unchanged
+    :rtype: settled (list of (file, signature) tuples), number of files still changing (int)
+    """
+    from decoded import source_signature
+    now = time.monotonic()
+    settled, changing = [], 0
+    for infile in find_inputs(patterns):
+        signature = source_signature(infile)
+        if signature[0] is None:
+            continue # removed since the listing
+        last = seen.get(infile)
+        if (last is None) or (last[0] != signature):
+            seen[infile] = (signature, now)
+            changing += 1
+        elif now - last[1] >= settle:
+            settled.append((infile, signature))
+        else:
+            changing += 1
+    return settled, changing
+
+
+def cmd_watch(args):
+    from catalog import CATALOG, Catalog
+    from spatial import INDEX, SpatialIndex
+    recipe = load_recipe(args.recipe) if args.recipe else None
+    rhash = recipe_hash(recipe) if recipe else None
+    os.makedirs(args.out, exist_ok=True)
+    manifest = Manifest(args.out) if recipe else None
+    index_path = os.path.join(args.out, INDEX)
+    index = SpatialIndex.open(index_path)
+    seen, failed, running = {}, set(), {}
+    # files this command writes, which must not be taken for new lines when the output directory is watched too
+    produced = {os.path.normcase(os.path.abspath(os.path.join(args.out, name))) for name in (manifest.entries if manifest else ())}
+    print('watching %s (every %g s, %d worker(s)); ctrl-c to stop' % (', '.join(args.inputs), args.interval, args.workers))
+    with Catalog(args.catalog or os.path.join(args.out, CATALOG)) as catalog, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        try:
+            while True:
+                settled, changing = settled_files(args.inputs, seen, args.settle)
+                busy = {job[0] for job in running.values()}
+                queue = [(infile, sig) for infile, sig in settled
+                         if (infile not in busy) and (os.path.normcase(infile) not in produced)
+                         and ((infile, json.dumps(sig)) not in failed) and not catalog.is_current(infile, sig)]
+                # at most one job per worker in flight; the rest are picked up by later polls
+                for infile, sig in queue[:max(0, args.workers - len(running))]:
+                    outfile = output_path(infile, args.out, EXPORTS[args.format]) if recipe else None
+                    if (outfile is not None) and overwrites_input(infile, outfile):
+                        print('%s is cached but not processed: the output would overwrite it' % os.path.basename(infile))
+                        outfile = None
+                    if outfile is not None:
+                        produced.add(os.path.normcase(os.path.abspath(outfile)))
+                    running[pool.submit(ingest_file, infile, recipe if outfile else None, outfile, args.format)] = (infile, sig, outfile)
+                if args.once and not (running or queue or changing):
+                    return 1 if failed else 0
+                done, _ = concurrent.futures.wait(running, timeout=args.interval, return_when=concurrent.futures.FIRST_COMPLETED)
+                ingested = []
+                for future in done:
+                    infile, sig, outfile = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # not retried until the file changes or the watch is restarted
+                        failed.add((infile, json.dumps(sig)))
+                        catalog.record(infile, sig, error='%s: %s' % (type(e).__name__, e))
+                        print('FAILED %s: %s' % (os.path.basename(infile), e))
+                        continue
+                    catalog.record(infile, sig, result['summary'], seconds=round(result['seconds'], 3), outputs=result['outputs'])
+                    if outfile is not None:
+                        manifest.record(outfile, infile, rhash, seconds=round(result['seconds'], 3))
+                    print('%s ingested (%.2f s)' % (os.path.basename(infile), result['seconds']))
+                    ingested.append(infile)
+                # GPS positions go into the spatial index once per poll, not once per file
+                if ingested and index.update(ingested):
+                    index.save(index_path)
+                if not running:
+                    time.sleep(args.interval)
+        except KeyboardInterrupt:
+            print('stopping; waiting for %d file(s) in progress' % len(running))
+            return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='batch.py', description='Process DZT files without the GUI.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    render = commands.add_parser('render', help='save a quick-look image of every file')
+    render.add_argument('inputs', nargs='+', help='directories and/or glob patterns of DZT files')
+    render.add_argument('-r', '--recipe', help='filter recipe saved from the GUI (default: no filters)')
+    render.add_argument('-o', '--out', default='quicklook', help='output directory (default: %(default)s)')
+    render.add_argument('-f', '--format', default='png', choices=('png', 'jpg', 'pdf', 'svg'), help='image format (default: %(default)s)')
+    render.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    render.add_argument('--width', type=float, default=12, help='figure width in inches (default: %(default)s)')
+    render.add_argument('--height', type=float, default=4, help='figure height in inches (default: %(default)s)')
+    render.add_argument('--dpi', type=int, default=150, help='dots per inch (default: %(default)s)')
+    render.add_argument('--force', action='store_true', help='render even if the output is up to date')
+    render.set_defaults(func=cmd_render)
+
+    process = commands.add_parser('process', help='filter every file and export the result')
+    process.add_argument('inputs', nargs='+', help='directories and/or glob patterns of DZT files')
+    process.add_argument('-r', '--recipe', help='filter recipe saved from the GUI (default: no filters)')
+    process.add_argument('-o', '--out', default='processed', help='output directory (default: %(default)s)')
+    process.add_argument('-f', '--format', default='hdf5', choices=sorted(EXPORTS), help='export format (default: %(default)s)')
+    process.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    process.add_argument('--force', action='store_true', help='process even if the output is up to date')
+    process.set_defaults(func=cmd_process)
+
+    watch = commands.add_parser('watch', help='ingest new and changed files as they arrive')
+    watch.add_argument('inputs', nargs='+', help='directories and/or glob patterns of DZT files to watch')
+    watch.add_argument('-r', '--recipe', help='filter recipe to process each file with (default: only catalog and cache)')
+    watch.add_argument('-o', '--out', default='processed', help='output directory for processed files, the catalog and the spatial index (default: %(default)s)')
+    watch.add_argument('-f', '--format', default='hdf5', choices=sorted(EXPORTS), help='export format with a recipe (default: %(default)s)')
+    watch.add_argument('-j', '--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2), help='worker processes (default: half the CPUs, %(default)s here)')
+    watch.add_argument('--catalog', default=None, help='catalog database (default: catalog.sqlite in the output directory)')
+    watch.add_argument('--interval', type=float, default=5, help='seconds between polls (default: %(default)s)')
+    watch.add_argument('--settle', type=float, default=10, help='seconds a file must stay unchanged before it is ingested (default: %(default)s)')
+    watch.add_argument('--once', action='store_true', help='exit once every file present is ingested')
+    watch.set_defaults(func=cmd_watch)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
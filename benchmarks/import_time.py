@@ -0,0 +1,96 @@
+"""
+Import-time report and regression guard.
+
+Imports each module in a fresh interpreter with ``python -X importtime``,
+prints the slowest imports it pulled in, and exits non-zero if any module
+takes longer than its budget. Run from anywhere:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py backend --budget backend=250 --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# milliseconds, best of --repeat runs; the GUI figure is dominated by Qt and matplotlib
+BUDGETS = {
+    'dzt_visualizer': 1500,
+    'backend': 400,
+    'batch': 150,
+}
+
+
+def import_times(module, extra_path=()):
+    """
+    Import a module in a new interpreter and parse the :code:`-X importtime` report.
+
+    :param str module: The module to import
+    :param list extra_path: Directories to put on PYTHONPATH ahead of the repository root
+    :rtype: list of (self ms, cumulative ms, depth, name) tuples, in import order
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(list(extra_path) + [ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('importing %s failed:\n%s' % (module, proc.stderr.strip().splitlines()[-1]))
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(own) / 1000., int(cumulative) / 1000., depth, name.strip()))
+    return rows
+
+
+def total(rows, module):
+    # cumulative time of the requested module, the last top-level entry with its name
+    return [r[1] for r in rows if r[3] == module][-1]
+
+
+def report(module, rows, top):
+    print('%s: %.0f ms' % (module, total(rows, module)))
+    print('    %9s %9s  %s' % ('self ms', 'cumul ms', 'module'))
+    for own, cumulative, depth, name in sorted(rows, key=lambda r: r[1], reverse=True)[:top]:
+        print('    %9.1f %9.1f  %s%s' % (own, cumulative, '  ' * (depth - 1), name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure module import times against a budget.')
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS), help='modules to import (default: %s)' % ', '.join(BUDGETS))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module; the fastest counts (default: %(default)s)')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list per module (default: %(default)s)')
+    parser.add_argument('--budget', action='append', default=[], metavar='MODULE=MS', help='override a budget in milliseconds')
+    parser.add_argument('--path', action='append', default=[], help='extra directory for PYTHONPATH, e.g. readgssi/ when it is not installed')
+    args = parser.parse_args(argv)
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        name, ms = item.split('=')
+        budgets[name] = float(ms)
+
+    over = []
+    for module in args.modules:
+        runs = [import_times(module, args.path) for _ in range(args.repeat)]
+        best = min(runs, key=lambda rows: total(rows, module))
+        report(module, best, args.top)
+        budget = budgets.get(module)
+        if budget is not None:
+            ms = total(best, module)
+            print('    budget %.0f ms: %s\n' % (budget, 'ok' if ms <= budget else 'OVER by %.0f ms' % (ms - budget)))
+            if ms > budget:
+                over.append(module)
+        else:
+            print('')
+    if over:
+        print('over budget: %s' % ', '.join(over))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+Peak-memory accounting for the processing pipeline.
+
+Runs the GUI's pipeline on one file (a synthetic tier or a DZT of your own):
+read, the filter chain, display preparation and each export. For every stage
+it reports:
+
+* the peak of memory traced by tracemalloc above the stage's start, which
+  includes every NumPy array (temporaries too), and that peak as a number of
+  full-size copies of the stage's input
+* the memory still held when the stage ends, with the array allocation sites
+  responsible (file:line, count, bytes)
+* the peak resident set size, sampled from a background thread, which also
+  sees memory allocated outside Python (HDF5, Qt)
+
+Results can be saved as a baseline and later runs compared against it; a
+stage whose peak grows by more than the tolerance is flagged and the exit
+status is 1. Run from anywhere:
+
+    python benchmarks/memory_profile.py --tier medium --filters bgr agc --save-baseline mem.json
+    python benchmarks/memory_profile.py --tier medium --filters bgr agc --baseline mem.json
+    python benchmarks/memory_profile.py --file LINE.DZT --recipe agc.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+import run_benchmarks
+import synthetic
+
+MIN_BLOCK = 2**20 # allocations smaller than this are not listed by site
+RSS_INTERVAL = 0.002 # seconds between RSS samples
+TOLERANCE = 0.10 # relative growth of a peak that counts as a regression
+TOLERANCE_BYTES = 2**20 # ...as long as it is also at least this many bytes
+
+
+#------------- RESIDENT MEMORY ------------------#
+def rss_bytes():
+    """
+    Current resident set size of this process, or None where it can't be read.
+
+    :rtype: int
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class RSSSampler(object):
+    """
+    Samples the resident set size from a background thread and keeps the maximum. Use as a context manager around a stage.
+
+    :param float interval: Seconds between samples
+    """
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.start = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = rss_bytes()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._sample()
+
+
+#------------- TRACED ALLOCATIONS ------------------#
+def array_snapshot():
+    """
+    Snapshot of the live NumPy array buffers.
+
+    :rtype: :py:class:`tracemalloc.Snapshot`
+    """
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+
+
+def allocation_sites(before, after, min_block=MIN_BLOCK):
+    """
+    Array allocations made between two snapshots and still alive, grouped by the line that made them.
+
+    :param tracemalloc.Snapshot before: Snapshot at the start of the stage
+    :param tracemalloc.Snapshot after: Snapshot at the end
+    :param int min_block: Sites allocating less than this in total are left out
+    :rtype: list of dict, largest first
+    """
+    sites = []
+    for stat in after.compare_to(before, 'lineno'):
+        if stat.size_diff < min_block:
+            continue
+        frame = stat.traceback[0]
+        sites.append({'site': '%s:%d' % (os.path.relpath(frame.filename, synthetic.ROOT) if frame.filename.startswith(synthetic.ROOT) else frame.filename, frame.lineno),
+                      'count': stat.count_diff, 'bytes': stat.size_diff})
+    return sites
+
+
+def profile_stage(name, setup, run, input_bytes, trace=True, min_block=MIN_BLOCK):
+    """
+    Run one stage and account for its memory.
+
+    :param str name: The stage name
+    :param callable setup: Called before the stage (not measured); its result is passed to :code:`run` as arguments. None for no setup.
+    :param callable run: The stage
+    :param int input_bytes: Size of the stage's input, to express the peak as full-size copies
+    :param bool trace: Whether tracemalloc is running
+    :param int min_block: Smallest allocation site listed
+    :rtype: the record (dict), the stage's result
+    """
+    args = setup() if setup is not None else ()
+    gc.collect()
+    if trace:
+        before = array_snapshot()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with RSSSampler() as rss:
+        result = run(*args)
+    seconds = time.perf_counter() - start
+    record = {'stage': name, 'seconds': round(seconds, 4), 'input_bytes': int(input_bytes)}
+    if rss.start is not None:
+        record.update({'rss_start': rss.start, 'rss_peak': rss.peak, 'rss_growth': rss.peak - rss.start})
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        record.update({
+            'traced_peak': peak - base,
+            'traced_retained': current - base,
+            'copies_at_peak': round((peak - base) / input_bytes, 2) if input_bytes else None,
+            'allocations': allocation_sites(before, array_snapshot(), min_block=min_block),
+        })
+    return record, result
+
+
+#------------- PIPELINE ------------------#
+def filter_chain(names, recipe=None):
+    """
+    The filter chain to profile, from a recipe file or from the short names in :py:data:`run_benchmarks.FILTERS`.
+
+    :rtype: :py:class:`collections.OrderedDict`
+    """
+    import collections
+    if recipe:
+        from recipes import load_recipe, recipe_filters
+        return recipe_filters(load_recipe(recipe))
+    known = {short: (name, params) for short, name, params in run_benchmarks.FILTERS}
+    unknown = [n for n in names if n not in known]
+    if unknown:
+        raise ValueError('unknown filter(s) %s (choose from %s)' % (', '.join(unknown), ', '.join(known)))
+    return collections.OrderedDict(known[n] for n in names)
+
+
+def warm_up(path, filters):
+    """
+    Import everything the pipeline uses and compile the filter kernels on a few traces, so one-time costs (module imports, numba compilation) don't count against the first stage that hits them.
+
+    :param str path: The DZT file
+    :param dict filters: The filter chain
+    """
+    import copy
+    from readgssi.dzt import readdzt
+    from backend import dzt_filters
+    header, ar, gps = readdzt(path, num_scans=64)
+    dzt_filters([ar[:header['rh_nsamp']].copy()], [copy.deepcopy(header)], filters)
+    run_benchmarks.display_stages(ar[:header['rh_nsamp']])
+
+
+def profile_pipeline(path, filters, exports, trace=True, split=False, min_block=MIN_BLOCK):
+    """
+    Profile the GUI's pipeline on one file: read with :py:func:`backend.dzt_func`, the filter chain with :py:func:`backend.dzt_filters` (as one stage, the way the GUI runs it, or one stage per filter with :code:`split`), display preparation, and each export format. The output of each stage is kept alive while the next runs, as it is in the GUI.
+
+    :param str path: The DZT file
+    :param dict filters: The filter chain
+    :param list exports: Export format names (see :py:func:`run_benchmarks.export_stages`)
+    :param bool trace: Whether tracemalloc is running
+    :param bool split: Profile each filter as its own stage
+    :param int min_block: Smallest allocation site listed
+    :rtype: list of dict
+    """
+    from backend import dzt_func, dzt_filters
+    records = []
+
+    def stage(name, setup, run, input_bytes):
+        record, result = profile_stage(name, setup, run, input_bytes, trace=trace, min_block=min_block)
+        records.append(record)
+        report(record)
+        return result
+
+    data, headers = stage('read', None, lambda: dzt_func([path]), os.path.getsize(path))
+    orig = data[0]
+    # the GUI filters a new list holding the original arrays, which stay referenced
+    data = list(data)
+    chains = [(f, {f: filters[f]}) for f in filters] if split else ([('chain', filters)] if filters else [])
+    for name, chain in chains:
+        nbytes = data[0].nbytes
+        data = stage('filter.' + name, None, lambda chain=chain: dzt_filters(data, headers, chain), nbytes)
+    ar, header = data[0], headers[0]
+    keep = [orig, ar]
+    for name, setup, run, nbytes in run_benchmarks.display_stages(ar):
+        keep.append(stage(name, setup, run, nbytes))
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, setup, run, nbytes in run_benchmarks.export_stages(ar, header, out_dir):
+            if name.split('.', 1)[1] in exports:
+                stage(name, setup, run, nbytes)
+    del keep
+    return records
+
+
+#------------- REPORTING ------------------#
+def mb(n):
+    return '%.1f' % (n / 2**20) if n is not None else '-'
+
+
+def report(record):
+    print('  %-18s %7.2f s  traced peak %8s MB (%5s copies)  retained %8s MB  RSS peak %8s MB (+%s)'
+          % (record['stage'], record['seconds'], mb(record.get('traced_peak')), record.get('copies_at_peak', '-'),
+             mb(record.get('traced_retained')), mb(record.get('rss_peak')), mb(record.get('rss_growth'))))
+    for site in record.get('allocations', [])[:5]:
+        print('      %8s MB in %3d array(s) at %s' % (mb(site['bytes']), site['count'], site['site']))
+
+
+def compare(records, baseline, tolerance=TOLERANCE, tolerance_bytes=TOLERANCE_BYTES):
+    """
+    Flag stages whose traced peak (or, without tracemalloc, RSS growth) grew beyond the tolerance relative to a baseline.
+
+    :param list records: This run's stage records
+    :param dict baseline: A saved results file
+    :rtype: list of str (the regressed stages)
+    """
+    before = {r['stage']: r for r in baseline['stages']}
+    if baseline.get('settings', {}).get('input') != records_input(records):
+        print('\nWARNING: the baseline was measured on a different input; peaks scale with file size')
+    print('\ncompared with baseline (%s):' % baseline.get('time'))
+    regressed = []
+    for r in records:
+        old = before.get(r['stage'])
+        if old is None:
+            continue
+        key = 'traced_peak' if ('traced_peak' in r and 'traced_peak' in old) else 'rss_growth'
+        if (key not in r) or (key not in old):
+            continue
+        growth = r[key] - old[key]
+        bad = (growth > tolerance_bytes) and (growth > tolerance * max(old[key], 1))
+        if bad:
+            regressed.append(r['stage'])
+        print('  %-18s %-12s %9s MB -> %9s MB  %s' % (r['stage'], key, mb(old[key]), mb(r[key]), 'REGRESSION' if bad else 'ok'))
+    return regressed
+
+
+def records_input(records):
+    return records[0]['input_bytes'] if records else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report peak memory and array allocations per pipeline stage.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--tier', default='medium', choices=sorted(run_benchmarks.TIERS), help='synthetic file size (default: %(default)s)')
+    source.add_argument('--file', help='profile this DZT file instead of a synthetic one')
+    chain = parser.add_mutually_exclusive_group()
+    chain.add_argument('--filters', nargs='*', default=['bgr', 'triangular', 'agc'], metavar='NAME',
+                       help='filter chain by short name: %s (default: %%(default)s)' % ' '.join(s for s, n, p in run_benchmarks.FILTERS))
+    chain.add_argument('-r', '--recipe', help='take the filter chain from a recipe saved from the GUI')
+    parser.add_argument('--split', action='store_true', help='profile each filter as its own stage instead of the chain as the GUI runs it')
+    parser.add_argument('--exports', nargs='*', default=['png', 'hdf5', 'segy'], metavar='FORMAT',
+                        help='export formats to profile: png tiff csv hdf5 dzt segy (default: %(default)s; csv is slow under tracemalloc)')
+    parser.add_argument('--no-trace', action='store_true', help='RSS sampling only; much less overhead, no allocation sites')
+    parser.add_argument('--min-block', type=float, default=MIN_BLOCK / 2**20, help='smallest allocation site listed, in MB (default: %(default)s)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'gpr-benchmarks'), help='where synthetic files are kept (default: %(default)s)')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', metavar='JSON', help='write the results as a baseline')
+    parser.add_argument('--baseline', metavar='JSON', help='compare with a saved baseline and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='relative peak growth that counts as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.file:
+        path = args.file
+    else:
+        os.makedirs(args.data_dir, exist_ok=True)
+        path = run_benchmarks.tier_file(args.data_dir, args.tier, 16, 1, 0)
+    filters = filter_chain(args.filters, args.recipe)
+    trace = not args.no_trace
+    print('%s (%.1f MB), filters: %s' % (os.path.basename(path), os.path.getsize(path) / 2**20, ', '.join(filters) or 'none'))
+    warm_up(path, filters)
+    if trace:
+        tracemalloc.start()
+    records = profile_pipeline(path, filters, args.exports, trace=trace, split=args.split, min_block=int(args.min_block * 2**20))
+    if trace:
+        tracemalloc.stop()
+
+    results = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'environment': run_benchmarks.environment(),
+               'settings': {'input': records_input(records), 'file': os.path.basename(path), 'filters': list(filters.items()),
+                            'exports': args.exports, 'trace': trace, 'split': args.split},
+               'stages': records}
+    for out in (args.out, args.save_baseline):
+        if out:
+            with open(out, 'w') as f:
+                json.dump(results, f, indent=1)
+            print('results written to %s' % out)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(records, json.load(f), tolerance=args.tolerance)
+        if regressed:
+            print('memory regressions: %s' % ', '.join(regressed))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
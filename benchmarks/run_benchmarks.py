@@ -0,0 +1,284 @@
+"""
+Throughput benchmarks for reading, filtering, display preparation and export.
+
+Each size tier is a synthetic DZT file (see synthetic.py), generated once into
+the data directory and reused on later runs. Every stage is first run once
+as a warm-up, which pays for numba compilation, imports and cold caches and is
+recorded separately as cold_s. It is then run --repeat times and the fastest
+of those runs is reported as traces/s and MB/s of its input.
+Results are written as JSON, and a previous results file can be given to
+--compare to print the change per stage. Run from anywhere:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --tiers medium large --stages filter. --out after.json --compare before.json
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import synthetic
+
+ROOT = synthetic.ROOT
+
+TIERS = {
+    'small': {'traces': 2000, 'samples': 512},
+    'medium': {'traces': 20000, 'samples': 512},
+    'large': {'traces': 100000, 'samples': 1024},
+}
+DEFAULT_TIERS = ('small', 'medium')
+
+# filter stages with the GUI's default parameters, in the form backend.dzt_filters takes
+FILTERS = (
+    ('bgr', 'Horizontal background removal', ['window=100']),
+    ('triangular', 'Vertical triangular FIR bandpass', ['freqmin=100', 'freqmax=800']),
+    ('agc', 'Automatic gain control', ['window=25']),
+    ('despike', 'Median despike', ['window=5', 'threshold=5']),
+    ('timezero', 'Automatic time-zero', ['threshold=0', 'statics=0']),
+    ('fft', 'Fast Fourier Transform', True),
+)
+VIEW_PIXELS = 1600 # screen width for the viewport stage
+
+
+#------------- STAGES ------------------#
+def read_stages(path, nchan):
+    """
+    Stages that decode the file.
+
+    :rtype: list of (name, setup, run, input bytes) tuples
+    """
+    from readgssi.dzt import readdzt
+    from backend import dzt_func
+    nbytes = os.path.getsize(path)
+    stages = [('read.readdzt', None, lambda: readdzt(path), nbytes)]
+    if nchan == 1:
+        # the GUI's path, which also resolves antenna frequencies and time zero
+        stages.append(('read.dzt_func', None, lambda: dzt_func([path]), nbytes))
+    return stages
+
+
+def filter_stages(ar, header):
+    """
+    One stage per backend filter, each on a fresh copy of the unfiltered array and header.
+    """
+    from backend import dzt_filters
+    stages = []
+    for short, name, params in FILTERS:
+        setup = lambda: ([ar.copy()], [copy.deepcopy(header)])
+        run = lambda data, headers, name=name, params=params: dzt_filters(data, headers, {name: params})
+        stages.append(('filter.' + short, setup, run, ar.nbytes))
+    return stages
+
+
+def display_stages(ar):
+    """
+    What the viewer computes before the first frame: statistics, the display pyramid, and the colormapped tiles of the full-extent view (into an empty cache each run).
+    """
+    from pyramid import DisplayPyramid
+    from render import TileCache, TileRenderer
+    from stats import clim, display_stats
+    view = {}
+    def setup():
+        # built on first use, so runs that skip this stage don't pay for it
+        if not view:
+            view['pyramid'], view['clim'] = DisplayPyramid(ar), clim(display_stats(ar))
+        return view['pyramid'], view['clim']
+    viewport = lambda pyr, limits: TileRenderer(pyr, clim=limits, cache=TileCache()).viewport(0, ar.shape[1], VIEW_PIXELS)
+    return [
+        ('display.stats', None, lambda: display_stats(ar), ar.nbytes),
+        ('display.pyramid', None, lambda: DisplayPyramid(ar), ar.nbytes),
+        ('display.viewport', setup, viewport, ar.nbytes),
+    ]
+
+
+def export_stages(ar, header, out_dir):
+    """
+    One stage per export format, each writing into :code:`out_dir`. Stages return the file written so its size can be reported.
+    """
+    from export import export_image
+    from readgssi import translate
+    from stats import clim, display_stats
+    base = os.path.join(out_dir, 'bench')
+    limits = lambda: (clim(display_stats(ar)),)
+    exports = (
+        ('png', lambda lim: export_image(base + '.png', ar, lim), limits),
+        ('tiff', lambda lim: export_image(base + '.tiff', ar, lim), limits),
+        ('csv', lambda: translate.csv(ar, base), None),
+        ('hdf5', lambda: translate.h5(ar, base, header), None),
+        ('dzt', lambda: translate.dzt(ar, base, header), None),
+        ('segy', lambda: translate.segy(ar, base, header), None),
+    )
+    return [('export.' + fmt, setup, run, ar.nbytes) for fmt, run, setup in exports]
+
+
+#------------- TIMING ------------------#
+def measure(setup, run, repeat):
+    """
+    Time a stage. A warm-up run comes first and is timed on its own, so JIT compilation and first-use imports don't count against the stage.
+
+    :param callable setup: Called before each run (untimed); its result is passed to :code:`run` as arguments. None for no setup.
+    :param callable run: The stage
+    :param int repeat: Number of runs after the warm-up
+    :rtype: warm-up time in seconds, run times in seconds (list), result of the last run
+    """
+    times = []
+    result = None
+    for _ in range(repeat + 1):
+        args = setup() if setup is not None else ()
+        # readgssi reports progress on stdout; keep it out of the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = run(*args)
+            times.append(time.perf_counter() - start)
+        del args
+    return times[0], times[1:], result
+
+
+def run_stage(tier, name, setup, run, nbytes, ntraces, repeat):
+    """
+    Time one stage and summarize it as a result record. Stages whose optional dependency is missing are recorded as skipped.
+
+    :rtype: dict
+    """
+    record = {'tier': tier, 'stage': name, 'traces': ntraces, 'input_bytes': int(nbytes)}
+    try:
+        cold, times, result = measure(setup, run, repeat)
+    except ImportError as e:
+        record['skipped'] = str(e)
+        print('  %-20s skipped (%s)' % (name, e))
+        return record
+    best = min(times)
+    record.update({
+        'best_s': round(best, 6),
+        'median_s': round(float(np.median(times)), 6),
+        'runs': len(times),
+        'cold_s': round(cold, 6),
+        'traces_per_s': round(ntraces / best, 1),
+        'mb_per_s': round(nbytes / best / 2**20, 2),
+    })
+    if isinstance(result, str) and os.path.isfile(result):
+        record['output_bytes'] = os.path.getsize(result)
+    print('  %-20s %9.4f s %12.0f traces/s %9.1f MB/s  (cold %.4f s)' % (name, best, record['traces_per_s'], record['mb_per_s'], cold))
+    return record
+
+
+def tier_file(data_dir, tier, bits, nchan, seed):
+    """
+    The synthetic file of a tier, generated if it is not in :code:`data_dir` yet.
+
+    :rtype: str
+    """
+    spec = TIERS[tier]
+    path = os.path.join(data_dir, 'synthetic_%s_%dx%d_%db_%dch_s%d.dzt' % (tier, spec['samples'], spec['traces'], bits, nchan, seed))
+    if not os.path.isfile(path):
+        print('generating %s' % os.path.basename(path))
+        synthetic.write_synthetic(path, ntraces=spec['traces'], nsamp=spec['samples'], nchan=nchan, bits=bits, seed=seed)
+    return path
+
+
+def run_tier(tier, path, nchan, repeat, selected, out_dir):
+    """
+    Run every selected stage of a tier.
+
+    :param list selected: Stage name prefixes to run; empty for all
+    :rtype: list of dict
+    """
+    from readgssi.dzt import readdzt
+    header, raw, gps = readdzt(path)
+    ar = np.ascontiguousarray(raw[:header['rh_nsamp']]) # the first channel
+    header = dict(header, rh_nchan=1)
+    ntraces = ar.shape[1]
+    stages = (read_stages(path, nchan) + filter_stages(ar, header) + display_stages(ar)
+              + export_stages(ar, header, out_dir))
+    print('%s: %d traces x %d samples, %d channel(s), %.1f MB' % (tier, ntraces, ar.shape[0], nchan, os.path.getsize(path) / 2**20))
+    results = []
+    for name, setup, run, nbytes in stages:
+        if selected and not any(name.startswith(s) for s in selected):
+            continue
+        results.append(run_stage(tier, name, setup, run, nbytes, ntraces, repeat))
+    return results
+
+
+#------------- RESULTS ------------------#
+def environment():
+    """
+    Where the numbers were measured, so runs can be compared fairly.
+
+    :rtype: dict
+    """
+    import kernels
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'kernels': kernels.get_backend(),
+    }
+
+
+def compare(results, baseline):
+    """
+    Print the speed of each stage relative to a previous run (above 1 is faster).
+
+    :param list results: This run's result records
+    :param dict baseline: A previous results file
+    """
+    before = {(r['tier'], r['stage']): r for r in baseline['results'] if 'best_s' in r}
+    print('\ncompared with %s (%s):' % (baseline['environment'].get('commit'), baseline['environment'].get('time')))
+    for r in results:
+        old = before.get((r['tier'], r['stage']))
+        if (old is None) or ('best_s' not in r):
+            continue
+        print('  %-7s %-20s %9.4f s -> %9.4f s  x%.2f' % (r['tier'], r['stage'], old['best_s'], r['best_s'], old['best_s'] / r['best_s']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark reading, filtering, display preparation and export on synthetic DZT files.')
+    parser.add_argument('--tiers', nargs='+', default=list(DEFAULT_TIERS), choices=sorted(TIERS), help='size tiers (default: %s)' % ' '.join(DEFAULT_TIERS))
+    parser.add_argument('--stages', nargs='+', default=[], metavar='PREFIX', help='only run stages starting with these, e.g. read. filter.bgr export.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage after the warm-up; the fastest counts (default: %(default)s)')
+    parser.add_argument('--bits', type=int, default=16, choices=sorted(synthetic.DTYPES), help='bits per sample of the files (default: %(default)s)')
+    parser.add_argument('--channels', type=int, default=1, help='channels in the files; stages after reading use the first (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the files (default: %(default)s)')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'gpr-benchmarks'), help='where synthetic files are kept between runs (default: %(default)s)')
+    parser.add_argument('--out', default=None, help='results file (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', default=None, metavar='JSON', help='previous results file to compare with')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    env = environment()
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for tier in args.tiers:
+            path = tier_file(args.data_dir, tier, args.bits, args.channels, args.seed)
+            results.extend(run_tier(tier, path, args.channels, args.repeat, args.stages, out_dir))
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', env['time'].replace(':', '') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'environment': env, 'settings': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+                   'results': results}, f, indent=1)
+    print('\nresults written to %s' % out)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
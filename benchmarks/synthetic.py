@@ -0,0 +1,250 @@
+"""
+Synthetic DZT files for benchmarks.
+
+Writes RADAN-format files of any size, bit depth and channel count that
+readgssi reads like field data: a direct wave at time zero, a few undulating
+reflectors, point-diffractor hyperbolas, attenuation with depth, random noise
+and the odd spike. Traces are generated and written a block at a time, so a
+file of any length costs one block of memory. Run from anywhere:
+
+    python benchmarks/synthetic.py line.dzt --traces 20000 --samples 512
+    python benchmarks/synthetic.py twochan.dzt --channels 2 --bits 32
+"""
+import argparse
+import os
+import struct
+import sys
+from datetime import datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in (ROOT, os.path.join(ROOT, 'readgssi')):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+BLOCK = 4096 # traces generated and written at a time
+DTYPES = {8: np.uint8, 16: np.uint16, 32: np.int32}
+# peak amplitude of the scaled data, leaving headroom below the type's limit
+FULL_SCALE = {8: 100, 16: 25000, 32: 2**24}
+
+
+#------------- HEADER ------------------#
+def synthetic_header(nsamp=512, nchan=1, bits=16, range_ns=50., spm=50., sps=64., epsr=9., antenna='50400S'):
+    """
+    Header dictionary with every field :py:func:`readgssi.translate.dzt_header` packs.
+
+    :param int nsamp: Samples per trace per channel
+    :param int nchan: Number of channels
+    :param int bits: Bits per sample: 8, 16 or 32
+    :param float range_ns: Time range of a trace in nanoseconds
+    :param float spm: Traces per metre
+    :param float sps: Traces per second
+    :param float epsr: Relative permittivity
+    :param str antenna: Antenna name, as in :py:data:`readgssi.constants.ANT`
+    :rtype: dict
+    """
+    from readgssi.constants import MINHEADSIZE, INFOAREASIZE, RGPSSIZE
+    if bits not in DTYPES:
+        raise ValueError('bits must be one of %s' % ', '.join(str(b) for b in DTYPES))
+    depth = range_ns * 1e-9 * 299792458 / np.sqrt(epsr) / 2
+    return {
+        'rh_tag': 0x00ff, 'rh_data': MINHEADSIZE * nchan, 'rh_nsamp': nsamp, 'rh_bits': bits,
+        'rh_zero': nsamp // 20, # time-zero sample; the direct wave starts here
+        'rhf_sps': sps, 'rhf_spm': spm, 'rhf_mpm': 0., 'rhf_position': 0., 'rhf_range': range_ns,
+        'rh_npass': 0, 'rhb_cdt': datetime(2020, 6, 1, 12, 0, 0),
+        'rh_rgain': 0, 'rh_nrgain': 0, 'rh_text': 0, 'rh_ntext': 0, 'rh_proc': 0, 'rh_nproc': 0,
+        'rh_nchan': nchan, 'rhf_epsr': epsr, 'rhf_top': 0., 'rhf_depth': depth,
+        'rh_xstart': 0., 'rh_xend': 0., 'rhf_servo_level': 0.,
+        'rh_accomp': 0, 'rh_sconfig': 0, 'rh_spp': 0, 'rh_linenum': 0, 'rh_ystart': 0., 'rh_yend': 0.,
+        'rh_96': b'\x00', 'rh_dtype': b'\x00', 'rh_112': b'\x00', 'vsbyte': b'\x00',
+        'dzt_ant': [antenna.encode('ascii').ljust(14, b'\x00')[:14]] * nchan,
+        'rh_name': bytes(12), 'rh_chksum': bytes(2),
+        'INFOAREA': bytes(INFOAREASIZE), 'rh_RGPS0': bytes(RGPSSIZE), 'rh_RGPS1': bytes(RGPSSIZE),
+        'header_extra': b'',
+    }
+
+
+def pack_header(header):
+    """
+    The binary header of every channel, with the sample size set from :code:`header['rh_bits']`.
+
+    :param dict header: The header from :py:func:`synthetic_header`
+    :rtype: bytes
+    """
+    from readgssi.translate import dzt_header
+    chans = bytearray()
+    for chan in range(header['rh_nchan']):
+        packed = bytearray(dzt_header(header, chan, header['rh_nsamp']))
+        # dzt_header always declares 32-bit samples
+        struct.pack_into('<h', packed, 6, header['rh_bits'])
+        chans += packed
+    return bytes(chans)
+
+
+#------------- SIGNAL MODEL ------------------#
+def make_model(ntraces, header, seed=0, noise=0.02, spikes=1e-5):
+    """
+    Draw the subsurface of a line: reflector shapes and diffractor positions.
+
+    :param int ntraces: Number of traces in the line
+    :param dict header: The file header
+    :param int seed: Random seed; the same seed gives the same file
+    :param float noise: Standard deviation of the random noise, as a fraction of full scale
+    :param float spikes: Fraction of samples hit by a spike
+    :rtype: dict
+    """
+    from readgssi.constants import ANT
+    rng = np.random.default_rng(seed)
+    range_ns = header['rhf_range']
+    freq_mhz = ANT.get(header['dzt_ant'][0].rstrip(b'\x00').decode('ascii'))
+    if not isinstance(freq_mhz, (int, float)):
+        freq_mhz = 400 # unknown or adjustable antennas
+    nlayers = 3
+    ndiff = max(1, ntraces // 250)
+    return {
+        'seed': seed,
+        'freq_ghz': freq_mhz / 1000.,
+        # centre of the direct wave, a period below the recorded time zero
+        'timezero': header['rh_zero'] * range_ns / header['rh_nsamp'] + 1000. / freq_mhz,
+        'velocity': 0.2998 / np.sqrt(header['rhf_epsr']), # m/ns
+        # reflectors: mean two-way time, undulation amplitude (ns), period (traces), phase, reflectivity
+        'layers': np.column_stack([np.sort(rng.uniform(0.2, 0.8, nlayers)) * range_ns,
+                                   rng.uniform(0.5, 3, nlayers), rng.uniform(300, 3000, nlayers),
+                                   rng.uniform(0, 2 * np.pi, nlayers), rng.uniform(-0.5, 0.5, nlayers)]),
+        # diffractors: trace, apex two-way time (ns), amplitude
+        'diffractors': np.column_stack([rng.uniform(0, ntraces, ndiff), rng.uniform(0.15, 0.9, ndiff) * range_ns,
+                                        rng.uniform(0.2, 0.6, ndiff) * rng.choice([-1, 1], ndiff)]),
+        'attenuation': 3. / range_ns, # per ns: the bottom of the trace is e**-3 weaker
+        'noise': noise,
+        'spikes': spikes,
+    }
+
+
+def ricker(t, freq):
+    """
+    Ricker wavelet.
+
+    :param numpy.ndarray t: Time in nanoseconds from the wavelet centre
+    :param float freq: Peak frequency in GHz
+    :rtype: numpy.ndarray
+    """
+    a = (np.pi * freq * t) ** 2
+    return (1 - 2 * a) * np.exp(-a)
+
+
+def add_events(block, arrivals, amplitudes, dt, freq):
+    """
+    Add one event to a block of traces: a wavelet centred on each trace's arrival time. Only the samples the wavelet covers are computed.
+
+    :param numpy.ndarray block: Block of traces (samples x traces), added to in place
+    :param numpy.ndarray arrivals: Arrival time for each trace, in nanoseconds
+    :param amplitudes: Amplitude for each trace (or one for all)
+    :param float dt: Sample interval in nanoseconds
+    :param float freq: Peak frequency in GHz
+    """
+    half = int(np.ceil(1.5 / freq / dt)) # the wavelet is negligible beyond 1.5 periods
+    k = np.arange(-half, half + 1)[:, None]
+    centre = np.rint(arrivals / dt).astype(np.int64)
+    rows = centre[None, :] + k
+    values = ricker((rows * dt) - arrivals[None, :], freq) * amplitudes
+    cols = np.broadcast_to(np.arange(block.shape[1]), rows.shape)
+    keep = (rows >= 0) & (rows < block.shape[0])
+    # each (row, col) appears once per event, so a fancy-index add is exact
+    block[rows[keep], cols[keep]] += values[keep]
+
+
+def render_traces(model, header, a, b, chan=0):
+    """
+    Traces :code:`a` to :code:`b` of one channel, in the range -1 to 1.
+
+    :param dict model: The model from :py:func:`make_model`
+    :param dict header: The file header
+    :param int a: First trace
+    :param int b: Last trace (exclusive)
+    :param int chan: Channel number; each channel gets its own noise
+    :rtype: :py:class:`numpy.ndarray` (samples x traces, float64)
+    """
+    nsamp = header['rh_nsamp']
+    dt = header['rhf_range'] / nsamp
+    freq = model['freq_ghz']
+    x = np.arange(a, b, dtype=np.float64)
+    block = np.zeros((nsamp, b - a))
+    # direct wave, wobbling a little with antenna height
+    add_events(block, model['timezero'] + 0.2 * np.sin(x / 150.), 1.0, dt, freq)
+    for t0, amp, period, phase, refl in model['layers']:
+        add_events(block, t0 + amp * np.sin(2 * np.pi * x / period + phase), refl, dt, freq)
+    # hyperbolas within the aperture of this block
+    aperture = header['rhf_range'] * model['velocity'] / 2 * header['rhf_spm']
+    for x0, t0, amp in model['diffractors']:
+        if (x0 + aperture < a) or (x0 - aperture > b):
+            continue
+        offset = (x - x0) / header['rhf_spm'] # metres
+        arrivals = np.sqrt(t0 ** 2 + (2 * offset / model['velocity']) ** 2)
+        add_events(block, arrivals, amp * t0 / arrivals, dt, freq)
+    t = np.arange(nsamp) * dt
+    block *= np.exp(-model['attenuation'] * np.maximum(t - model['timezero'], 0))[:, None]
+    # noise and spikes depend on the block and channel, so any block can be made on its own
+    rng = np.random.default_rng([model['seed'], chan, a])
+    block += rng.normal(0, model['noise'], block.shape)
+    nspikes = rng.binomial(block.size, model['spikes'])
+    block.flat[rng.integers(0, block.size, nspikes)] += rng.choice([-1, 1], nspikes) * 0.9
+    return block
+
+
+def scale(block, bits):
+    """
+    Convert traces in the range -1 to 1 to the stored sample type, offset as the DZT unsigned types are.
+
+    :param numpy.ndarray block: Traces from :py:func:`render_traces`
+    :param int bits: Bits per sample
+    :rtype: numpy.ndarray
+    """
+    info = np.iinfo(DTYPES[bits])
+    offset = 0 if info.min < 0 else (info.max + 1) // 2
+    return np.clip(np.rint(block * FULL_SCALE[bits]) + offset, info.min, info.max).astype(DTYPES[bits])
+
+
+#------------- WRITING ------------------#
+def write_synthetic(path, ntraces=2000, nsamp=512, nchan=1, bits=16, seed=0, block=BLOCK, **header_kwargs):
+    """
+    Write a synthetic DZT file.
+
+    :param str path: Output file
+    :param int ntraces: Number of traces
+    :param int nsamp: Samples per trace per channel
+    :param int nchan: Number of channels
+    :param int bits: Bits per sample: 8, 16 or 32
+    :param int seed: Random seed
+    :param int block: Traces generated and written at a time
+    :param header_kwargs: Passed on to :py:func:`synthetic_header`
+    :rtype: str
+    """
+    header = synthetic_header(nsamp=nsamp, nchan=nchan, bits=bits, **header_kwargs)
+    model = make_model(ntraces, header, seed=seed)
+    with open(path, 'wb') as f:
+        f.write(pack_header(header))
+        for a in range(0, ntraces, block):
+            b = min(a + block, ntraces)
+            # one row per trace: every channel's samples in turn
+            rows = np.hstack([scale(render_traces(model, header, a, b, chan=c), bits).T for c in range(nchan)])
+            f.write(rows.tobytes())
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic DZT file.')
+    parser.add_argument('outfile', help='output DZT file')
+    parser.add_argument('--traces', type=int, default=2000, help='number of traces (default: %(default)s)')
+    parser.add_argument('--samples', type=int, default=512, help='samples per trace (default: %(default)s)')
+    parser.add_argument('--channels', type=int, default=1, help='number of channels (default: %(default)s)')
+    parser.add_argument('--bits', type=int, default=16, choices=sorted(DTYPES), help='bits per sample (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+    write_synthetic(args.outfile, ntraces=args.traces, nsamp=args.samples, nchan=args.channels, bits=args.bits, seed=args.seed)
+    print('%s: %d traces x %d samples x %d channel(s), %d-bit, %.1f MB'
+          % (args.outfile, args.traces, args.samples, args.channels, args.bits, os.path.getsize(args.outfile) / 2**20))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+# Catalog of ingested lines: one row per DZT with its header values, so a
+# survey can be listed and searched without opening any file. Kept in SQLite
+# (standard library) and written only by the process that runs the watch
+# command of batch.py.
+
+CATALOG = 'catalog.sqlite'
+
+COLUMNS = (
+    ('path', 'TEXT PRIMARY KEY'),
+    ('name', 'TEXT'),
+    ('signature', 'TEXT'), # see decoded.source_signature
+    ('status', 'TEXT'), # 'ok' or 'failed'
+    ('error', 'TEXT'),
+    ('ingested', 'TEXT'),
+    ('seconds', 'REAL'),
+    ('created', 'TEXT'),
+    ('system', 'INTEGER'),
+    ('antennas', 'TEXT'),
+    ('frequencies', 'TEXT'),
+    ('channels', 'INTEGER'),
+    ('samples', 'INTEGER'),
+    ('traces', 'INTEGER'),
+    ('bits', 'INTEGER'),
+    ('range_ns', 'REAL'),
+    ('epsr', 'REAL'),
+    ('spm', 'REAL'),
+    ('sps', 'REAL'),
+    ('duration_s', 'REAL'),
+    ('marks', 'INTEGER'),
+    ('has_dzx', 'INTEGER'),
+    ('has_dzg', 'INTEGER'),
+    ('outputs', 'TEXT'), # JSON list of files made from the line
+)
+
+
+def summarize(header):
+    """
+    The catalog values of a header.
+
+    :param dict header: The file header dictionary, as :py:func:`readgssi.readgssi.readgssi` returns it
+    :rtype: dict (JSON-serializable)
+    """
+    nchan = int(header['rh_nchan'])
+    created = header.get('rhb_cdt')
+    base = os.path.splitext(str(header.get('infile', '')))[0]
+    return {
+        'created': created.isoformat() if isinstance(created, datetime) else None,
+        'system': int(header['rh_system']),
+        'antennas': ', '.join(str(a) for a in header['rh_antname'][:nchan]),
+        'frequencies': ', '.join(str(f) for f in header['antfreq'][:nchan]),
+        'channels': nchan,
+        'samples': int(header['rh_nsamp']),
+        'traces': int(header['shape'][1]),
+        'bits': int(header['rh_bits']),
+        'range_ns': float(header['rhf_range']),
+        'epsr': float(header['rhf_epsr']),
+        'spm': float(header['rhf_spm']),
+        'sps': float(header['rhf_sps']),
+        'duration_s': float(header['sec']),
+        'marks': len(header['marks']),
+        'has_dzx': int(os.path.isfile(base + '.DZX')),
+        'has_dzg': int(os.path.isfile(base + '.DZG')),
+    }
+
+
+class Catalog(object):
+    """
+    The catalog database.
+
+    Usage: ::
+
+        with Catalog('survey/catalog.sqlite') as c:
+            for row in c.rows("status = 'ok' AND traces > ?", (10000,)):
+                print(row['name'], row['duration_s'])
+
+    :param str path: The database file, created if missing
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files (%s)' % ', '.join('%s %s' % c for c in COLUMNS))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def is_current(self, infile, signature):
+        """
+        Whether :code:`infile` was ingested successfully with the given source signature.
+
+        :rtype: bool
+        """
+        row = self.conn.execute('SELECT signature, status FROM files WHERE path = ?', (infile,)).fetchone()
+        return (row is not None) and (row['status'] == 'ok') and (json.loads(row['signature']) == signature)
+
+    def record(self, infile, signature, summary=None, seconds=None, outputs=None, error=None):
+        """
+        Add or replace the row of a file.
+
+        :param str infile: The DZT file location
+        :param list signature: Its source signature when it was ingested
+        :param dict summary: Header values from :py:func:`summarize`, or None if ingesting failed
+        :param float seconds: Time taken
+        :param list outputs: Files made from it
+        :param str error: What went wrong, or None
+        """
+        row = dict(summary or {})
+        row.update({
+            'path': infile,
+            'name': os.path.basename(infile),
+            'signature': json.dumps(signature),
+            'status': 'failed' if error else 'ok',
+            'error': error,
+            'ingested': datetime.now().isoformat(timespec='seconds'),
+            'seconds': seconds,
+            'outputs': json.dumps(outputs or []),
+        })
+        names = list(row)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO files (%s) VALUES (%s)' % (', '.join(names), ', '.join('?' * len(names))),
+                              [row[n] for n in names])
+
+    def rows(self, where=None, params=()):
+        """
+        Rows of the catalog, oldest line first.
+
+        :param str where: SQL condition, or None for every row
+        :param tuple params: Values for the condition's placeholders
+        :rtype: list of dict
+        """
+        query = 'SELECT * FROM files' + (' WHERE ' + where if where else '') + ' ORDER BY created, name'
+        return [dict(row) for row in self.conn.execute(query, params)]
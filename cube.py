@@ -0,0 +1,318 @@
+import json
+import os
+import tempfile
+import warnings
+import numpy as np
+import readgssi.functions as fx
+from backend import current_zero
+import instrument
+
+# 3-D survey cubes from grids of parallel lines, and horizontal slices through
+# them. Cubes are HDF5 files (h5py is imported when one is built or opened)
+# holding the amplitudes and their envelopes as float32 datasets ordered
+# (time, y, x) and chunked in thin slabs of time, so a slice reads only the
+# chunks of its time window.
+
+CUBE_EXT = '.cube.h5'
+CHUNK = (8, 64, 64) # time, y, x
+SLICE_MODES = ('instant', 'amplitude', 'envelope')
+C = 299792458. # speed of light in m/s
+
+
+def _h5py():
+    import h5py
+    return h5py
+
+
+#------------- PLACEMENT ------------------#
+def spacing_positions(data, headers, spacing, zigzag=False):
+    """
+    Trace positions of lines recorded at a fixed spacing: along each line from its distance calibration (:code:`rhf_spm`, traces per metre; trace numbers if it is unset), across the lines from the spacing.
+
+    :param list data: The line arrays, in survey order
+    :param list headers: The matching header dictionaries
+    :param float spacing: Distance between lines in metres
+    :param bool zigzag: Whether every other line was recorded in the opposite direction
+    :rtype: list of (u, v) position arrays in metres, one pair per line
+    """
+    positions = []
+    for i, (ar, header) in enumerate(zip(data, headers)):
+        ntr = ar.shape[1]
+        spm = float(header.get('rhf_spm') or 0) or 1.
+        u = np.arange(ntr) / spm
+        if zigzag and (i % 2):
+            u = u[::-1].copy()
+        positions.append((u, np.full(ntr, i * spacing)))
+    return positions
+
+
+def gps_positions(files, data):
+    """
+    Trace positions from the DZG of every line, interpolated between fixes by trace number and rotated so the first line runs along the x axis.
+
+    :param list files: The DZT file locations
+    :param list data: The matching line arrays
+    :rtype: list of (u, v) position arrays in metres, origin of the local plane (longitude, latitude), direction of the x axis (radians counterclockwise from east)
+    """
+    from spatial import dzg_path, local_xy, read_dzg
+    fixes = []
+    for infile in files:
+        f = read_dzg(dzg_path(infile)) if os.path.isfile(dzg_path(infile)) else []
+        if len(f) < 2:
+            raise ValueError('%s has no usable GPS (DZG) positions' % os.path.basename(infile))
+        fixes.append(f)
+    origin = (float(fixes[0]['longitude'][0]), float(fixes[0]['latitude'][0]))
+    xy = []
+    for f, ar in zip(fixes, data):
+        traces = np.arange(ar.shape[1])
+        x, y = local_xy(f['longitude'], f['latitude'], origin)
+        xy.append((np.interp(traces, f['trace'], x), np.interp(traces, f['trace'], y)))
+    x, y = xy[0]
+    angle = np.arctan2(y[-1] - y[0], x[-1] - x[0]) # direction of the first line
+    cos, sin = np.cos(angle), np.sin(angle)
+    positions = [(x * cos + y * sin, y * cos - x * sin) for x, y in xy]
+    u0 = min(u.min() for u, v in positions)
+    v0 = min(v.min() for u, v in positions)
+    return [(u - u0, v - v0) for u, v in positions], origin, float(angle)
+
+
+def resample_line(ar, u, v, gx):
+    """
+    Resample a line onto grid positions along x by linear interpolation between neighbouring traces, all samples at once.
+
+    :param numpy.ndarray ar: The line (samples x traces)
+    :param numpy.ndarray u: Position of each trace along x
+    :param numpy.ndarray v: Position of each trace along y
+    :param numpy.ndarray gx: Grid x positions
+    :rtype: values (x positions x samples, float32, NaN off the line), y position at each grid x (NaN off the line)
+    """
+    order = np.argsort(u, kind='stable')
+    us = u[order]
+    f = np.interp(gx, us, np.arange(len(us), dtype=float))
+    k0 = np.minimum(np.floor(f).astype(np.int64), len(us) - 1)
+    k1 = np.minimum(k0 + 1, len(us) - 1)
+    w = (f - k0).astype(np.float32)
+    c0, c1 = order[k0], order[k1]
+    values = ar[:, c0].T.astype(np.float32) * (1 - w)[:, None] + ar[:, c1].T.astype(np.float32) * w[:, None]
+    vy = v[c0] * (1 - w) + v[c1] * w
+    off = (gx < us[0]) | (gx > us[-1])
+    values[off] = np.nan
+    vy[off] = np.nan
+    return values, vy
+
+
+def line_weights(vlines, gy, max_gap):
+    """
+    For every grid cell, the two lines to interpolate between across y and the weight of the second, from the y position of each line at each grid x.
+
+    :param numpy.ndarray vlines: y position of each line at each grid x (lines x grid x), NaN where a line does not reach
+    :param numpy.ndarray gy: Grid y positions
+    :param float max_gap: Cells further than this from a line on either side are left empty
+    :rtype: first line, second line (int arrays, grid y x grid x), weight (float32), valid (bool)
+    """
+    nlines, nx = vlines.shape
+    i0 = np.zeros((len(gy), nx), dtype=np.int64)
+    i1 = np.zeros((len(gy), nx), dtype=np.int64)
+    w = np.zeros((len(gy), nx), dtype=np.float32)
+    valid = np.zeros((len(gy), nx), dtype=bool)
+    for ix in range(nx):
+        lines = np.flatnonzero(~np.isnan(vlines[:, ix]))
+        if not len(lines):
+            continue
+        lines = lines[np.argsort(vlines[lines, ix], kind='stable')]
+        v = vlines[lines, ix]
+        k = np.clip(np.searchsorted(v, gy), 1, max(len(v) - 1, 1))
+        a, b = lines[k - 1], lines[np.minimum(k, len(v) - 1)]
+        va, vb = v[k - 1], v[np.minimum(k, len(v) - 1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(vb > va, (gy - va) / (vb - va), 0.)
+        inside = (vb > va) & (t >= 0) & (t <= 1) & (vb - va <= max_gap)
+        # just beyond the outermost lines (or with a single line), take the nearest within half a gap
+        near_a = np.abs(gy - va) <= max_gap / 2
+        near_b = np.abs(gy - vb) <= max_gap / 2
+        t = np.where(inside, t, np.where(near_b & ~near_a, 1., 0.))
+        i0[:, ix], i1[:, ix], w[:, ix] = a, b, np.clip(t, 0, 1)
+        valid[:, ix] = inside | near_a | near_b
+    return i0, i1, w, valid
+
+
+#------------- BUILDING ------------------#
+def build_cube(outfile, data, headers, files=None, spacing=None, zigzag=False, gps=False, dx=None, dy=None,
+               max_gap=None, block=None, verbose=False):
+    """
+    Place the lines of a parallel-line survey on a regular x/y/time grid and write the cube to an HDF5 file.
+
+    Each line and its envelope are first resampled onto the grid x positions (into a temporary file, so memory holds one line at a time), then every block of grid rows is filled by interpolating across y between the two nearest lines at each x, and written. Cells further than :code:`max_gap` from a line are NaN. Lines are aligned on their time-zero samples (after any time-zero crop, see :py:func:`backend.current_zero`) and cut to the shortest. Multi-channel lines are refused.
+
+    :param str outfile: Output file (:py:data:`CUBE_EXT` is added if it has no .h5 extension)
+    :param list data: The line arrays (samples x traces), in survey order
+    :param list headers: The matching header dictionaries
+    :param list files: The DZT file locations, needed with :code:`gps=True` and recorded in the cube
+    :param float spacing: Line spacing in metres, for placement by spacing
+    :param bool zigzag: With spacing, whether every other line was recorded in the opposite direction
+    :param bool gps: Place traces from the DZG files instead, rotated so the first line runs along x
+    :param float dx: Grid step along the lines in metres. Defaults to None: the median trace spacing, but at least a fifth of :code:`dy`.
+    :param float dy: Grid step across the lines in metres. Defaults to None: the line spacing (median spacing with GPS).
+    :param float max_gap: Largest distance between lines to interpolate across. Defaults to None: twice the line spacing.
+    :param int block: Grid rows interpolated and written at a time. Defaults to None, which picks about 64 MB of cells per block.
+    :param bool verbose: Verbose, defaults to False
+    :rtype: str (the output file)
+    """
+    if not outfile.endswith('.h5'):
+        outfile += CUBE_EXT
+    for header in headers:
+        if int(header.get('rh_nchan') or 1) > 1:
+            # the channels are stacked one above the other in the array, and would be gridded as extra samples
+            raise ValueError('%s has %d channels; cubes are built from single-channel lines'
+                             % (os.path.basename(str(header.get('infile', 'a line'))), header['rh_nchan']))
+    files = list(files) if files is not None else [str(h.get('infile', '')) for h in headers]
+    origin, angle = None, 0.
+    if gps:
+        positions, origin, angle = gps_positions(files, data)
+    elif spacing:
+        positions = spacing_positions(data, headers, spacing, zigzag=zigzag)
+    else:
+        raise ValueError('give a line spacing or use GPS positions')
+    # lines are aligned on their time-zero samples, so lines cropped differently still line up in time
+    zeros = [current_zero(h) for h in headers]
+    zero = min(zeros)
+    offsets = [z - zero for z in zeros]
+    nt = min(ar.shape[0] - off for ar, off in zip(data, offsets))
+    line_v = np.array([np.median(v) for u, v in positions])
+    line_spacing = spacing if not gps else (float(np.median(np.diff(np.sort(line_v)))) if len(line_v) > 1 else 1.)
+    dy = dy or line_spacing
+    step = float(np.median(np.concatenate([np.hypot(np.diff(u), np.diff(v)) for u, v in positions if len(u) > 1])))
+    dx = dx or max(step, dy / 5.)
+    max_gap = max_gap or 2 * line_spacing
+    umax = max(u.max() for u, v in positions)
+    vmax = max(v.max() for u, v in positions)
+    gx = np.arange(0, umax + dx / 2, dx)
+    gy = np.arange(0, vmax + dy / 2, dy)
+    if block is None:
+        block = max(1, (64 * 2**20) // (len(gx) * nt * 4))
+    if verbose:
+        fx.printmsg('building a %d x %d x %d cube (time, y, x) from %d lines' % (nt, len(gy), len(gx), len(data)))
+
+    from scipy.signal import hilbert
+    shape = (len(data), len(gx), nt)
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(outfile))) as tmp:
+        # resampled lines and their envelopes, each stored x-major so the gather below reads whole traces
+        lines = np.memmap(tmp, dtype=np.float32, mode='w+', shape=(2,) + shape)
+        vlines = np.empty(shape[:2])
+        with instrument.stage('cube', 'resample', data, lines=len(data)):
+            for i, (ar, (u, v)) in enumerate(zip(data, positions)):
+                ar = np.asarray(ar[offsets[i]:offsets[i] + nt], dtype=np.float32)
+                lines[0, i], vlines[i] = resample_line(ar, u, v, gx)
+                # envelopes are taken along whole traces, before gridding, so slices need no transform
+                lines[1, i] = resample_line(np.abs(hilbert(ar, axis=0)).astype(np.float32), u, v, gx)[0]
+        i0, i1, w, valid = line_weights(vlines, gy, max_gap)
+        with instrument.stage('cube', 'grid', lines, shape=[nt, len(gy), len(gx)]) as s, _h5py().File(outfile, 'w') as f:
+            cols = np.arange(len(gx))[None, :]
+            for k, name in enumerate(('data', 'envelope')):
+                ds = f.create_dataset(name, shape=(nt, len(gy), len(gx)), dtype=np.float32,
+                                      chunks=tuple(min(c, n) for c, n in zip(CHUNK, (nt, len(gy), len(gx)))), fillvalue=np.nan)
+                for a in range(0, len(gy), block):
+                    b = min(a + block, len(gy))
+                    wb = w[a:b, :, None]
+                    cells = lines[k, i0[a:b], cols] * (1 - wb) + lines[k, i1[a:b], cols] * wb # (rows, x, time)
+                    cells[~valid[a:b]] = np.nan
+                    ds[:, a:b, :] = cells.transpose(2, 0, 1)
+            header = headers[0]
+            f.attrs['dx'], f.attrs['dy'] = dx, dy
+            f.attrs['dt'] = float(header['ns_per_zsample']) # seconds per sample
+            f.attrs['zero'] = zero
+            f.attrs['epsr'] = float(header.get('rhf_epsr') or 1.)
+            f.attrs['placement'] = 'gps' if gps else ('zigzag' if zigzag else 'spacing')
+            f.attrs['origin'] = json.dumps(origin)
+            f.attrs['angle'] = angle
+            f.attrs['files'] = json.dumps(files)
+            s.out(outfile)
+        del lines
+    return outfile
+
+
+#------------- SLICING ------------------#
+class Cube(object):
+    """
+    An opened cube. Slices are averaged over a time window, as raw values, mean absolute amplitude, or mean envelope (magnitude of the analytic signal, computed when the cube was built), and can be read at a stride for a quick look at large grids. Recent slices are kept, so going back and forth with a slider is free.
+
+    :param str path: The cube file
+    :param int cache: Slices kept
+    """
+    def __init__(self, path, cache=32):
+        self.path = path
+        self.file = _h5py().File(path, 'r')
+        self.data = self.file['data']
+        self.envelope = self.file['envelope']
+        self.nt, self.ny, self.nx = self.data.shape
+        self.dx, self.dy = float(self.file.attrs['dx']), float(self.file.attrs['dy'])
+        self.dt = float(self.file.attrs['dt'])
+        self.zero = int(self.file.attrs['zero'])
+        self.epsr = float(self.file.attrs['epsr'])
+        self.files = json.loads(self.file.attrs['files'])
+        self.cache = {}
+        self.cache_size = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def time_ns(self, sample):
+        """
+        Two-way travel time of a sample after time zero, in nanoseconds.
+        """
+        return (sample - self.zero) * self.dt * 1e9
+
+    def depth(self, sample):
+        """
+        Depth of a sample in metres, from the header's relative permittivity.
+        """
+        return (sample - self.zero) * self.dt * C / np.sqrt(self.epsr) / 2
+
+    def sample_at_depth(self, depth):
+        """
+        The sample nearest a depth in metres.
+
+        :rtype: int
+        """
+        return int(np.clip(round(self.zero + 2 * depth * np.sqrt(self.epsr) / (C * self.dt)), 0, self.nt - 1))
+
+    def extent(self):
+        """
+        Grid extent in metres for :py:meth:`matplotlib.axes.Axes.imshow` (left, right, bottom, top).
+        """
+        return (-self.dx / 2, (self.nx - 0.5) * self.dx, -self.dy / 2, (self.ny - 0.5) * self.dy)
+
+    def slice(self, sample, window=1, mode='amplitude', step=1):
+        """
+        A horizontal slice.
+
+        :param int sample: First sample of the time window
+        :param int window: Samples averaged
+        :param str mode: 'instant' (mean value), 'amplitude' (mean absolute value) or 'envelope' (mean envelope)
+        :param int step: Read every :code:`step`-th row and column only
+        :rtype: :py:class:`numpy.ndarray` (y x x, float32)
+        """
+        if mode not in SLICE_MODES:
+            raise ValueError('unknown slice mode "%s" (choose from %s)' % (mode, ', '.join(SLICE_MODES)))
+        a = int(np.clip(sample, 0, self.nt - 1))
+        b = min(self.nt, a + max(1, int(window)))
+        key = (a, b, mode, step)
+        if key in self.cache:
+            return self.cache[key]
+        values = (self.envelope if mode == 'envelope' else self.data)[a:b, ::step, ::step]
+        if mode == 'amplitude':
+            values = np.abs(values)
+        with warnings.catch_warnings():
+            # cells off the survey are NaN all the way down
+            warnings.simplefilter('ignore', RuntimeWarning)
+            result = np.nanmean(values, axis=0) if values.shape[0] > 1 else values[0]
+        if len(self.cache) >= self.cache_size:
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = result
+        return result
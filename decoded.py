@@ -0,0 +1,113 @@
+import json
+import os
+import numpy as np
+from readgssi.h5 import encode_header, decode_header
+
+# Decode cache: the samples of a DZT stored as a C-ordered .npy (samples x
+# traces, the layout the filters want) next to the file, with the full header in
+# a JSON sidecar. Opening a cached file memory-maps the .npy copy-on-write, so
+# nothing is read until it is drawn or filtered and in-place filters never
+# touch the cache. Written by the watch command of batch.py.
+
+DECODED_EXT = '.dec.npy'
+HEADER_EXT = '.dec.json'
+FORMAT_VERSION = 1 # bump when the layout below changes; older caches are then ignored
+BLOCK_TRACES = 16384 # traces copied at a time when writing
+
+
+#------------- SOURCE FILES ------------------#
+def companions(infile):
+    """
+    The files that make up a line: the DZT and its DZX (marks and picks) and DZG (GPS), whether or not they exist yet.
+
+    :param str infile: The DZT file location
+    :rtype: list of str
+    """
+    base = os.path.splitext(infile)[0]
+    return [infile, base + '.DZX', base + '.DZG']
+
+
+def source_signature(infile):
+    """
+    Size and modification time of a DZT and its DZX and DZG, so a change to any of them (e.g. a DZX copied after the DZT) is noticed.
+
+    :param str infile: The DZT file location
+    :rtype: list of [size, mtime_ns] pairs, None for a missing file
+    """
+    signature = []
+    for path in companions(infile):
+        try:
+            st = os.stat(path)
+        except OSError:
+            signature.append(None)
+        else:
+            signature.append([st.st_size, st.st_mtime_ns])
+    return signature
+
+
+def decoded_path(infile):
+    """
+    Location of the decode cache kept next to a DZT.
+
+    :param str infile: The DZT file location
+    :rtype: str
+    """
+    return infile + DECODED_EXT
+
+
+#------------- CACHE FILES ------------------#
+def write_decoded(infile, ar, header, block=BLOCK_TRACES):
+    """
+    Write the decode cache of a DZT. The array is copied into the .npy a block of traces at a time, so a transposed array is never copied whole in memory. Both files are written under temporary names and moved into place, the header last, so readers never see a partial cache.
+
+    :param str infile: The DZT file location
+    :param numpy.ndarray ar: The radar array, as :py:func:`readgssi.readgssi.readgssi` returns it
+    :param dict header: The matching header dictionary
+    :param int block: Traces copied at a time
+    :rtype: str (the .npy path)
+    """
+    path = decoded_path(infile)
+    tmp = path + '.tmp'
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=ar.dtype, shape=ar.shape)
+    for a in range(0, ar.shape[1], block):
+        out[:, a:a + block] = ar[:, a:a + block]
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'signature': source_signature(infile),
+        'shape': list(ar.shape),
+        'dtype': np.dtype(ar.dtype).str,
+        'header': encode_header(header),
+    }
+    tmp = infile + HEADER_EXT + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, infile + HEADER_EXT)
+    return path
+
+
+def open_decoded(infile):
+    """
+    Open the decode cache of a DZT if there is an up-to-date one.
+
+    :param str infile: The DZT file location
+    :rtype: radar array (copy-on-write :py:class:`numpy.memmap`), header (:py:class:`dict`); or None if there is no cache or it is out of date
+    """
+    path = decoded_path(infile)
+    try:
+        with open(infile + HEADER_EXT) as f:
+            meta = json.load(f)
+        if (meta.get('format_version') != FORMAT_VERSION) or (meta['signature'] != source_signature(infile)):
+            return None
+        ar = np.load(path, mmap_mode='c')
+    except (OSError, ValueError, KeyError):
+        return None
+    if (list(ar.shape) != meta['shape']) or (ar.dtype.str != meta['dtype']):
+        return None
+    header = decode_header(meta['header'])
+    header['shape'] = ar.shape # a tuple, as readdzt gives it; JSON has made it a list
+    # the cache may have been written through another mount of the same drive
+    header['infile'] = infile
+    return ar, header
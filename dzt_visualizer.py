@@ -1,16 +1,28 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
-from matplotlib import pyplot as plt
-from matplotlib import image
-from matplotlib import backend_bases as bb
-from mpl_toolkits import mplot3d
+from matplotlib.figure import Figure
+import collections
 import concurrent.futures
 import numpy as np
-import pandas as pd
 import os
 import time
+import copy
+import math
 from backend import dzt_func, dzt_filters
-from popupWindows import Export_Dialog, Alert_Dialog, Writing_Dialog
+from pyramid import DisplayPyramid
+from render import TileRenderer
+from stats import VersionedCache, display_stats, clim
+from export import export_image
+from plotting import setup_axes, profile_limits, view_extent
+from recipes import make_recipe, save_recipe
+import overview
+import instrument
+import spectral
+import server
+from popupWindows import Export_Dialog, Alert_Dialog, Writing_Dialog, Slice_Dialog
+
+# overview files for newly opened lines are written one at a time, off the GUI thread
+overview_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 
 #----------------------------------------------------------#
@@ -56,8 +68,12 @@ class data_tab(QtWidgets.QWidget):
         self.filter_param_list = {
             'Horizontal background removal' : [1, 'window='],
             'Vertical triangular FIR bandpass' : [1, 'freqmin=', 'freqmax='],
+            'Automatic time-zero' : [1, 'threshold=0', 'statics=0'],
+            'Automatic gain control' : [1, 'window=25'],
+            'Median despike' : [1, 'window=5', 'threshold=5'],
             'Fast Fourier Transform' : [0],
             'Hilbert Huang Transform' : [0], #['theta_1=', 'theta_2=', 'alpha=']
+            'EMD Hilbert Huang Transform' : [1, 'siftings=15', 'imfs=10'],
             'Wavelets' : [2, 'Haar', 'Daubechies', 'Symlets', 'Coiflets', 'Biorthogonal', 
                             'Reverse biorthogonal', 'Discrete FIR approximation of Meyer wavelet',
                             'Gaussian wavelets', 'Mexican hat wavelet', 'Morlet wavelet',
@@ -83,6 +99,9 @@ class data_tab(QtWidgets.QWidget):
         self.filter_desc = {
             'Horizontal background removal' : 'Subtracts off row averages for full-width or window-length slices.\n\n:window:\nwindow size - 0 defaults to full length slices',
             'Vertical triangular FIR bandpass' : 'Vertical bandpass filter based on weighted average using a triagular shaped weighting function.\n\n\:freqmin:\nThe lower corner of the bandpass\n:freqmax:\nThe upper corner of the bandpass',
+            'Automatic time-zero' : 'Picks the direct wave on every trace and removes the air gap above it.\n\n:threshold:\nfraction of the trace envelope maximum used as the first-break threshold - 0 picks the envelope peak\n:statics:\n1 aligns every trace to the median pick with fractional-sample shifts, 0 crops only',
+            'Automatic gain control' : 'Divides each sample by the mean absolute amplitude in a vertical window around it to balance weak late arrivals.\n\n:window:\nwindow length in samples',
+            'Median despike' : 'Replaces samples that stand out from a vertical running median by more than a robust threshold.\n\n:window:\nrunning median length in samples\n:threshold:\nrejection threshold in robust standard deviations',
             'Fast Fourier Transform' : 'Converts a signal from the time domain to the frequency domain.',
             'Hilbert Huang Transform' : 'A time series analysis technique which breaks a signal down into Intrinsic Mode Functions (IMFs) which are characterized by being narrowband, nearly monocomponent and having a large time-bandwidth product.\n\n',
                                         # investigate as to what these params do, currently there are default values used by the hht module
@@ -92,6 +111,7 @@ class data_tab(QtWidgets.QWidget):
                                         # Threshold for the stopping criterion\
                                         # :alpha: \n\
                                         # Tolerance for the stopping criterion'
+            'EMD Hilbert Huang Transform' : 'Replaces each trace by what is left after empirical mode decomposition removes its Intrinsic Mode Functions, then takes the real part of the 2-D Hilbert transform.\n\n:siftings:\nsifting iterations per IMF\n:imfs:\nmaximum number of IMFs removed',
             'Wavelets' : 'Computes the Discrete Wavelet Transform using the selected wavelet function\n\nPartial wavlet descriptions at:\nhttp://wavelets.pybytes.com/'
         }
         # check to see if the user actually selected files before attempting to build a tab and read the files
@@ -100,17 +120,42 @@ class data_tab(QtWidgets.QWidget):
 
     def _build_tab(self):
         print(self.files_paths)
-        a_dialog = Alert_Dialog(self)
-        a_dialog.show()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(dzt_func, self.files_paths)
-            self.orig_data_arrs, self.data_heads = future.result()
-        self.filtered_data_arrs = self.orig_data_arrs
-        a_dialog.done(0)
+        # bumped whenever the filtered arrays change, so cached display products are rebuilt
+        self.data_version = 0
+        self.pyramids = VersionedCache()
+        self.stats = VersionedCache()
+        self.spectra = VersionedCache()
+        self.spectrograms = VersionedCache()
+        self.renderers = {}
+        self.load_timer = None
+        # filter chains applied since the last reset, oldest first; stored with HDF5 exports
+        self.filter_history = []
+        self.overviews = [overview.open_overview(path) for path in self.files_paths]
+        # timings of the last action in this tab, shown in the "Last run" panel
+        self.last_run = None
+        self.load_run = instrument.run("Open Files")
+        # with a processing server running (see server.py), it decodes, filters and caches for this tab
+        self.server = server.connect()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.loader = executor.submit(self.load_run.bind(self.read_files), self.files_paths)
+        executor.shutdown(wait=False)
+        if all(self.overviews):
+            # draw from the overview files now; the samples are decoded in the background
+            self.orig_data_arrs = [None] * len(self.files_paths)
+            self.orig_data_heads = [ov.header for ov in self.overviews]
+            self.filtered_data_arrs = list(self.orig_data_arrs)
+            self.data_heads = copy.deepcopy(self.orig_data_heads)
+        else:
+            a_dialog = Alert_Dialog(self)
+            a_dialog.show()
+            self.wait_loaded()
+            a_dialog.done(0)
         self.setUpdatesEnabled(True)
         # #### Main window layout ####
-        self.horizontalLayout_2 = QtWidgets.QHBoxLayout(self)
+        self.tabLayout = QtWidgets.QVBoxLayout(self)
+        self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
+        self.tabLayout.addLayout(self.horizontalLayout_2, 1)
         # ==== Setion 1 layout ====
         self.verticalLayout = QtWidgets.QVBoxLayout()
         self.verticalLayout.setObjectName("verticalLayout")
@@ -190,6 +235,10 @@ class data_tab(QtWidgets.QWidget):
         self.applyButton.setObjectName("applyButton")    
         self.applyButton.setText("Apply Filters")
         self.verticalLayout_4.addWidget(self.applyButton)
+        # ---- Contrast selection ----
+        self.contrastBox = QtWidgets.QComboBox(self)
+        self.contrastBox.addItems(["Contrast: mean \u00b1 3\u03c3", "Contrast: 1-99 percentile"])
+        self.verticalLayout_4.addWidget(self.contrastBox)
         # ---- Show button ----
         self.showButton = QtWidgets.QPushButton(self, clicked=lambda: self.plot_figure(True))
         self.showButton.setObjectName("showButton")    
@@ -205,32 +254,97 @@ class data_tab(QtWidgets.QWidget):
         self.exportButton.clicked.connect(self.export_pressed)
         self.exportButton.setText("Export Data")
         self.verticalLayout_4.addWidget(self.exportButton)
+        # ---- Save recipe button ----
+        self.recipeButton = QtWidgets.QPushButton(self)
+        self.recipeButton.clicked.connect(self.save_recipe_pressed)
+        self.recipeButton.setText("Save Recipe")
+        self.verticalLayout_4.addWidget(self.recipeButton)
+        # ---- Build cube button ----
+        self.cubeButton = QtWidgets.QPushButton(self)
+        self.cubeButton.clicked.connect(self.cube_pressed)
+        self.cubeButton.setText("Build Cube")
+        self.verticalLayout_4.addWidget(self.cubeButton)
+        # ==== Plot area ====
+        self.figure = Figure()
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.canvas.setMinimumHeight(300)
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        self.tabLayout.addWidget(self.toolbar)
+        self.tabLayout.addWidget(self.canvas, 3)
+        # ==== Last run breakdown (collapsible) ====
+        self.perfToggle = QtWidgets.QToolButton(self)
+        self.perfToggle.setText("Last run")
+        self.perfToggle.setCheckable(True)
+        self.perfToggle.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.perfToggle.setArrowType(QtCore.Qt.RightArrow)
+        self.perfToggle.toggled.connect(self.toggle_perf_panel)
+        self.perfToggle.setVisible(instrument.enabled())
+        self.tabLayout.addWidget(self.perfToggle)
+        self.perfTree = QtWidgets.QTreeWidget(self)
+        self.perfTree.setHeaderLabels(["Stage", "Name", "Wall (s)", "CPU (s)", "In (MB)", "Out (MB)", "Shape"])
+        self.perfTree.setRootIsDecorated(False)
+        self.perfTree.setMaximumHeight(180)
+        self.perfTree.setVisible(False)
+        self.tabLayout.addWidget(self.perfTree)
+        self.update_perf_panel()
+        # ==== Spectrum (collapsible) ====
+        self.spectrumToggle = QtWidgets.QToolButton(self)
+        self.spectrumToggle.setText("Spectrum")
+        self.spectrumToggle.setCheckable(True)
+        self.spectrumToggle.setToolButtonStyle(QtCore.Qt.ToolButtonTextBesideIcon)
+        self.spectrumToggle.setArrowType(QtCore.Qt.RightArrow)
+        self.spectrumToggle.toggled.connect(self.toggle_spectrum_panel)
+        self.tabLayout.addWidget(self.spectrumToggle)
+        self.spectrumPanel = QtWidgets.QWidget(self)
+        self.spectrumLayout = QtWidgets.QVBoxLayout(self.spectrumPanel)
+        self.spectrumLayout.setContentsMargins(0, 0, 0, 0)
+        self.spectrumControls = QtWidgets.QHBoxLayout()
+        self.spectrumFile = QtWidgets.QComboBox(self)
+        self.spectrumFile.addItems([os.path.basename(f) for f in self.files_paths])
+        self.spectrumFile.currentIndexChanged.connect(self.update_spectrum_panel)
+        self.spectrumControls.addWidget(self.spectrumFile)
+        self.spectrumTrace = QtWidgets.QSpinBox(self)
+        self.spectrumTrace.setPrefix("Trace: ")
+        self.spectrumTrace.setToolTip("Trace shown in the spectrogram; clicking a trace in the plot selects it too")
+        self.spectrumTrace.valueChanged.connect(self.update_spectrum_panel)
+        self.spectrumControls.addWidget(self.spectrumTrace)
+        self.spectrumLabel = QtWidgets.QLabel(self)
+        self.spectrumControls.addWidget(self.spectrumLabel, 1)
+        self.spectrumLayout.addLayout(self.spectrumControls)
+        self.spectrumFigure = Figure()
+        self.spectrumCanvas = FigureCanvasQTAgg(self.spectrumFigure)
+        self.spectrumCanvas.setMinimumHeight(220)
+        self.spectrumLayout.addWidget(self.spectrumCanvas)
+        self.spectrumPanel.setVisible(False)
+        self.tabLayout.addWidget(self.spectrumPanel, 1)
+        self.images = []
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas.mpl_connect('motion_notify_event', self.on_mouse_move)
+        self.canvas.mpl_connect('button_press_event', self.on_click)
+        if self.loader is not None:
+            self.load_timer = QtCore.QTimer(self)
+            self.load_timer.timeout.connect(self.check_loaded)
+            self.load_timer.start(200)
+            self.plot_figure(True)
 
     def plot_figure(self, show):
-        fig, axs = plt.subplots(len(self.filtered_data_arrs), 1, constrained_layout=True)
-        # create and array out of the one subpolt that is created if we only have a sinlge input file
-        # - avoids errors in for loop code below
-        if(len(self.filtered_data_arrs)==1):
-            axs = [axs]
-        fig.suptitle("DZT Data")
+        with instrument.run("Plot Data") as run:
+            self._plot_figure(show)
+        self.show_run(run)
+
+    def _plot_figure(self, show):
+        # the figure, axes and images are built once per tab; later calls only swap data and limits
+        if len(self.images) != len(self.filtered_data_arrs):
+            self._build_figure()
+        for vline, hline in self.cursors:
+            vline.set_visible(False)
+            hline.set_visible(False)
         for i in range(len(self.filtered_data_arrs)):
         # ------ info needed to plot data ---------------------
-            mean = np.mean(self.filtered_data_arrs[i])
-            std = np.std(self.filtered_data_arrs[i])
-            ll = mean - (std * 3)
-            ul = mean + (std * 3)
-            # ===== Y-AXIS IN DISTANCE UNITS =======
-            #   zmax = self.data_heads[i]['rhf_depth'] - self.data_heads[i]['rhf_top']
-            #   axs[i].set_ylabel("Depth (m)")
-            # ===== Y-AXIS IN TIME UNITS ==========
-            zmax = self.data_heads[i]['rhf_range']
-            axs[i].set_ylabel('Two-way Time (ns)')
-            # ===== X-AXIS IN DISTANCE UNITS ======
-            xmax = self.filtered_data_arrs[i].shape[1] / self.data_heads[i]['rhf_spm']
-            axs[i].set_xlabel("Distance (m)")
-            # ====== X-AXIS IN TIME UNITS =======
-            #   xmax = self.data_heads[i]['sec']
-            #   axs[i].set_xlabel('Time (s)')
+            ll, ul = clim(self.get_stats(i), mode='percentile' if self.contrastBox.currentIndex() == 1 else 'sigma')
+            # axis units are chosen in plotting.profile_limits, shared with the batch renderer
+            xlim, zlim = profile_limits(self.data_heads[i], self.get_pyramid(i).ntraces)
             # =============+=+= SCALING ROUTINE =+=+===============
             # current problem here is that the data is then plotted as very long thin rectangles, not good
             # try:
@@ -241,31 +355,261 @@ class data_tab(QtWidgets.QWidget):
             #     zscale = self.filtered_data_arrs[i].shape[0]/zmax
             #     xmax = self.data_heads[i]['sec']
             #     xscale = self.filtered_data_arrs[i].shape[1]/xmax
+            #     self.axes[i].set_aspect(float(zscale)/float(xscale))
         # -------------------------------------------------------------------------
-            # auto scaling
-            axs[i] = axs[i].imshow(self.filtered_data_arrs[i], cmap='gray', clim=(ll, ul), interpolation='bicubic', aspect='auto', extent=[0, xmax, zmax, 2]).axes
-            # using the scaling routine above
-            # axs[i] = axs[i].imshow(self.filtered_data_arrs[i], cmap='gray', clim=(ll, ul), interpolation='bicubic', aspect=float(zscale)/float(xscale), extent=[0, xmax, zmax, 2]).axes
-            axs[i].set_title(os.path.basename(self.files_paths[i]))
+            self.get_renderer(i).set_style('gray', (ll, ul))
+            self.axes[i].set_ylim(*zlim)
+            # resetting the x limits fires update_view, which composites the visible tiles and sets the extent
+            self.axes[i].set_xlim(*xlim)
         if show:
-            plt.show()
+            self.canvas.draw_idle()
+
+    def _build_figure(self):
+        self.figure.clear()
+        self.axes = self.figure.subplots(len(self.filtered_data_arrs), 1, squeeze=False)[:, 0]
+        self.figure.suptitle("DZT Data")
+        self.images = []
+        self.cursors = []
+        for i, ax in enumerate(self.axes):
+            setup_axes(ax, os.path.basename(self.files_paths[i]))
+            img = ax.imshow(np.zeros((1, 1, 4), dtype=np.uint8), interpolation='bicubic', aspect='auto')
+            ax.set_autoscale_on(False)
+            ax.callbacks.connect('xlim_changed', lambda ax, img=img, i=i: self.update_view(ax, img, i))
+            self.images.append(img)
+            # crosshair drawn by blitting on top of a cached background
+            self.cursors.append((ax.axvline(0, color='r', lw=0.8, animated=True, visible=False),
+                                 ax.axhline(0, color='r', lw=0.8, animated=True, visible=False)))
+        self.figure.tight_layout()
+
+    # caches the rendered figure so cursor moves only blit the crosshair
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def on_mouse_move(self, event):
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        for ax, (vline, hline) in zip(self.axes, self.cursors):
+            inside = (event.inaxes is ax) and (self.toolbar.mode == '')
+            vline.set_visible(inside)
+            hline.set_visible(inside)
+            if inside:
+                vline.set_xdata([event.xdata, event.xdata])
+                hline.set_ydata([event.ydata, event.ydata])
+                ax.draw_artist(vline)
+                ax.draw_artist(hline)
+        self.canvas.blit(self.figure.bbox)
+
+    # clicking a trace while the spectrum panel is open shows its spectrogram
+    def on_click(self, event):
+        if (not self.spectrumToggle.isChecked()) or (self.toolbar.mode != '') or (event.inaxes is None):
+            return
+        for i, ax in enumerate(self.axes):
+            if event.inaxes is ax:
+                self.spectrumFile.blockSignals(True)
+                self.spectrumFile.setCurrentIndex(i)
+                self.spectrumFile.blockSignals(False)
+                self.spectrumTrace.setMaximum(self.filtered_data_arrs[i].shape[1] - 1)
+                self.spectrumTrace.setValue(int(round(event.xdata * self.data_heads[i]['rhf_spm'])))
+                self.update_spectrum_panel()
+
+    # display pyramid and statistics for file i, built once per version of the filtered data.
+    # unfiltered files with an overview file use the stored pyramid and statistics instead
+    def get_pyramid(self, i):
+        if (self.overviews[i] is not None) and (self.filtered_data_arrs[i] is self.orig_data_arrs[i]):
+            return self.overviews[i].pyramid
+        return self.pyramids.get(i, self.data_version, lambda: self._timed('pyramid', i, DisplayPyramid))
+
+    def get_stats(self, i):
+        if (self.overviews[i] is not None) and (self.filtered_data_arrs[i] is self.orig_data_arrs[i]):
+            return self.overviews[i].stats
+        return self.stats.get(i, self.data_version, lambda: self._timed('stats', i, display_stats))
+
+    # runs a display-preparation step on file i's filtered data as an instrumented stage
+    def _timed(self, stage, i, func):
+        with instrument.stage(stage, os.path.basename(self.files_paths[i]), self.filtered_data_arrs[i]) as s:
+            result = func(self.filtered_data_arrs[i])
+            s.out(getattr(result, 'levels', None))
+        return result
+
+    # tile renderer for file i; it keeps its cached tiles until the data version or colour limits change
+    def get_renderer(self, i):
+        renderer = self.renderers.get(i)
+        if renderer is None:
+            renderer = self.renderers[i] = TileRenderer(self.get_pyramid(i), version=self.data_version)
+        else:
+            renderer.set_data(self.get_pyramid(i), self.data_version)
+        return renderer
+
+    # swaps in the rendered tiles that match the current zoom/pan of an axes
+    def update_view(self, ax, img, i):
+        spm = self.data_heads[i]['rhf_spm']
+        x0, x1 = ax.get_xlim()
+        with instrument.stage('view', os.path.basename(self.files_paths[i])) as s:
+            data, c0, c1, level = self.get_renderer(i).viewport(int(min(x0, x1) * spm), int(math.ceil(max(x0, x1) * spm)), ax.get_window_extent().width)
+            s.out(data)
+        img.set_data(data)
+        img.set_extent(view_extent(self.data_heads[i], c0, c1))
+
+    # polled by load_timer while the samples are decoded in the background
+    def check_loaded(self):
+        if self.loader.done():
+            self.wait_loaded()
+
+    # blocks until the decoded samples are in place; anything that needs the full arrays calls this first
+    def wait_loaded(self):
+        if self.loader is None:
+            return
+        arrs, heads = self.loader.result()
+        self.loader = None
+        self.show_run(self.load_run)
+        if self.load_timer is not None:
+            self.load_timer.stop()
+        for i, ov in enumerate(self.overviews):
+            if ov is not None:
+                # same samples as the memory map, so tiles already rendered stay valid
+                ov.pyramid.levels[0] = arrs[i]
+            else:
+                overview_writer.submit(overview.write_overview, self.files_paths[i], arrs[i], heads[i])
+        self.orig_data_arrs, self.orig_data_heads = arrs, heads
+        self.filtered_data_arrs = list(self.orig_data_arrs)
+        self.data_heads = copy.deepcopy(self.orig_data_heads)
 
     def apply_filts(self):
         a_dialog = Alert_Dialog(self)
         a_dialog.show()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(dzt_filters, self.filtered_data_arrs, self.data_heads, self.active_filters)
-            self.filtered_data_arrs = future.result()
+        self.wait_loaded()
+        chain = make_recipe(self.active_filters)['filters']
+        try:
+            with instrument.run("Apply Filters") as run, concurrent.futures.ThreadPoolExecutor() as executor:
+                future = executor.submit(run.bind(self.run_filters), chain)
+                self.filtered_data_arrs, self.data_heads = future.result()
+        except server.ServerError as e:
+            # the data is left as it was; local filtering would fail the same way
+            a_dialog.done(0)
+            QtWidgets.QMessageBox.warning(self, "Apply Filters", "The processing server could not apply the filters:\n%s" %(e))
+            return
+        self.filter_history.append(chain)
+        self.data_version += 1
         a_dialog.done(0)
+        self.show_run(run)
+        self.update_spectrum_panel()
+
+    # decoding and filtering go to the processing server when there is one, and fall back to this process if it goes away
+    def read_files(self, paths):
+        if self.server is not None:
+            try:
+                return self.server.load(paths)
+            except server.ServerUnavailable as e:
+                print("%s; processing locally" %(e))
+                self.server = None
+            except server.ServerError as e:
+                # e.g. the server cannot see the files; then it cannot filter them either
+                print("server failed to read the files (%s); processing locally" %(e))
+                self.server = None
+        return dzt_func(paths)
+
+    def run_filters(self, chain):
+        if self.server is not None:
+            try:
+                return self.server.filter(self.files_paths, self.filter_history + [chain])
+            except server.ServerUnavailable as e:
+                print("%s; processing locally" %(e))
+                self.server = None
+        active_filters = collections.OrderedDict((filt, params) for filt, params in chain)
+        return dzt_filters(self.filtered_data_arrs, self.data_heads, active_filters, workers=os.cpu_count() or 1, processes=os.cpu_count() or 1), self.data_heads
+
+    # reports a finished run in the main window's status bar and this tab's "Last run" panel
+    def show_run(self, run):
+        if not instrument.enabled():
+            return
+        self.last_run = run
+        window = self.window()
+        if isinstance(window, QtWidgets.QMainWindow):
+            window.statusBar().showMessage(run.summary())
+        self.update_perf_panel()
+
+    def toggle_perf_panel(self, checked):
+        self.perfToggle.setArrowType(QtCore.Qt.DownArrow if checked else QtCore.Qt.RightArrow)
+        self.perfTree.setVisible(checked)
+
+    def update_perf_panel(self):
+        if (self.last_run is None) or not hasattr(self, 'perfTree'):
+            return
+        run = self.last_run
+        self.perfToggle.setText("Last run: %s (%.2f s)" %(run.label, run.wall_s))
+        self.perfTree.clear()
+        mb = lambda n: '' if n is None else '%.1f' %(n / 2**20)
+        for e in list(run.events):
+            shape = '%s \u2192 %s' %(e.get('shape_in'), e.get('shape_out')) if e.get('shape_in') or e.get('shape_out') else ''
+            self.perfTree.addTopLevelItem(QtWidgets.QTreeWidgetItem([
+                e['stage'], str(e.get('name') or ''), '%.3f' %e['wall_s'], '%.3f' %e['cpu_s'],
+                mb(e.get('bytes_in')), mb(e.get('bytes_out')), shape]))
+        for c in range(self.perfTree.columnCount()):
+            self.perfTree.resizeColumnToContents(c)
+
+    def toggle_spectrum_panel(self, checked):
+        self.spectrumToggle.setArrowType(QtCore.Qt.DownArrow if checked else QtCore.Qt.RightArrow)
+        self.spectrumPanel.setVisible(checked)
+        self.update_spectrum_panel()
+
+    # mean spectrum of the selected file and spectrogram of the selected trace, both cached per data version,
+    # with the response of the bandpass in the active filters drawn over the spectrum
+    def update_spectrum_panel(self):
+        if not self.spectrumToggle.isChecked():
+            return
+        self.wait_loaded()
+        i = self.spectrumFile.currentIndex()
+        ar, header = self.filtered_data_arrs[i], self.data_heads[i]
+        self.spectrumTrace.blockSignals(True)
+        self.spectrumTrace.setMaximum(ar.shape[1] - 1)
+        self.spectrumTrace.blockSignals(False)
+        trace = self.spectrumTrace.value()
+        with instrument.run("Spectrum") as run:
+            spec = self.spectra.get(i, self.data_version, lambda: self._timed('spectrum', i, lambda ar: spectral.line_spectrum(ar, header)))
+            gram = self.spectrograms.get((i, trace), self.data_version, lambda: spectral.trace_spectrogram(ar, header, trace))
+        mhz = spec['freqs'] / 1e6
+        peak, lo, hi = spectral.band(mhz, spec['power'])
+        text = "Peak %.0f MHz, -%d dB band %.0f-%.0f MHz" %(peak, spectral.BAND_DB, lo, hi)
+        try:
+            response = spectral.filter_response(self.active_filters, header, spec['freqs'])
+        except ValueError as e:
+            response = None
+            text += "  |  bandpass not drawn: %s" %(e)
+        self.spectrumLabel.setText(text)
+        self.spectrumFigure.clear()
+        ax_spec, ax_gram = self.spectrumFigure.subplots(1, 2)
+        ax_spec.plot(mhz, 10 * np.log10(spec['power'] / spec['power'].max() + 1e-12))
+        ax_spec.set_xlabel("Frequency (MHz)")
+        ax_spec.set_ylabel("Power (dB)")
+        ax_spec.set_title("Mean of %d traces" %(spec['traces']), fontsize='medium')
+        if response is not None:
+            ax_gain = ax_spec.twinx()
+            ax_gain.plot(mhz, response, 'r--')
+            ax_gain.set_ylim(0, 1.05)
+            ax_gain.set_ylabel("Bandpass gain", color='r')
+        ax_gram.pcolormesh(gram['times'] * 1e9, gram['freqs'] / 1e6, 10 * np.log10(gram['power'] + 1e-12), shading='auto')
+        ax_gram.set_xlabel("Time (ns)")
+        ax_gram.set_ylabel("Frequency (MHz)")
+        ax_gram.set_title("Trace %d" %(trace), fontsize='medium')
+        self.spectrumFigure.tight_layout()
+        self.spectrumCanvas.draw_idle()
+        self.show_run(run)
 
     def reset_data(self):
-        self.filtered_data_arrs = self.orig_data_arrs
+        self.wait_loaded()
+        self.filtered_data_arrs = list(self.orig_data_arrs)
+        self.data_heads = copy.deepcopy(self.orig_data_heads)
+        self.data_version += 1
+        self.filter_history = []
         self.appliedFilterList.clear()
+        self.update_spectrum_panel()
 
     def remove_filter(self, filt):
         if filt != None:
             self.active_filters.pop(filt.text().split('(')[0])
             self.appliedFilterList.takeItem(self.appliedFilterList.row(self.appliedFilterList.selectedItems()[0]))
+            self.update_spectrum_panel()
 
     def create_param(self, t, params):
         edit_list = list()
@@ -386,6 +730,45 @@ class data_tab(QtWidgets.QWidget):
                 new_param.append(code)
                 self.active_filters[filt] = new_param
         self.list_stack.removeWidget(self.list_stack.widget(0))  
+        self.update_spectrum_panel()
+
+    # saves the active filters and contrast as a recipe for batch.py
+    def save_recipe_pressed(self):
+        path = QtWidgets.QFileDialog.getSaveFileName(None, "Save Recipe", "recipe.json", "Filter recipe (*.json)")[0]
+        if path != "":
+            if not path.lower().endswith('.json'):
+                path += '.json'
+            save_recipe(path, make_recipe(self.active_filters, contrast='percentile' if self.contrastBox.currentIndex() == 1 else 'sigma'))
+
+    # grids the filtered lines of the tab into a cube next to the first file and opens the slice browser
+    def cube_pressed(self):
+        placements = ["Line spacing", "Line spacing (zigzag)", "GPS (DZG)"]
+        placement, ok = QtWidgets.QInputDialog.getItem(self, "Build Cube", "Place the lines by:", placements, 0, False)
+        if not ok:
+            return
+        spacing = None
+        if placement != placements[2]:
+            spacing, ok = QtWidgets.QInputDialog.getDouble(self, "Build Cube", "Line spacing (m):", 0.5, 0.01, 100., 2)
+            if not ok:
+                return
+        self.wait_loaded()
+        import cube
+        outfile = os.path.splitext(self.files_paths[0])[0] + cube.CUBE_EXT
+        a_dialog = Alert_Dialog(self)
+        a_dialog.show()
+        try:
+            with instrument.run("Build Cube") as run, concurrent.futures.ThreadPoolExecutor() as executor:
+                future = executor.submit(run.bind(cube.build_cube), outfile, self.filtered_data_arrs, self.data_heads, files=self.files_paths,
+                                         spacing=spacing, zigzag=(placement == placements[1]), gps=(placement == placements[2]))
+                future.result()
+        except (ValueError, OSError) as e:
+            a_dialog.done(0)
+            QtWidgets.QMessageBox.warning(self, "Build Cube", str(e))
+            return
+        a_dialog.done(0)
+        self.show_run(run)
+        self.slice_dialog = Slice_Dialog(cube.Cube(outfile), self)
+        self.slice_dialog.show()
 
     # this method is connected to the export button, will pop up a dialog box and then open up a file explorer box
     def export_pressed(self):
@@ -394,6 +777,7 @@ class data_tab(QtWidgets.QWidget):
         export_info_box.exec_()
         #Determines whether export box was closed by Cancel or Ok
         if export_info_box.result() == 1:
+            self.wait_loaded()
             #Prompts user to select select location to export file using File Explorer
             export_file_placement = str(QtWidgets.QFileDialog.getExistingDirectory(None, "Select Directory"))
             #Checks if no file location was selected to export
@@ -413,22 +797,56 @@ class data_tab(QtWidgets.QWidget):
                 #Create and show Writing Dialog Modal
                 writing_dialog = Writing_Dialog(self)
                 writing_dialog.show()
-                #Method for writing png output file
-                if output_type == "png":
-                    self.plot_figure(False)
-                    plt.savefig("%s.%s" %(output_abs_path, output_type))
-                #Method for writing csv output file
-                elif output_type == "csv":
-                    if len(self.filtered_data_arrs) == 1:
-                        output_abs_path = output_abs_path  + "." + output_type
-                        data = pd.DataFrame(self.filtered_data_arrs[0]) # using pandas to output csv
-                        data.to_csv(output_abs_path) # write
-                    else:
-                        for i in range(len(self.filtered_data_arrs)):
-                            data = pd.DataFrame(self.filtered_data_arrs[i]) # using pandas to output csv
-                            data.to_csv("%s(%d).%s" %(output_abs_path, i+1, output_type))
+                with instrument.run("Export " + export_info_box.format_selection_box.currentText()) as run:
+                    self.write_export(output_type, output_abs_path)
                 #Close Writing Dialog Modal dialog Modal
                 writing_dialog.done(0)
+                self.show_run(run)
+
+    # writes the filtered data of every file in the tab in the chosen format
+    def write_export(self, output_type, output_abs_path):
+        #Method for writing png/tiff output file: the data itself through the colormap, at native resolution
+        if output_type in ("png", "tiff"):
+            mode = 'percentile' if self.contrastBox.currentIndex() == 1 else 'sigma'
+            for i in range(len(self.filtered_data_arrs)):
+                if len(self.filtered_data_arrs) == 1:
+                    image_path = "%s.%s" %(output_abs_path, output_type)
+                else:
+                    image_path = "%s(%d).%s" %(output_abs_path, i+1, output_type)
+                with instrument.stage('export', os.path.basename(image_path), self.filtered_data_arrs[i]) as s:
+                    s.out(export_image(image_path, self.filtered_data_arrs[i], clim(self.get_stats(i), mode=mode)))
+        #Method for writing csv output file
+        elif output_type == "csv":
+            from readgssi import translate
+            with instrument.stage('export', os.path.basename(output_abs_path) + ".csv", self.filtered_data_arrs) as s:
+                if len(self.filtered_data_arrs) == 1:
+                    s.out(translate.csv(self.filtered_data_arrs[0], output_abs_path))
+                else:
+                    # one worker process per file
+                    s.out(translate.csv_many(self.filtered_data_arrs, ["%s(%d)" %(output_abs_path, i+1) for i in range(len(self.filtered_data_arrs))]))
+        #Method for writing hdf5 output file: every profile in the tab goes into one container
+        elif output_type == "hdf5":
+            from readgssi.h5 import SurveyWriter
+            with instrument.stage('export', os.path.basename(output_abs_path) + ".h5", self.filtered_data_arrs) as s:
+                with SurveyWriter(output_abs_path + ".h5") as writer:
+                    names = []
+                    for i in range(len(self.filtered_data_arrs)):
+                        name = os.path.splitext(os.path.basename(self.files_paths[i]))[0]
+                        if name in names:
+                            name = "%s(%d)" %(name, i+1)
+                        names.append(name)
+                        writer.write_profile(name, self.filtered_data_arrs[i], self.data_heads[i], filters=self.filter_history)
+                s.out(output_abs_path + ".h5")
+        #Method for writing seg-y output file
+        elif output_type == "seg-y":
+            from readgssi import translate
+            for i in range(len(self.filtered_data_arrs)):
+                if len(self.filtered_data_arrs) == 1:
+                    segy_path = output_abs_path + ".sgy"
+                else:
+                    segy_path = "%s(%d).sgy" %(output_abs_path, i+1)
+                with instrument.stage('export', os.path.basename(segy_path), self.filtered_data_arrs[i]) as s:
+                    s.out(translate.segy(self.filtered_data_arrs[i], segy_path, self.data_heads[i]))
 #----------------------------------------------------------#
 # Parent class widget to manage the dynamic tabs
 class tab_manager(QtWidgets.QTabWidget):
@@ -493,6 +911,8 @@ class Ui_MainWindow(object):
 
 if __name__ == "__main__":
     import sys
+    # stage timings for the status bar and "Last run" panels; set GPR_PERF_LOG to also log them as JSON lines
+    instrument.enable(os.environ.get(instrument.LOG_ENV))
     app = QtWidgets.QApplication(sys.argv)
     MainWindow = QtWidgets.QMainWindow()
     ui = Ui_MainWindow()
@@ -0,0 +1,168 @@
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import numpy as np
+import backend
+import instrument
+
+DEFAULT_TILE = 2048 # traces per tile
+PROCESS_MIN_BYTES = 128 * 2**20 # below this, worker start-up costs more than it saves
+
+_pool = None
+_pool_workers = None # worker count _pool was started with
+
+
+#------------- TILED EXECUTION ------------------#
+def run_tiled(ar, header, active_filters, tile=None, workers=1):
+    """
+    Run a filter chain over an array in tiles of traces. Consecutive stages with a finite horizontal support (see :py:func:`backend.filter_support`) are fused into a segment that runs tile by tile: each tile is widened by the summed halo of the segment's stages, pushed through every stage, trimmed back and written into a preallocated output. Stages that need a whole-array reduction of their input start a new segment, and stages that need the whole array (e.g. the 2-D FFT) run on it directly.
+
+    Peak memory for a segment is the output array plus a few tile-sized temporaries, instead of several full-size temporaries per stage.
+
+    :param numpy.ndarray ar: The radar array
+    :param dict header: The file header dictionary
+    :param dict active_filters: Filter names mapped to their parameter lists
+    :param int tile: Traces per tile. Defaults to None, which resolves to :py:data:`DEFAULT_TILE`.
+    :param int workers: Number of threads to run tiles on
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    if tile is None:
+        tile = DEFAULT_TILE
+    segment = []
+    for filt, params in active_filters.items():
+        halo, reduce = backend.filter_support(filt, params, ar.shape)
+        if segment and ((halo is None) or reduce):
+            ar = run_segment(ar, header, segment, tile=tile, workers=workers)
+            segment = []
+        if halo is None:
+            with instrument.stage('filter', filt, ar, file=os.path.basename(str(header.get('infile', '')))) as s:
+                ar = backend.run_filter(ar, header, filt, params)
+                s.out(ar)
+        else:
+            segment.append((filt, params, halo, reduce))
+    if segment:
+        ar = run_segment(ar, header, segment, tile=tile, workers=workers)
+    return ar
+
+
+def run_segment(ar, header, segment, tile=DEFAULT_TILE, workers=1):
+    """
+    Run a fused segment of tileable stages over an array. Only the first stage of a segment may need a whole-array reduction.
+
+    :param numpy.ndarray ar: The segment input
+    :param dict header: The file header dictionary
+    :param list segment: :code:`(filt, params, halo, reduce)` tuples
+    :param int tile: Traces per tile
+    :param int workers: Number of threads to run tiles on
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    ntr = ar.shape[1]
+    # per-filter time is summed over the tiles (and the whole-array reduction) and reported once per stage
+    tally = instrument.tally()
+    states = []
+    for filt, params, halo, reduce in segment:
+        with tally.stage(filt):
+            states.append(backend.prepare_filter(ar, header, filt, params, tile=tile) if reduce else None)
+    halo = sum(s[2] for s in segment)
+    bounds = [(a, min(a + tile, ntr)) for a in range(0, ntr, tile)]
+
+    def work(a, b):
+        lo = max(a - halo, 0)
+        hi = min(b + halo, ntr)
+        x = ar[:, lo:hi]
+        for (filt, params, h, r), state in zip(segment, states):
+            with tally.stage(filt, x) as s:
+                x = backend.run_filter(x, header, filt, params, state=state, cols=slice(lo, hi))
+                s.out(x)
+        return x[:, a - lo:b - lo]
+
+    # the first tile tells us the output rows and dtype
+    first = work(*bounds[0])
+    out = np.empty((first.shape[0], ntr), dtype=first.dtype)
+    out[:, bounds[0][0]:bounds[0][1]] = first
+    del first
+
+    def store(bound):
+        out[:, bound[0]:bound[1]] = work(*bound)
+
+    if (workers > 1) and (len(bounds) > 2):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(store, bounds[1:]))
+    else:
+        for bound in bounds[1:]:
+            store(bound)
+    tally.emit('filter', file=os.path.basename(str(header.get('infile', ''))), tiles=len(bounds), shape_in=list(ar.shape), shape_out=list(out.shape))
+    return out
+
+
+#------------- MULTI-FILE PROCESS POOL ------------------#
+def run_files_shared(data, headers, active_filters, workers=None, tile=None):
+    """
+    Filter several arrays at once on a pool of worker processes. Each array is copied once into a :py:class:`multiprocessing.shared_memory.SharedMemory` block, and a second block is reserved for the result; workers receive only the block names, shapes, header and filter plan, attach to the blocks, run :py:func:`run_tiled` and write the result in place. No array is pickled in either direction unless a result outgrows its block.
+
+    :param list data: The radar arrays. Entries are replaced by the filtered arrays.
+    :param list headers: The matching header dictionaries. Entries are updated with header changes made by the filters.
+    :param dict active_filters: Filter names mapped to their parameter lists
+    :param int workers: Number of worker processes. Defaults to None, which uses one per CPU.
+    :param int tile: Traces per tile within each worker
+    :rtype: list of :py:class:`numpy.ndarray`
+    """
+    pool = process_pool(workers)
+    blocks = []
+    try:
+        futures = []
+        for ar, header in zip(data, headers):
+            src = shared_memory.SharedMemory(create=True, size=max(ar.nbytes, 1))
+            blocks.append(src)
+            np.ndarray(ar.shape, dtype=ar.dtype, buffer=src.buf)[...] = ar
+            # every stage in this tree returns at most as many samples as it gets
+            dst = shared_memory.SharedMemory(create=True, size=max(ar.size * 8, ar.nbytes, 1))
+            blocks.append(dst)
+            futures.append(pool.submit(_filter_shared, src.name, ar.shape, ar.dtype.str,
+                                       dst.name, dst.size, header, active_filters, tile))
+        for i, future in enumerate(futures):
+            shape, dtype, header, spill = future.result()
+            if spill is None:
+                spill = np.ndarray(shape, dtype=dtype, buffer=blocks[2 * i + 1].buf).copy()
+            data[i] = spill
+            headers[i].update(header)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return data
+
+
+def process_pool(workers=None):
+    """
+    Return the shared worker process pool, starting it on first use so later runs skip the worker start-up and import cost. The pool is rebuilt if a different number of workers is asked for.
+
+    :param int workers: Number of worker processes. Defaults to None, which uses one per CPU.
+    :rtype: :py:class:`concurrent.futures.ProcessPoolExecutor`
+    """
+    global _pool, _pool_workers
+    if (_pool is None) or (workers is not None and _pool_workers != workers):
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool_workers = workers or os.cpu_count() or 1
+        # spawn rather than fork: the GUI process has Qt and BLAS threads running
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=_pool_workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _filter_shared(src_name, shape, dtype, dst_name, dst_size, header, active_filters, tile):
+    # worker side of run_files_shared(): attach, filter, write the result into the reserved block
+    src = shared_memory.SharedMemory(name=src_name)
+    dst = shared_memory.SharedMemory(name=dst_name)
+    try:
+        ar = np.ndarray(shape, dtype=dtype, buffer=src.buf)
+        out = run_tiled(ar, header, active_filters, tile=tile)
+        del ar
+        if out.nbytes > dst_size:
+            return out.shape, out.dtype.str, header, out
+        np.ndarray(out.shape, dtype=out.dtype, buffer=dst.buf)[...] = out
+        return out.shape, out.dtype.str, header, None
+    finally:
+        src.close()
+        dst.close()
@@ -0,0 +1,163 @@
+import os
+import struct
+import zlib
+import numpy as np
+from render import colormap_lut, lut_index
+
+BLOCK_ROWS = 256 # output rows mapped and written at a time
+IDAT_BYTES = 2**20 # compressed bytes gathered before a PNG IDAT chunk is written
+
+
+#------------- RASTER MAPPING ------------------#
+def raster_blocks(ar, clim, cmap='gray', size=None, block=BLOCK_ROWS):
+    """
+    Map an array to RGB bytes through a 256-entry colormap LUT, one block of output rows at a time, so only a block of rows is ever held in memory. With :code:`size` the image is resampled (nearest neighbour) to that many rows and columns.
+
+    :param numpy.ndarray ar: The radar array (may be a memory map)
+    :param tuple clim: Values mapped to the ends of the colormap
+    :param str cmap: The colormap name
+    :param tuple size: Output (height, width) in pixels. Defaults to None, which keeps the native resolution (one pixel per sample).
+    :param int block: Output rows per block
+    :rtype: generator of :py:class:`numpy.ndarray` blocks of shape (rows, width, 3) and dtype uint8
+    """
+    lut = colormap_lut(cmap)[:, :3]
+    height, width = ar.shape if size is None else size
+    rows = None if size is None else (np.arange(height) * ar.shape[0] // height)
+    cols = None if size is None else (np.arange(width) * ar.shape[1] // width)
+    for r0 in range(0, height, block):
+        r1 = min(r0 + block, height)
+        if rows is None:
+            values = ar[r0:r1]
+        else:
+            values = ar[rows[r0:r1]][:, cols]
+        yield lut[lut_index(values, clim)]
+
+
+#------------- PNG ------------------#
+def _png_chunk(f, tag, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(tag)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff))
+
+
+def write_png(path, ar, clim, cmap='gray', size=None, block=BLOCK_ROWS, level=6):
+    """
+    Write an array as an 8-bit RGB (or greyscale, for grey colormaps) PNG, streaming row blocks through one zlib stream into IDAT chunks.
+
+    :param str path: Output file
+    :param numpy.ndarray ar: The radar array
+    :param tuple clim: Colour limits
+    :param str cmap: The colormap name
+    :param tuple size: Output (height, width), or None for native resolution
+    :param int block: Output rows per block
+    :param int level: zlib compression level
+    :rtype: str
+    """
+    height, width = ar.shape if size is None else size
+    lut = colormap_lut(cmap)
+    # grey colormaps are written as 1-channel greyscale, a third of the bytes to compress
+    channels = 1 if (np.all(lut[:, 0] == lut[:, 1]) and np.all(lut[:, 0] == lut[:, 2])) else 3
+    z = zlib.compressobj(level)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2 if channels == 3 else 0, 0, 0, 0))
+        pending = []
+        npending = 0
+        for rgb in raster_blocks(ar, clim, cmap=cmap, size=size, block=block):
+            # every scanline starts with filter type 0 (none)
+            lines = np.zeros((rgb.shape[0], width * channels + 1), dtype=np.uint8)
+            lines[:, 1:] = rgb[..., :channels].reshape(rgb.shape[0], -1)
+            data = z.compress(lines.tobytes())
+            if data:
+                pending.append(data)
+                npending += len(data)
+            if npending >= IDAT_BYTES:
+                _png_chunk(f, b'IDAT', b''.join(pending))
+                pending = []
+                npending = 0
+        pending.append(z.flush())
+        _png_chunk(f, b'IDAT', b''.join(pending))
+        _png_chunk(f, b'IEND', b'')
+    return path
+
+
+#------------- TIFF ------------------#
+def write_tiff(path, ar, clim, cmap='gray', size=None, block=BLOCK_ROWS):
+    """
+    Write an array as an uncompressed 8-bit RGB baseline TIFF with one strip per row block. Strips are written as they are mapped and the image directory goes at the end of the file, so nothing larger than a block is held in memory.
+
+    :param str path: Output file
+    :param numpy.ndarray ar: The radar array
+    :param tuple clim: Colour limits
+    :param str cmap: The colormap name
+    :param tuple size: Output (height, width), or None for native resolution
+    :param int block: Output rows per block (rows per strip)
+    :rtype: str
+    """
+    height, width = ar.shape if size is None else size
+    if height * width * 3 >= 2**32:
+        raise ValueError('%d x %d pixels is too large for a classic TIFF; pass a smaller size' % (height, width))
+    offsets = []
+    counts = []
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00\x00\x00\x00\x00') # directory offset filled in below
+        for rgb in raster_blocks(ar, clim, cmap=cmap, size=size, block=block):
+            offsets.append(f.tell())
+            counts.append(rgb.nbytes)
+            f.write(rgb.tobytes())
+        # word-aligned out-of-line values: bits per sample, strip offsets, strip byte counts
+        if f.tell() % 2:
+            f.write(b'\x00')
+        bits_at = f.tell()
+        f.write(struct.pack('<3H', 8, 8, 8))
+        offsets_at = f.tell()
+        f.write(struct.pack('<%dI' % len(offsets), *offsets))
+        counts_at = f.tell()
+        f.write(struct.pack('<%dI' % len(counts), *counts))
+        nstrips = len(offsets)
+        # (tag, type, count, value); type 3 is SHORT, 4 is LONG
+        entries = [
+            (256, 4, 1, width), # ImageWidth
+            (257, 4, 1, height), # ImageLength
+            (258, 3, 3, bits_at), # BitsPerSample
+            (259, 3, 1, 1), # Compression: none
+            (262, 3, 1, 2), # PhotometricInterpretation: RGB
+            (273, 4, nstrips, offsets_at if nstrips > 1 else offsets[0]), # StripOffsets
+            (277, 3, 1, 3), # SamplesPerPixel
+            (278, 4, 1, block), # RowsPerStrip
+            (279, 4, nstrips, counts_at if nstrips > 1 else counts[0]), # StripByteCounts
+            (284, 3, 1, 1), # PlanarConfiguration: chunky
+        ]
+        ifd_at = f.tell()
+        f.write(struct.pack('<H', len(entries)))
+        for tag, typ, count, value in entries:
+            if (typ == 3) and (count == 1):
+                f.write(struct.pack('<HHIHH', tag, typ, count, value, 0))
+            else:
+                f.write(struct.pack('<HHII', tag, typ, count, value))
+        f.write(struct.pack('<I', 0))
+        f.seek(4)
+        f.write(struct.pack('<I', ifd_at))
+    return path
+
+
+WRITERS = {'.png': write_png, '.tif': write_tiff, '.tiff': write_tiff}
+
+
+def export_image(path, ar, clim, cmap='gray', size=None, block=BLOCK_ROWS):
+    """
+    Write an array straight to a PNG or TIFF chosen by the file extension, without building a matplotlib figure. The image is the data itself (no axes or labels) at native resolution unless :code:`size` is given.
+
+    :param str path: Output file ending in .png, .tif or .tiff
+    :param numpy.ndarray ar: The radar array
+    :param tuple clim: Colour limits
+    :param str cmap: The colormap name
+    :param tuple size: Output (height, width), or None for native resolution
+    :param int block: Output rows per block
+    :rtype: str
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError('unsupported image format "%s" (choose from %s)' % (ext, ', '.join(WRITERS)))
+    return WRITERS[ext](path, ar, clim, cmap=cmap, size=size, block=block)
@@ -0,0 +1,308 @@
+import functools
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Lightweight timing of the processing stages (reading, each filter, display
+# preparation, export). Instrumentation is off until enable() is called; while
+# off, stage() hands back a shared do-nothing object, so instrumented code pays
+# one global lookup per stage.
+
+LOG_ENV = 'GPR_PERF_LOG' # environment variable naming a JSON-lines log file
+
+_enabled = False
+_log = None
+_log_lock = threading.Lock()
+_local = threading.local()
+
+
+#------------- SWITCHES ------------------#
+def enable(log_path=None):
+    """
+    Turn instrumentation on.
+
+    :param str log_path: File to append every event to as one JSON object per line, or None for no log
+    """
+    global _enabled, _log
+    disable()
+    if log_path:
+        _log = open(log_path, 'a')
+    _enabled = True
+
+
+def disable():
+    """
+    Turn instrumentation off and close the log file.
+    """
+    global _enabled, _log
+    _enabled = False
+    with _log_lock:
+        if _log is not None:
+            _log.close()
+            _log = None
+
+
+def enabled():
+    return _enabled
+
+
+#------------- EVENTS ------------------#
+def describe(data):
+    """
+    Size and shape of a stage's input or output.
+
+    :param data: An array, a list of arrays, a file path, a byte count, or None
+    :rtype: bytes (int or None), shape (list or None)
+    """
+    if data is None:
+        return None, None
+    if isinstance(data, np.ndarray) or hasattr(data, 'nbytes'):
+        return int(data.nbytes), list(data.shape)
+    if isinstance(data, str):
+        return (os.path.getsize(data) if os.path.isfile(data) else None), None
+    if isinstance(data, (int, np.integer)):
+        return int(data), None
+    if isinstance(data, (list, tuple)):
+        parts = [describe(d) for d in data]
+        sizes = [p[0] for p in parts if p[0] is not None]
+        return (sum(sizes) if sizes else None), [p[1] for p in parts]
+    return None, None
+
+
+def emit(event):
+    """
+    Record a finished stage: add it to the current run (if any) and write it to the log (if any).
+
+    :param dict event: The event
+    """
+    run = getattr(_local, 'run', None)
+    event.setdefault('run', run.label if run is not None else None)
+    event.setdefault('thread', threading.current_thread().name)
+    if run is not None:
+        run.add(event)
+    if _log is not None:
+        line = json.dumps(event, default=str)
+        with _log_lock:
+            if _log is not None:
+                _log.write(line + '\n')
+                _log.flush()
+
+
+class Stage(object):
+    """
+    Times one stage, as a context manager. Call :py:meth:`out` with the result before leaving the block so its size and shape are recorded.
+
+    :param str stage: The kind of stage, e.g. 'read', 'filter', 'export'
+    :param str name: What ran, e.g. the filter or file name
+    :param data: The stage input (see :py:func:`describe`)
+    :param info: Extra JSON-serializable fields for the event
+    """
+    def __init__(self, stage, name=None, data=None, **info):
+        self.event = dict(stage=stage, name=name, **info)
+        self.data = data
+        self.result = None
+
+    def __enter__(self):
+        self.event['bytes_in'], self.event['shape_in'] = describe(self.data)
+        self.data = None
+        self.event['time'] = time.time()
+        self._wall = time.perf_counter()
+        # process time, so work done on pool threads for this stage is included
+        self._cpu = time.process_time()
+        return self
+
+    def out(self, result):
+        self.result = result
+
+    def __exit__(self, exc_type, exc, tb):
+        self.event['wall_s'] = time.perf_counter() - self._wall
+        self.event['cpu_s'] = time.process_time() - self._cpu
+        self.event['bytes_out'], self.event['shape_out'] = describe(self.result)
+        self.result = None
+        if exc_type is not None:
+            self.event['error'] = exc_type.__name__
+        emit(self.event)
+        return False
+
+
+class _NullStage(object):
+    # stands in for Stage and Tally while instrumentation is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def out(self, result):
+        pass
+
+    def stage(self, name, data=None):
+        return self
+
+    def emit(self, stage, **info):
+        pass
+
+
+_NULL = _NullStage()
+
+
+def stage(stage, name=None, data=None, **info):
+    """
+    Context manager timing a stage; see :py:class:`Stage`. Does nothing while instrumentation is off.
+
+    Usage: ::
+
+        with instrument.stage('filter', filt, ar) as s:
+            ar = run_filter(ar, header, filt, params)
+            s.out(ar)
+    """
+    if not _enabled:
+        return _NULL
+    return Stage(stage, name, data, **info)
+
+
+class Tally(object):
+    """
+    Sums the time of stages that run piecewise, e.g. a filter applied tile by tile on several threads, and emits one event per stage name afterwards. CPU time is per thread here, so concurrent tiles are not counted twice.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    @staticmethod
+    def _blank():
+        return {'wall_s': 0., 'cpu_s': 0., 'bytes_in': 0, 'bytes_out': 0, 'pieces': 0}
+
+    def stage(self, name, data=None):
+        return _TallyPiece(self, name, data)
+
+    def add(self, name, wall, cpu, bytes_in, bytes_out):
+        with self.lock:
+            total = self.totals.setdefault(name, self._blank())
+            total['wall_s'] += wall
+            total['cpu_s'] += cpu
+            total['bytes_in'] += bytes_in or 0
+            total['bytes_out'] += bytes_out or 0
+            total['pieces'] += 1
+
+    def emit(self, stage, **info):
+        """
+        Emit one event per stage name, in the order the names were first seen.
+
+        :param str stage: The kind of stage
+        :param info: Extra fields for every event
+        """
+        for name, total in self.totals.items():
+            event = dict(stage=stage, name=name, time=time.time(), **info)
+            event.update(total)
+            emit(event)
+
+
+class _TallyPiece(object):
+    def __init__(self, tally, name, data):
+        self.tally, self.name, self.data, self.result = tally, name, data, None
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def out(self, result):
+        self.result = result
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self.tally.add(self.name, wall, cpu, describe(self.data)[0], describe(self.result)[0])
+        self.data = self.result = None
+        return False
+
+
+def tally():
+    """
+    A :py:class:`Tally`, or a do-nothing stand-in while instrumentation is off.
+    """
+    if not _enabled:
+        return _NULL
+    return Tally()
+
+
+#------------- RUNS ------------------#
+class Run(object):
+    """
+    The events of one user action (e.g. "Apply Filters"), collected from the thread that opened it and from any function wrapped with :py:meth:`bind`.
+
+    :param str label: What the user did
+    """
+    def __init__(self, label):
+        self.label = label
+        self.events = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def close(self):
+        self.end = time.perf_counter()
+
+    @property
+    def wall_s(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def bind(self, func):
+        """
+        Wrap a function so events it emits, on whatever thread it runs, belong to this run. The run ends when the function returns, unless it is also used as a context manager that closes later.
+
+        :param callable func: The function
+        :rtype: callable
+        """
+        @functools.wraps(func)
+        def bound(*args, **kwargs):
+            previous = getattr(_local, 'run', None)
+            _local.run = self
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _local.run = previous
+                self.end = time.perf_counter()
+        return bound
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'run', None)
+        _local.run = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.run = self._previous
+        self.close()
+        return False
+
+    def summary(self, top=3):
+        """
+        One line for a status bar: the total and the slowest stages.
+
+        :param int top: Number of stages to name
+        :rtype: str
+        """
+        with self.lock:
+            events = list(self.events)
+        text = '%s: %.2f s' % (self.label, self.wall_s)
+        slowest = sorted(events, key=lambda e: e.get('wall_s', 0), reverse=True)[:top]
+        if slowest:
+            text += ' — ' + ', '.join('%s %.2f s' % (e.get('name') or e['stage'], e['wall_s']) for e in slowest)
+        return text
+
+
+def run(label):
+    """
+    Start collecting the events of a user action; use as a context manager.
+
+    :param str label: What the user did
+    :rtype: :py:class:`Run`
+    """
+    return Run(label)
@@ -0,0 +1,422 @@
+import importlib.util
+import os
+import numpy as np
+
+# Numba is optional. When it is installed the kernels below are compiled with
+# parallel loops over traces and cached on disk (next to this file, or in
+# NUMBA_CACHE_DIR), so only the very first run pays the JIT cost. Numba itself
+# is only imported when a kernel is first called, not when this module is.
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+numba = None
+prange = range
+
+BACKENDS = ('numba', 'numpy')
+
+
+#------------- BACKEND SELECTION ------------------#
+def available_backends():
+    """
+    List the kernel backends that can be used in this environment.
+
+    :rtype: list of str
+    """
+    if not HAVE_NUMBA:
+        return ['numpy']
+    return list(BACKENDS)
+
+
+def set_backend(name=None):
+    """
+    Select the kernel backend at runtime. Defaults to the :code:`GPR_KERNEL_BACKEND` environment variable, then to Numba when it is installed, then to NumPy.
+
+    :param str name: 'numba', 'numpy' or None for the default
+    :rtype: str
+    """
+    global backend
+    if name is None:
+        name = os.environ.get('GPR_KERNEL_BACKEND', available_backends()[0])
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError('unknown kernel backend "%s" (choose from %s)' % (name, ', '.join(BACKENDS)))
+    if name not in available_backends():
+        print('WARNING: numba is not installed, falling back to numpy kernels')
+        name = 'numpy'
+    backend = name
+    return backend
+
+
+def get_backend():
+    """
+    Return the name of the active kernel backend.
+
+    :rtype: str
+    """
+    return backend
+
+
+def _load_numba():
+    # swaps the prange placeholder for numba's before the first kernel is compiled
+    global numba, prange
+    if numba is None:
+        import numba
+        prange = numba.prange
+    return numba
+
+
+def _jit(func):
+    # compile on first call with parallel prange loops and an on-disk cache, or leave as plain python
+    if not HAVE_NUMBA:
+        return func
+    compiled = []
+
+    def kernel(*args):
+        if not compiled:
+            compiled.append(_load_numba().njit(parallel=True, cache=True, nogil=True)(func))
+        return compiled[0](*args)
+    kernel.__name__ = func.__name__
+    kernel.__doc__ = func.__doc__
+    return kernel
+
+
+def _float(ar):
+    return np.asarray(ar, dtype=np.float64)
+
+
+#------------- NUMBA KERNELS ------------------#
+@_jit
+def _bgr_numba(ar, window, means):
+    nsamp, ntr = ar.shape
+    out = np.empty((nsamp, ntr))
+    half = window // 2
+    for i in prange(nsamp):
+        for j in range(ntr):
+            out[i, j] = ar[i, j] - means[i]
+        if window > 1:
+            # zero-padded boxcar of the demeaned row, as uniform_filter1d(mode='constant')
+            csum = np.zeros(ntr + 1)
+            for j in range(ntr):
+                csum[j + 1] = csum[j] + out[i, j]
+            for j in range(ntr):
+                lo = max(j - half, 0)
+                hi = min(j + half + 1, ntr)
+                out[i, j] -= (csum[hi] - csum[lo]) / window
+    return out
+
+
+@_jit
+def _agc_numba(ar, window):
+    nsamp, ntr = ar.shape
+    out = np.empty((nsamp, ntr))
+    half = window // 2
+    for j in prange(ntr):
+        csum = np.zeros(nsamp + 1)
+        for i in range(nsamp):
+            csum[i + 1] = csum[i] + abs(ar[i, j])
+        for i in range(nsamp):
+            lo = max(i - half, 0)
+            hi = min(i + half + 1, nsamp)
+            env = (csum[hi] - csum[lo]) / window
+            out[i, j] = ar[i, j] / env if env > 0 else 0.0
+    return out
+
+
+@_jit
+def _despike_numba(ar, window, thresh):
+    nsamp, ntr = ar.shape
+    out = np.empty((nsamp, ntr))
+    half = window // 2
+    for j in prange(ntr):
+        med = np.empty(nsamp)
+        buf = np.empty(window)
+        for i in range(nsamp):
+            # edge samples are repeated, as median_filter(mode='nearest')
+            for k in range(window):
+                v = ar[min(max(i - half + k, 0), nsamp - 1), j]
+                # insertion sort, cheaper than np.median for short windows
+                m = k
+                while m > 0 and buf[m - 1] > v:
+                    buf[m] = buf[m - 1]
+                    m -= 1
+                buf[m] = v
+            med[i] = buf[half]
+        resid = np.empty(nsamp)
+        for i in range(nsamp):
+            resid[i] = abs(ar[i, j] - med[i])
+        limit = thresh * 1.4826 * np.median(resid)
+        for i in range(nsamp):
+            out[i, j] = med[i] if resid[i] > limit else ar[i, j]
+    return out
+
+
+@_jit
+def _shift_numba(ar, shifts):
+    nsamp, ntr = ar.shape
+    out = np.empty((nsamp, ntr))
+    for j in prange(ntr):
+        for i in range(nsamp):
+            pos = i + shifts[j]
+            if pos < 0 or pos > nsamp - 1:
+                out[i, j] = 0.0
+            else:
+                # a position on the last sample is in range, with nothing above it to blend in
+                lo = int(np.floor(pos))
+                hi = min(lo + 1, nsamp - 1)
+                frac = pos - lo
+                out[i, j] = ar[lo, j] * (1 - frac) + ar[hi, j] * frac
+    return out
+
+
+@_jit
+def _emd_numba(ar, siftings, max_imf):
+    nsamp, ntr = ar.shape
+    out = np.empty((nsamp, ntr))
+    for j in prange(ntr):
+        r = ar[:, j].copy()
+        h = np.empty(nsamp)
+        mean = np.empty(nsamp)
+        kx = np.empty(nsamp, dtype=np.int64)
+        ky = np.empty(nsamp)
+        m2 = np.empty(nsamp)
+        cp = np.empty(nsamp)
+        dp = np.empty(nsamp)
+        for imf in range(max_imf):
+            count = 0
+            for i in range(1, nsamp - 1):
+                if (r[i] > r[i - 1] and r[i] >= r[i + 1]) or (r[i] < r[i - 1] and r[i] <= r[i + 1]):
+                    count += 1
+            if count <= 2:
+                break
+            for i in range(nsamp):
+                h[i] = r[i]
+            sifted = 0
+            for it in range(siftings):
+                for i in range(nsamp):
+                    mean[i] = 0.0
+                ok = True
+                for env in range(2):
+                    # upper envelope through the maxima, then lower through the minima
+                    sign = 1.0 if env == 0 else -1.0
+                    kx[0] = 0
+                    ky[0] = h[0]
+                    m = 1
+                    for i in range(1, nsamp - 1):
+                        if sign * h[i] > sign * h[i - 1] and sign * h[i] >= sign * h[i + 1]:
+                            kx[m] = i
+                            ky[m] = h[i]
+                            m += 1
+                    if m < 2:
+                        ok = False
+                        break
+                    kx[m] = nsamp - 1
+                    ky[m] = h[nsamp - 1]
+                    m += 1
+                    # natural cubic spline: tridiagonal solve for the second derivatives
+                    cp[0] = 0.0
+                    dp[0] = 0.0
+                    for i in range(1, m - 1):
+                        hl = kx[i] - kx[i - 1]
+                        hr = kx[i + 1] - kx[i]
+                        rhs = 6.0 * ((ky[i + 1] - ky[i]) / hr - (ky[i] - ky[i - 1]) / hl)
+                        den = 2.0 * (hl + hr) - hl * cp[i - 1]
+                        cp[i] = hr / den
+                        dp[i] = (rhs - hl * dp[i - 1]) / den
+                    m2[0] = 0.0
+                    m2[m - 1] = 0.0
+                    for i in range(m - 2, 0, -1):
+                        m2[i] = dp[i] - cp[i] * m2[i + 1]
+                    for s in range(m - 1):
+                        x0 = kx[s]
+                        w = kx[s + 1] - x0
+                        stop = kx[s + 1] + 1 if s == m - 2 else kx[s + 1]
+                        for t in range(x0, stop):
+                            b = (t - x0) / w
+                            a = 1.0 - b
+                            v = a * ky[s] + b * ky[s + 1] + ((a * a * a - a) * m2[s] + (b * b * b - b) * m2[s + 1]) * w * w / 6.0
+                            mean[t] += 0.5 * v
+                if not ok:
+                    break
+                for i in range(nsamp):
+                    h[i] -= mean[i]
+                sifted += 1
+            if sifted == 0:
+                break
+            lo = np.inf
+            hi = -np.inf
+            total = 0.0
+            for i in range(nsamp):
+                r[i] -= h[i]
+                lo = min(lo, r[i])
+                hi = max(hi, r[i])
+                total += abs(r[i])
+            if hi - lo < 1e-3 or total < 5e-3:
+                break
+        for i in range(nsamp):
+            out[i, j] = r[i]
+    return out
+
+
+#------------- NUMPY KERNELS ------------------#
+def _bgr_numpy(ar, window, means):
+    from scipy.ndimage import uniform_filter1d
+    out = ar - means[:, None]
+    if window > 1:
+        out -= uniform_filter1d(out, size=window, mode='constant', cval=0, axis=1)
+    return out
+
+
+def _agc_numpy(ar, window):
+    from scipy.ndimage import uniform_filter1d
+    env = uniform_filter1d(np.abs(ar), size=window, mode='constant', cval=0, axis=0)
+    out = np.zeros_like(env)
+    np.divide(ar, env, out=out, where=env > 0)
+    return out
+
+
+def _despike_numpy(ar, window, thresh):
+    from scipy.ndimage import median_filter
+    med = median_filter(ar, size=(window, 1), mode='nearest')
+    resid = np.abs(ar - med)
+    limit = thresh * 1.4826 * np.median(resid, axis=0)
+    return np.where(resid > limit, med, ar)
+
+
+def _shift_numpy(ar, shifts):
+    n = ar.shape[0]
+    pos = np.arange(n)[:, None] + shifts[None, :]
+    valid = (pos >= 0) & (pos <= n - 1)
+    lo = np.clip(np.floor(pos), 0, n - 1).astype(np.intp)
+    frac = pos - lo
+    hi = np.minimum(lo + 1, n - 1)
+    out = np.take_along_axis(ar, lo, axis=0) * (1 - frac)
+    out += np.take_along_axis(ar, hi, axis=0) * frac
+    out[~valid] = 0
+    return out
+
+
+def _envelope_numpy(h, sign):
+    # natural cubic spline through the maxima of sign * h and both end samples
+    s = sign * h
+    inner = np.flatnonzero((s[1:-1] > s[:-2]) & (s[1:-1] >= s[2:])) + 1
+    if not len(inner):
+        return None
+    knots = np.concatenate(([0], inner, [len(h) - 1]))
+    x0 = knots[:-1]
+    w = np.diff(knots).astype(np.float64)
+    y = h[knots]
+    # tridiagonal system for the second derivatives, solved as in the numba kernel
+    m2 = np.zeros(len(knots))
+    if len(knots) > 2:
+        from scipy.linalg import solve_banded
+        bands = np.zeros((3, len(knots) - 2))
+        bands[0, 1:] = w[1:-1]
+        bands[1] = 2.0 * (w[:-1] + w[1:])
+        bands[2, :-1] = w[1:-1]
+        slope = np.diff(y) / w
+        m2[1:-1] = solve_banded((1, 1), bands, 6.0 * np.diff(slope))
+    seg = np.searchsorted(knots, np.arange(len(h)), side='right') - 1
+    seg[-1] = len(knots) - 2
+    b = (np.arange(len(h)) - x0[seg]) / w[seg]
+    a = 1.0 - b
+    ws = w[seg]
+    return a * y[seg] + b * y[seg + 1] + ((a * a * a - a) * m2[seg] + (b * b * b - b) * m2[seg + 1]) * ws * ws / 6.0
+
+
+def _emd_numpy(ar, siftings, max_imf):
+    out = np.empty_like(ar)
+    for j in range(ar.shape[1]):
+        r = ar[:, j].copy()
+        for imf in range(max_imf):
+            mid = r[1:-1]
+            ext = ((mid > r[:-2]) & (mid >= r[2:])) | ((mid < r[:-2]) & (mid <= r[2:]))
+            if np.count_nonzero(ext) <= 2:
+                break
+            h = r.copy()
+            sifted = 0
+            for it in range(siftings):
+                upper = _envelope_numpy(h, 1.0)
+                lower = None if upper is None else _envelope_numpy(h, -1.0)
+                if lower is None:
+                    break
+                h -= 0.5 * upper + 0.5 * lower
+                sifted += 1
+            if sifted == 0:
+                break
+            r -= h
+            if (r.max() - r.min() < 1e-3) or (np.abs(r).sum() < 5e-3):
+                break
+        out[:, j] = r
+    return out
+
+
+_KERNELS = {
+    'numba': {'bgr': _bgr_numba, 'agc': _agc_numba, 'despike': _despike_numba, 'shift': _shift_numba, 'emd': _emd_numba},
+    'numpy': {'bgr': _bgr_numpy, 'agc': _agc_numpy, 'despike': _despike_numpy, 'shift': _shift_numpy, 'emd': _emd_numpy},
+}
+
+
+#------------- DISPATCH ------------------#
+def bgr(ar, window=0, means=None):
+    """
+    Subtract each row's mean, then (if :code:`window > 1`) a zero-padded moving average of :code:`window` traces.
+
+    :param numpy.ndarray ar: The radar array
+    :param int window: Odd window length in traces, or 0 for full-width only
+    :param numpy.ndarray means: Row means to subtract. Defaults to None, which computes them from :code:`ar`; pass the full-line means when :code:`ar` is only a tile of the line.
+    :rtype: :py:class:`numpy.ndarray` (float64)
+    """
+    if means is None:
+        means = ar.mean(axis=1)
+    return _KERNELS[backend]['bgr'](_float(ar), int(window), _float(means))
+
+
+def agc(ar, window):
+    """
+    Automatic gain control. Divides each sample by the mean absolute amplitude in a vertical window of :code:`window` samples centred on it.
+
+    :param numpy.ndarray ar: The radar array
+    :param int window: Window length in samples
+    :rtype: :py:class:`numpy.ndarray` (float64)
+    """
+    return _KERNELS[backend]['agc'](_float(ar), int(window))
+
+
+def despike(ar, window, thresh):
+    """
+    Median despiking. Samples further than :code:`thresh` robust standard deviations (1.4826 * MAD, per trace) from a vertical running median are replaced by that median.
+
+    :param numpy.ndarray ar: The radar array
+    :param int window: Running median length in samples
+    :param float thresh: Rejection threshold in robust standard deviations
+    :rtype: :py:class:`numpy.ndarray` (float64)
+    """
+    return _KERNELS[backend]['despike'](_float(ar), int(window), float(thresh))
+
+
+def shift(ar, shifts):
+    """
+    Fractional-sample static shift with linear interpolation. Output sample :code:`t` of trace :code:`j` is read from input sample :code:`t + shifts[j]`; positions outside the trace (before the first sample or after the last) give zero. A whole-sample shift copies samples exactly, so a zero shift returns the array unchanged, last sample included::
+
+        >>> ar = np.arange(8.).reshape(4, 2)
+        >>> bool((shift(ar, np.zeros(2)) == ar).all())
+        True
+
+    :param numpy.ndarray ar: The radar array
+    :param numpy.ndarray shifts: Shift in samples for each trace
+    :rtype: :py:class:`numpy.ndarray` (float64)
+    """
+    return _KERNELS[backend]['shift'](_float(ar), _float(shifts))
+
+
+def emd(ar, siftings=15, max_imf=10):
+    """
+    Empirical mode decomposition of each trace, returning its last component: what is left once up to :code:`max_imf` intrinsic mode functions have been sifted out. Each mode is sifted a fixed :code:`siftings` times against the mean of natural cubic spline envelopes through the trace's local extrema and its two end samples. Decomposition stops early when fewer than three extrema remain or the residue is flat.
+
+    :param numpy.ndarray ar: The radar array
+    :param int siftings: Sifting iterations per mode
+    :param int max_imf: Maximum number of modes removed
+    :rtype: :py:class:`numpy.ndarray` (float64)
+    """
+    return _KERNELS[backend]['emd'](_float(ar), int(siftings), int(max_imf))
+
+
+backend = set_backend()
@@ -0,0 +1,170 @@
+import os
+import numpy as np
+from readgssi import readgssi as r
+from pyramid import DisplayPyramid
+from stats import display_stats
+
+# h5py is optional. Without it overview files are neither written nor read and
+# every file is decoded in full on open, as before.
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+OVERVIEW_EXT = '.ovr.h5'
+FORMAT_VERSION = 1 # bump when the layout below changes; older files are then rebuilt
+CHUNK_TRACES = 1024 # columns per HDF5 chunk in the stored levels
+
+STAT_KEYS = ('count', 'mean', 'std', 'min', 'max', 'sampled')
+
+
+#------------- SOURCE FILES ------------------#
+def overview_path(infile):
+    """
+    Location of the overview file kept next to a DZT.
+
+    :param str infile: The DZT file location
+    :rtype: str
+    """
+    return infile + OVERVIEW_EXT
+
+
+def source_signature(infile):
+    """
+    Size and modification time of a DZT, stored in its overview so a changed file is noticed.
+
+    :param str infile: The DZT file location
+    :rtype: tuple of int
+    """
+    st = os.stat(infile)
+    return st.st_size, st.st_mtime_ns
+
+
+def read_header(infile):
+    """
+    Read the header of a DZT without decoding any samples.
+
+    :param str infile: The DZT file location
+    :rtype: :py:class:`dict`
+    """
+    return r.readgssi(infile, num_scans=0)[1]
+
+
+def raw_view(infile, header):
+    """
+    Memory-mapped view of the samples of a DZT with the same shape and dtype :py:func:`backend.dzt_func` returns. Slicing a range of traces only reads those traces from disk.
+
+    :param str infile: The DZT file location
+    :param dict header: The file header, from :py:func:`read_header`
+    :rtype: :py:class:`numpy.memmap` (transposed)
+    """
+    dtype = np.dtype(header['dtype'])
+    rows = header['rh_nsamp'] * header['rh_nchan']
+    ntraces = (os.path.getsize(infile) - header['data_offset']) // (rows * dtype.itemsize)
+    return np.memmap(infile, dtype=dtype, mode='r', offset=header['data_offset'], shape=(ntraces, rows)).T
+
+
+#------------- OVERVIEW FILES ------------------#
+class Overview(object):
+    """
+    An opened overview: the header of the source file, a :py:class:`pyramid.DisplayPyramid` whose decimated levels are read lazily from the HDF5 file and whose level 0 is a memory map of the DZT, and the stored display statistics.
+
+    :param str infile: The DZT file location
+    :param dict header: The file header, completed with the shape, duration and marks stored in the overview
+    :param pyramid.DisplayPyramid pyramid: The display pyramid
+    :param dict stats: Statistics in the form returned by :py:func:`stats.display_stats`
+    """
+    def __init__(self, infile, header, pyramid, stats):
+        self.infile = infile
+        self.header = header
+        self.pyramid = pyramid
+        self.stats = stats
+
+
+def write_overview(infile, ar, header=None, pyramid=None, stats=None, mode='minmax', compression='gzip'):
+    """
+    Write the overview file for a DZT: every decimated level of its display pyramid, chunked along the trace axis and compressed, plus display statistics and the marks, so the next open can draw at once. The file is written under a temporary name and moved into place, so readers never see a partial overview.
+
+    :param str infile: The DZT file location
+    :param numpy.ndarray ar: The raw radar array of the file
+    :param dict header: The file header, used for the marks. Defaults to None (no marks stored).
+    :param pyramid.DisplayPyramid pyramid: Pyramid of :code:`ar` if one was already built
+    :param dict stats: Statistics of :code:`ar` if they were already computed
+    :param str mode: Pyramid mode when :code:`pyramid` is not given
+    :param str compression: HDF5 compression filter
+    :rtype: str (the overview path), or None if h5py is not installed
+    """
+    if h5py is None:
+        return None
+    if pyramid is None:
+        pyramid = DisplayPyramid(ar, mode=mode)
+    if stats is None:
+        stats = display_stats(ar)
+    path = overview_path(infile)
+    tmp = path + '.tmp'
+    size, mtime = source_signature(infile)
+    with h5py.File(tmp, 'w') as f:
+        f.attrs['format_version'] = FORMAT_VERSION
+        f.attrs['source_size'] = size
+        f.attrs['source_mtime_ns'] = mtime
+        f.attrs['shape'] = ar.shape
+        f.attrs['dtype'] = np.dtype(ar.dtype).str
+        f.attrs['mode'] = pyramid.mode
+        f.attrs['factors'] = pyramid.factors
+        levels = f.create_group('levels')
+        for k in range(1, len(pyramid.levels)):
+            group = levels.create_group(str(k))
+            for name, data in zip(('first', 'second'), pyramid.levels[k]):
+                data = np.asarray(data)
+                chunks = (data.shape[0], min(data.shape[1], CHUNK_TRACES)) if data.ndim == 2 else True
+                group.create_dataset(name, data=data, chunks=chunks, compression=compression, shuffle=True)
+        g = f.create_group('stats')
+        for key in STAT_KEYS:
+            g.attrs[key] = stats[key]
+        g.attrs['percentile_keys'] = list(stats['percentiles'].keys())
+        g.attrs['percentile_values'] = list(stats['percentiles'].values())
+        g.create_dataset('hist', data=stats['hist'])
+        g.create_dataset('bin_edges', data=stats['bin_edges'])
+        f.create_dataset('marks', data=np.asarray(header['marks'] if header else [], dtype=np.int64))
+    os.replace(tmp, path)
+    return path
+
+
+def open_overview(infile):
+    """
+    Open the overview file of a DZT if there is an up-to-date one. The HDF5 file stays open for as long as the returned pyramid is in use, so tiles are read from it on demand.
+
+    :param str infile: The DZT file location
+    :rtype: :py:class:`Overview`, or None if there is no overview, it is out of date, or h5py is not installed
+    """
+    path = overview_path(infile)
+    if (h5py is None) or not os.path.isfile(path):
+        return None
+    try:
+        f = h5py.File(path, 'r')
+    except OSError:
+        return None
+    if ((f.attrs.get('format_version') != FORMAT_VERSION)
+            or ((f.attrs['source_size'], f.attrs['source_mtime_ns']) != source_signature(infile))):
+        f.close()
+        return None
+    header = read_header(infile)
+    raw = raw_view(infile, header)
+    if raw.shape != tuple(f.attrs['shape']):
+        f.close()
+        return None
+    header['shape'] = raw.shape
+    try:
+        header['sec'] = raw.shape[1] / float(header['rhf_sps'])
+    except ZeroDivisionError:
+        header['sec'] = 1.
+    header['marks'] = f['marks'][()].tolist()
+    factors = [int(x) for x in f.attrs['factors']]
+    levels = [(f['levels'][str(k)]['first'], f['levels'][str(k)]['second']) for k in range(1, len(factors))]
+    pyramid = DisplayPyramid.from_levels(raw, levels, factors, mode=str(f.attrs['mode']))
+    g = f['stats']
+    stats = {key: g.attrs[key] for key in STAT_KEYS}
+    stats['percentiles'] = dict(zip(g.attrs['percentile_keys'].tolist(), g.attrs['percentile_values'].tolist()))
+    stats['hist'] = g['hist'][()]
+    stats['bin_edges'] = g['bin_edges'][()]
+    return Overview(infile, header, pyramid, stats)
@@ -0,0 +1,94 @@
+import os
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# figure logic shared by data_tab (Qt canvas) and the batch renderer (Agg, no Qt)
+
+
+#------------- PROFILE AXES ------------------#
+def setup_axes(ax, title):
+    """
+    Label an axes for a radargram drawn in distance and two-way time.
+
+    :param matplotlib.axes.Axes ax: The axes
+    :param str title: The axes title, normally the file name
+    """
+    ax.set_ylabel('Two-way Time (ns)')
+    ax.set_xlabel("Distance (m)")
+    ax.set_title(title)
+
+
+def profile_limits(header, ntraces):
+    """
+    Axis limits of a whole profile.
+
+    :param dict header: The file header
+    :param int ntraces: Number of traces in the profile
+    :rtype: x limits (tuple), z limits (tuple, top of the plot last)
+    """
+    # ===== Y-AXIS IN DISTANCE UNITS =======
+    #   zmax = header['rhf_depth'] - header['rhf_top']
+    #   ax.set_ylabel("Depth (m)")
+    # ===== Y-AXIS IN TIME UNITS ==========
+    zmax = time_range(header)
+    # ===== X-AXIS IN DISTANCE UNITS ======
+    xmax = ntraces / header['rhf_spm']
+    # ====== X-AXIS IN TIME UNITS =======
+    #   xmax = header['sec']
+    #   ax.set_xlabel('Time (s)')
+    return (0, xmax), (zmax, 2)
+
+
+def time_range(header):
+    """
+    Two-way time spanned by the samples of a profile in ns: the recorded range, less any samples cropped from the top (see :py:func:`backend.record_crop`).
+
+    :param dict header: The file header
+    :rtype: float
+    """
+    cropped = int(header.get('cropped') or 0)
+    return header['rhf_range'] * (header['rh_nsamp'] - cropped) / header['rh_nsamp']
+
+
+def view_extent(header, c0, c1):
+    """
+    Image extent of traces :code:`c0` to :code:`c1` of a profile.
+
+    :param dict header: The file header
+    :param int c0: First trace
+    :param int c1: Last trace (exclusive)
+    :rtype: list of float
+    """
+    spm = header['rhf_spm']
+    return [c0 / spm, c1 / spm, time_range(header), 2]
+
+
+#------------- STATIC RENDERING ------------------#
+def render_profile(outfile, pyramid, header, title, clim, cmap='gray', figsize=(12, 4), dpi=150):
+    """
+    Draw one profile the way the viewer shows it at full extent and save it, using the Agg canvas directly (no pyplot, no GUI). The pyramid level drawn is the one matching the output width, so long lines cost no more than short ones.
+
+    :param str outfile: Output image; the format follows the extension
+    :param pyramid.DisplayPyramid pyramid: The display pyramid of the profile
+    :param dict header: The file header
+    :param str title: The axes title
+    :param tuple clim: Colour limits
+    :param str cmap: The colormap name
+    :param tuple figsize: Figure size in inches
+    :param int dpi: Dots per inch
+    :rtype: str
+    """
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    ax = figure.subplots()
+    figure.suptitle("DZT Data")
+    setup_axes(ax, title)
+    data, c0, c1, level = pyramid.view(0, pyramid.ntraces, int(figsize[0] * dpi))
+    ax.imshow(data, cmap=cmap, vmin=clim[0], vmax=clim[1], interpolation='bicubic', aspect='auto',
+              extent=view_extent(header, c0, c1))
+    xlim, zlim = profile_limits(header, pyramid.ntraces)
+    ax.set_xlim(*xlim)
+    ax.set_ylim(*zlim)
+    figure.tight_layout()
+    figure.savefig(outfile)
+    return outfile
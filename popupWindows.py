@@ -10,6 +10,7 @@
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 import time
+import numpy as np
 
 
 class Export_Dialog(QtWidgets.QDialog):
@@ -62,6 +63,9 @@ class Export_Dialog(QtWidgets.QDialog):
         self.format_selection_box.setObjectName("format_selection_box")
         self.format_selection_box.addItem("")
         self.format_selection_box.addItem("")
+        self.format_selection_box.addItem("")
+        self.format_selection_box.addItem("")
+        self.format_selection_box.addItem("")
         self.output_layout.addWidget(self.format_selection_box)
         self.buttonBox = QtWidgets.QDialogButtonBox(Dialog)
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
@@ -86,6 +90,9 @@ class Export_Dialog(QtWidgets.QDialog):
         self.format_selection_box.setCurrentText(_translate("Dialog", "PNG"))
         self.format_selection_box.setItemText(0, _translate("Dialog", "PNG"))
         self.format_selection_box.setItemText(1, _translate("Dialog", "CSV"))
+        self.format_selection_box.setItemText(2, _translate("Dialog", "TIFF"))
+        self.format_selection_box.setItemText(3, _translate("Dialog", "HDF5"))
+        self.format_selection_box.setItemText(4, _translate("Dialog", "SEG-Y"))
 
 class Writing_Dialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
@@ -142,3 +149,73 @@ class Alert_Dialog(QtWidgets.QDialog):
         movie.setScaledSize(QtCore.QSize(200, 50))
         self.load_label.setMovie(movie)
         movie.start()
+
+class Slice_Dialog(QtWidgets.QDialog):
+    # browses horizontal slices of a cube (see cube.py); slices are read at a stride that fits the canvas
+    def __init__(self, cube, parent=None):
+        super().__init__()
+        self.cube = cube
+        self.setupUi(self)
+        self.draw_slice()
+
+    def setupUi(self, Dialog):
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+        from matplotlib.figure import Figure
+        Dialog.setObjectName("SDialog")
+        Dialog.resize(800, 700)
+        Dialog.setWindowTitle("Time Slices")
+        self.layout = QtWidgets.QVBoxLayout(Dialog)
+        self.figure = Figure()
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.layout.addWidget(self.canvas, 1)
+        self.ax = self.figure.add_subplot(111)
+        self.ax.set_xlabel("x (m)")
+        self.ax.set_ylabel("y (m)")
+        self.image = None
+        self.controls = QtWidgets.QHBoxLayout()
+        self.slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.slider.setRange(0, self.cube.nt - 1)
+        self.slider.setValue(min(self.cube.nt - 1, self.cube.zero))
+        self.slider.valueChanged.connect(self.draw_slice)
+        self.controls.addWidget(self.slider, 1)
+        self.window_box = QtWidgets.QSpinBox()
+        self.window_box.setPrefix("Window: ")
+        self.window_box.setRange(1, self.cube.nt)
+        self.window_box.setValue(8)
+        self.window_box.valueChanged.connect(self.draw_slice)
+        self.controls.addWidget(self.window_box)
+        self.mode_box = QtWidgets.QComboBox()
+        self.mode_box.addItems(["Amplitude", "Envelope", "Instant"])
+        self.mode_box.currentIndexChanged.connect(self.draw_slice)
+        self.controls.addWidget(self.mode_box)
+        self.layout.addLayout(self.controls)
+        self.position_label = QtWidgets.QLabel()
+        self.layout.addWidget(self.position_label)
+
+    def draw_slice(self, *args):
+        sample, window = self.slider.value(), self.window_box.value()
+        mode = self.mode_box.currentText().lower()
+        # one cube cell per canvas pixel is as fine as the slice can be drawn
+        width, height = max(1, self.canvas.width()), max(1, self.canvas.height())
+        step = max(1, min(self.cube.nx // width, self.cube.ny // height))
+        values = self.cube.slice(sample, window, mode, step)
+        finite = values[np.isfinite(values)]
+        vmin, vmax = np.percentile(finite, (1, 99)) if finite.size else (0, 1)
+        if self.image is None:
+            cmap = 'seismic' if mode == 'instant' else 'viridis'
+            self.image = self.ax.imshow(values, origin='lower', extent=self.cube.extent(), cmap=cmap, aspect='equal', interpolation='nearest')
+        else:
+            self.image.set_data(values)
+            self.image.set_cmap('seismic' if mode == 'instant' else 'viridis')
+        if mode == 'instant':
+            vmax = max(abs(vmin), abs(vmax))
+            vmin = -vmax
+        self.image.set_clim(vmin, vmax)
+        end = min(self.cube.nt, sample + window)
+        self.position_label.setText("Samples %d-%d  |  %.1f-%.1f ns  |  depth %.2f-%.2f m" %(sample, end - 1,
+                                    self.cube.time_ns(sample), self.cube.time_ns(end), self.cube.depth(sample), self.cube.depth(end)))
+        self.canvas.draw_idle()
+
+    def closeEvent(self, event):
+        self.cube.close()
+        super().closeEvent(event)
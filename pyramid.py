@@ -0,0 +1,146 @@
+import math
+import numpy as np
+
+
+#------------- DISPLAY PYRAMID ------------------#
+class DisplayPyramid(object):
+    """
+    Level-of-detail copies of a radar array for display. Level 0 is the array itself; level :code:`k > 0` bins :code:`2 ** (k + 1)` traces at a time and keeps, per sample row, either the minimum and maximum of each bin (:code:`mode='minmax'`, shown as two interleaved columns so peaks of both polarities survive) or the RMS envelope of the bin (:code:`mode='rms'`, one column). Each level therefore has half the columns of the one before it.
+
+    Levels are built once, with :py:func:`numpy.ufunc.reduceat` along the trace axis, until a level is narrower than :code:`min_width` columns. The viewer then asks :py:meth:`view` for the coarsest level that still has at least one column per screen pixel in the visible trace range.
+
+    :param numpy.ndarray ar: The radar array
+    :param str mode: 'minmax' or 'rms'
+    :param int min_width: Stop adding levels once a level has fewer columns than this
+    """
+    def __init__(self, ar, mode='minmax', min_width=512):
+        if mode not in ('minmax', 'rms'):
+            raise ValueError('unknown pyramid mode "%s"' % mode)
+        self.mode = mode
+        self.shape = ar.shape
+        self.ntraces = ar.shape[1]
+        self.levels = [ar]
+        self.factors = [1]
+        factor = 4
+        prev = None
+        while self.columns(len(self.levels), factor) >= min_width:
+            prev = self._build(ar, prev, factor)
+            self.levels.append(prev)
+            self.factors.append(factor)
+            factor *= 2
+
+    @classmethod
+    def from_levels(cls, ar, levels, factors, mode='minmax'):
+        """
+        Rebuild a pyramid from levels computed earlier (e.g. read back from an overview file) without touching the data. Level arrays only need to support 2-D slicing, so on-disk datasets and memory maps work as well as in-memory arrays.
+
+        :param ar: Level 0, the full-resolution array
+        :param list levels: The decimated levels, as stored in :code:`levels[1:]`
+        :param list factors: Traces per bin of each level, starting with 1 for level 0
+        :param str mode: 'minmax' or 'rms'
+        :rtype: :py:class:`DisplayPyramid`
+        """
+        self = cls.__new__(cls)
+        self.mode = mode
+        self.shape = ar.shape
+        self.ntraces = ar.shape[1]
+        self.levels = [ar] + list(levels)
+        self.factors = list(factors)
+        return self
+
+    def _build(self, ar, prev, factor):
+        if prev is None:
+            # first decimated level comes straight from the data
+            starts = np.arange(0, self.ntraces, factor)
+            if self.mode == 'minmax':
+                return (np.minimum.reduceat(ar, starts, axis=1), np.maximum.reduceat(ar, starts, axis=1))
+            sq = np.add.reduceat(np.square(ar, dtype=np.float32), starts, axis=1)
+            counts = np.diff(np.append(starts, self.ntraces))
+            return (sq, counts)
+        # later levels merge pairs of bins from the level before
+        starts = np.arange(0, prev[0].shape[1], 2)
+        if self.mode == 'minmax':
+            return (np.minimum.reduceat(prev[0], starts, axis=1), np.maximum.reduceat(prev[1], starts, axis=1))
+        return (np.add.reduceat(prev[0], starts, axis=1), np.add.reduceat(prev[1], starts))
+
+    def columns(self, level, factor=None):
+        """
+        Number of display columns a level has across the whole line.
+
+        :param int level: The level index
+        :param int factor: Traces per bin; defaults to the factor of an existing level
+        :rtype: int
+        """
+        if level == 0:
+            return self.ntraces
+        if factor is None:
+            factor = self.factors[level]
+        bins = int(math.ceil(self.ntraces / float(factor)))
+        return 2 * bins if self.mode == 'minmax' else bins
+
+    def traces_per_column(self, level):
+        """
+        Number of traces each display column of a level stands for.
+
+        :param int level: The level index
+        :rtype: int
+        """
+        if level == 0:
+            return 1
+        return self.factors[level] // 2 if self.mode == 'minmax' else self.factors[level]
+
+    def level_data(self, level, j0, j1):
+        """
+        Display columns :code:`j0` to :code:`j1` (exclusive) of a level.
+
+        :param int level: The level index
+        :param int j0: First column
+        :param int j1: Last column (exclusive)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        if level == 0:
+            return self.levels[0][:, j0:j1]
+        first, second = self.levels[level]
+        if self.mode == 'minmax':
+            # columns alternate min, max per bin
+            b0, b1 = j0 // 2, (j1 + 1) // 2
+            data = np.empty((first.shape[0], 2 * (b1 - b0)), dtype=first.dtype)
+            data[:, 0::2] = first[:, b0:b1]
+            data[:, 1::2] = second[:, b0:b1]
+            return data[:, j0 - 2 * b0:j1 - 2 * b0]
+        return np.sqrt(first[:, j0:j1] / second[j0:j1])
+
+    def level_for(self, c0, c1, pixels):
+        """
+        Pick the coarsest level that keeps at least one column per pixel over traces :code:`c0` to :code:`c1`.
+
+        :param int c0: First visible trace
+        :param int c1: Last visible trace (exclusive)
+        :param int pixels: Width of the view in screen pixels
+        :rtype: int
+        """
+        traces = max(c1 - c0, 1)
+        level = 0
+        for k in range(1, len(self.levels)):
+            if traces * self.columns(k) / float(self.ntraces) >= pixels:
+                level = k
+        return level
+
+    def view(self, c0, c1, pixels, level=None):
+        """
+        Display data for traces :code:`c0` to :code:`c1` at the level matching the screen width.
+
+        :param int c0: First visible trace
+        :param int c1: Last visible trace (exclusive)
+        :param int pixels: Width of the view in screen pixels
+        :param int level: Force a level instead of choosing one
+        :rtype: data (:py:class:`numpy.ndarray`), first trace covered (:py:class:`int`), last trace covered (:py:class:`int`, exclusive), level (:py:class:`int`)
+        """
+        c0 = int(min(max(c0, 0), self.ntraces - 1))
+        c1 = int(min(max(c1, c0 + 1), self.ntraces))
+        if level is None:
+            level = self.level_for(c0, c1, pixels)
+        scale = self.traces_per_column(level)
+        j0 = c0 // scale
+        j1 = min(int(math.ceil(c1 / float(scale))), self.columns(level))
+        return self.level_data(level, j0, j1), j0 * scale, min(j1 * scale, self.ntraces), level
@@ -1,4 +1,11 @@
-from . import _version
-
 name = 'readgssi'
-__version__ = _version.version
+
+try:
+    from ._version import version as __version__
+except ImportError:
+    # _version.py is written at build time; fall back to the installed package metadata
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        __version__ = version(name)
+    except PackageNotFoundError:
+        __version__ = 'unknown'
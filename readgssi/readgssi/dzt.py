@@ -2,7 +2,6 @@ import struct
 import math
 import os
 import numpy as np
-from pandas import DataFrame
 from datetime import datetime
 from itertools import takewhile
 from readgssi.constants import *
@@ -74,7 +73,7 @@ def readtime(bytez):
     return new_arr'''
 
 
-def readdzt(infile, gps=DataFrame(), spm=None, start_scan=0, num_scans=-1,
+def readdzt(infile, gps=None, spm=None, start_scan=0, num_scans=-1,
             epsr=None, antfreq=[None,None,None,None], verbose=False,
             zero=[None,None,None,None]):
     """
@@ -277,6 +276,7 @@ def readdzt(infile, gps=DataFrame(), spm=None, start_scan=0, num_scans=-1,
         num_items = -1
             
     # read in and transpose data
+    infile.seek(header['data_offset'] + start_offset)
     data = np.fromfile(infile, dtype, count=num_items)
     data = data.reshape(-1,(header['rh_nsamp']*header['rh_nchan'])) # offset=start_offset,
     data = data.T
@@ -299,6 +299,7 @@ def readdzt(infile, gps=DataFrame(), spm=None, start_scan=0, num_scans=-1,
         except (TypeError, IndexError):
            header['timezero'][i] = header['rh_zero']
     
+    from pandas import DataFrame
     gps = DataFrame()
 
     header['marks'] = []
@@ -0,0 +1,248 @@
+import base64
+import json
+import os
+from datetime import datetime
+import numpy as np
+import readgssi.functions as fx
+
+"""
+HDF5 survey containers: many profiles in one file, each stored chunked by
+blocks of traces and compressed, with its header, marks, GPS and the filter
+chain that produced it. h5py is imported when a container is opened.
+"""
+
+CONTAINER_VERSION = 1
+CHUNK_BYTES = 2**20 # target size of one chunk (all samples of a block of traces)
+
+
+def _h5py():
+    import h5py
+    return h5py
+
+
+#------------- HEADER ENCODING ------------------#
+class _HeaderEncoder(json.JSONEncoder):
+    # header values JSON can't hold are tagged so they decode to the same types
+    def default(self, o):
+        if isinstance(o, bytes):
+            return {'__bytes__': base64.b64encode(o).decode('ascii')}
+        if isinstance(o, datetime):
+            return {'__datetime__': o.isoformat()}
+        if isinstance(o, type) and issubclass(o, np.generic):
+            return {'__dtype__': np.dtype(o).str}
+        if isinstance(o, np.dtype):
+            return {'__dtype__': o.str}
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return str(o)
+
+
+def _decode_header(obj):
+    if '__bytes__' in obj:
+        return base64.b64decode(obj['__bytes__'])
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__dtype__' in obj:
+        return np.dtype(obj['__dtype__']).type
+    return obj
+
+
+def encode_header(header):
+    """
+    Serialize a header dictionary to JSON without losing bytes, dates or the sample dtype.
+
+    :param dict header: The file header dictionary
+    :rtype: str
+    """
+    return json.dumps(header, cls=_HeaderEncoder)
+
+
+def decode_header(text):
+    """
+    Inverse of :py:func:`encode_header`.
+
+    :param str text: The JSON text
+    :rtype: dict
+    """
+    return json.loads(text, object_hook=_decode_header)
+
+
+#------------- WRITING ------------------#
+class SurveyWriter(object):
+    """
+    Writes profiles into an HDF5 container. Each profile is a group under :code:`/profiles` holding:
+
+    * :code:`data` -- the radar array (samples x traces), chunked by blocks of traces, compressed, and grown as blocks are appended, so a line never has to be in memory at once
+    * :code:`marks` -- user mark trace numbers
+    * :code:`gps` -- GPS records as a compound dataset, if any
+
+    The group attributes hold the full header (attribute :code:`header`, see :py:func:`encode_header`), the common scalar header values as individual attributes for other HDF5 tools, the source file name and the filter chain as JSON.
+
+    Usage: ::
+
+        with SurveyWriter('survey.h5') as w:
+            w.write_profile('FILE__001', ar, header, filters=[['Automatic gain control', ['window=25']]])
+
+    :param str path: Output file
+    :param str mode: 'w' to create or truncate, 'a' to add profiles to an existing container
+    :param str compression: HDF5 compression filter
+    :param int compression_opts: Compression level
+    """
+    def __init__(self, path, mode='w', compression='gzip', compression_opts=4):
+        self.file = _h5py().File(path, mode)
+        self.file.attrs['container_version'] = CONTAINER_VERSION
+        self.profiles = self.file.require_group('profiles')
+        self.compression = compression
+        self.compression_opts = compression_opts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def create_profile(self, name, header, nsamp, dtype, filters=None, gps=None):
+        """
+        Create an empty profile to append traces to.
+
+        :param str name: The profile name, unique in the container
+        :param dict header: The file header dictionary
+        :param int nsamp: Samples per trace (rows of the array)
+        :param dtype: Sample dtype
+        :param filters: JSON-serializable record of the filter chain applied, or None
+        :param gps: GPS records (:py:class:`pandas.DataFrame` or structured array), or None
+        :rtype: :py:class:`h5py.Group`
+        """
+        if name in self.profiles:
+            del self.profiles[name]
+        group = self.profiles.create_group(name)
+        dtype = np.dtype(dtype)
+        chunk = max(16, CHUNK_BYTES // max(nsamp * dtype.itemsize, 1))
+        group.create_dataset('data', shape=(nsamp, 0), maxshape=(nsamp, None), dtype=dtype,
+                             chunks=(nsamp, chunk), compression=self.compression,
+                             compression_opts=self.compression_opts, shuffle=True)
+        group.create_dataset('marks', data=np.asarray(header.get('marks', []), dtype=np.int64))
+        if gps is not None and len(gps):
+            records = gps.to_records(index=False) if hasattr(gps, 'to_records') else np.asarray(gps)
+            group.create_dataset('gps', data=records, compression=self.compression)
+        group.attrs['header'] = encode_header(header)
+        group.attrs['filters'] = json.dumps(filters if filters is not None else [])
+        group.attrs['source'] = os.path.basename(str(header.get('infile', '')))
+        for key, value in header.items():
+            # scalars only; everything is in the 'header' attribute anyway
+            if isinstance(value, (int, float, str, np.integer, np.floating)) and not isinstance(value, bool):
+                group.attrs[key] = value
+        return group
+
+    def append(self, name, block):
+        """
+        Append a block of traces to a profile.
+
+        :param str name: The profile name
+        :param numpy.ndarray block: Traces to add (samples x traces)
+        """
+        data = self.profiles[name]['data']
+        n = data.shape[1]
+        data.resize(n + block.shape[1], axis=1)
+        data[:, n:] = block
+
+    def write_profile(self, name, ar, header, filters=None, gps=None, block=None, verbose=False):
+        """
+        Write a whole profile, a chunk-aligned block of traces at a time (so memory maps are never read in full).
+
+        :param str name: The profile name
+        :param numpy.ndarray ar: The radar array
+        :param dict header: The file header dictionary
+        :param filters: Record of the filter chain applied, or None
+        :param gps: GPS records, or None
+        :param int block: Traces per write. Defaults to None, which uses a multiple of the chunk width near 16 MB.
+        :param bool verbose: Verbose, defaults to False
+        """
+        group = self.create_profile(name, header, ar.shape[0], ar.dtype, filters=filters, gps=gps)
+        if block is None:
+            chunk = group['data'].chunks[1]
+            block = chunk * max(1, 16 * CHUNK_BYTES // (chunk * max(ar.shape[0] * ar.dtype.itemsize, 1)))
+        if verbose:
+            fx.printmsg('writing profile %s (%d traces) to %s' % (name, ar.shape[1], self.file.filename))
+        group['data'].resize(ar.shape[1], axis=1)
+        for a in range(0, ar.shape[1], block):
+            group['data'][:, a:a + block] = ar[:, a:a + block]
+
+
+#------------- READING ------------------#
+class SurveyReader(object):
+    """
+    Reads profiles back from a container written by :py:class:`SurveyWriter`. :py:meth:`data` returns the on-disk dataset, so slicing a range of traces only decompresses the chunks it touches.
+
+    :param str path: The container file
+    """
+    def __init__(self, path):
+        self.file = _h5py().File(path, 'r')
+        self.profiles = list(self.file['profiles'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def data(self, name):
+        """
+        :param str name: The profile name
+        :rtype: :py:class:`h5py.Dataset`
+        """
+        return self.file['profiles'][name]['data']
+
+    def header(self, name):
+        """
+        The header of a profile, with :code:`marks` and :code:`shape` as stored.
+
+        :param str name: The profile name
+        :rtype: dict
+        """
+        group = self.file['profiles'][name]
+        header = decode_header(group.attrs['header'])
+        header['marks'] = group['marks'][()].tolist()
+        header['shape'] = group['data'].shape
+        return header
+
+    def filters(self, name):
+        """
+        :param str name: The profile name
+        :rtype: the filter chain record stored with the profile
+        """
+        return json.loads(self.file['profiles'][name].attrs['filters'])
+
+    def gps(self, name):
+        """
+        :param str name: The profile name
+        :rtype: :py:class:`numpy.ndarray` (structured), or None
+        """
+        group = self.file['profiles'][name]
+        return group['gps'][()] if 'gps' in group else None
+
+
+def read_h5(infile, profile=None, start_scan=0, num_scans=-1):
+    """
+    Read one profile from a container, optionally only a range of traces, with the same trace-window arguments as :py:func:`readgssi.dzt.readdzt`.
+
+    :param str infile: The container file
+    :param str profile: The profile name. Defaults to None, which reads the first profile.
+    :param int start_scan: Zero-based first trace to read
+    :param int num_scans: Number of traces to read. Defaults to -1, which reads to the end.
+    :rtype: radar array (:py:class:`numpy.ndarray`), header (:py:class:`dict`)
+    """
+    with SurveyReader(infile) as r:
+        if profile is None:
+            profile = r.profiles[0]
+        data = r.data(profile)
+        stop = data.shape[1] if num_scans == -1 else min(start_scan + num_scans, data.shape[1])
+        return data[:, start_scan:stop], r.header(profile)
@@ -1,9 +1,7 @@
-import h5py
-import pandas as pd
+import os
 import numpy as np
 import json
 import struct
-from readgssi.gps import readdzg
 import readgssi.functions as fx
 from datetime import datetime
 
@@ -24,24 +22,117 @@ def json_header(header, outfile_abspath, verbose=False):
             fx.printmsg('serializing header as %s' % (f.name))
         json.dump(obj=header, fp=f, indent=4, sort_keys=True, default=str)
 
-def csv(ar, outfile_abspath, header=None, verbose=False):
+def csv_format(ar):
     """
-    Output to csv. Data is read into a :py:class:`pandas.DataFrame`, then written using :py:func:`pandas.DataFrame.to_csv`.
+    Default number format for :py:func:`csv`: integers as integers, floats with 10 significant digits (more than the 32-bit samples a DZT can hold).
 
     :param numpy.ndarray ar: Radar array
-    :param str outfile_abspath: Output file path
+    :rtype: str
+    """
+    return '%d' if np.issubdtype(ar.dtype, np.integer) else '%.10g'
+
+def csv(ar, outfile_abspath, header=None, verbose=False, fmt=None, delimiter=',', gzip=False, block=None):
+    """
+    Output to csv (or another delimited text format). The layout is the one :py:func:`pandas.DataFrame.to_csv` produces: a header row of column numbers, then one row per sample with the row number first. Rows are formatted a block at a time with one %-format string per block and streamed to disk, so the text never sits in memory whole and nothing goes through pandas.
+
+    :param numpy.ndarray ar: Radar array
+    :param str outfile_abspath: Output file path, without extension
     :param dict header: File header dictionary to write, if desired. Defaults to None.
     :param bool verbose: Verbose, defaults to False
+    :param str fmt: %-format for one value. Defaults to None, which resolves to :py:func:`csv_format`.
+    :param str delimiter: Field separator. A tab gives a .tsv file.
+    :param bool gzip: Whether to gzip the output (adds .gz to the name)
+    :param int block: Rows formatted at a time. Defaults to None, which picks about a million values per block.
+    :rtype: str (the output file)
     """
+    import gzip as gz
+    if fmt is None:
+        fmt = csv_format(ar)
+    if block is None:
+        block = max(1, 2**20 // max(ar.shape[1], 1))
+    outfile = '%s.%s%s' % (outfile_abspath, 'tsv' if delimiter == '\t' else 'csv', '.gz' if gzip else '')
     if verbose:
         t = ''
         if header:
             t = ' with json header'
-        fx.printmsg('output format is csv%s. writing data to: %s.csv' % (t, outfile_abspath))
-    data = pd.DataFrame(ar) # using pandas to output csv
-    data.to_csv('%s.csv' % (outfile_abspath)) # write
+        fx.printmsg('output format is csv%s. writing data to: %s' % (t, outfile))
+    # index column, then one value per trace
+    row = '%d' + delimiter + delimiter.join([fmt] * ar.shape[1]) + '\n'
+    index = np.arange(ar.shape[0])[:, None]
+    f = gz.open(outfile, 'wt', compresslevel=6) if gzip else open(outfile, 'w')
+    with f:
+        f.write(delimiter + delimiter.join(str(i) for i in range(ar.shape[1])) + '\n')
+        for a in range(0, ar.shape[0], block):
+            b = min(a + block, ar.shape[0])
+            rows = np.hstack((index[a:b], ar[a:b]))
+            f.write((row * (b - a)) % tuple(rows.ravel().tolist()))
     if header:
         json_header(header=header, outfile_abspath=outfile_abspath, verbose=verbose)
+    return outfile
+
+def csv_many(arrays, outfiles_abspath, headers=None, workers=None, **kwargs):
+    """
+    Write several arrays with :py:func:`csv` at once, one worker process per file (text formatting is CPU-bound, so threads would not help). Arrays are not pickled to the workers: each is copied into a :py:class:`multiprocessing.shared_memory.SharedMemory` block that the worker attaches to by name, and only as many blocks as there are workers exist at a time.
+
+    :param list arrays: Radar arrays
+    :param list outfiles_abspath: Output file paths, without extension
+    :param list headers: File header dictionaries to write alongside, or None
+    :param int workers: Number of worker processes. Defaults to None, which uses one per CPU (at most one per file).
+    :param kwargs: Passed on to :py:func:`csv`
+    :rtype: list of str (the output files)
+    """
+    import concurrent.futures
+    import multiprocessing
+    from multiprocessing import shared_memory
+    if headers is None:
+        headers = [None] * len(arrays)
+    if (len(arrays) == 1) or (workers == 1):
+        return [csv(ar, out, header=h, **kwargs) for ar, out, h in zip(arrays, outfiles_abspath, headers)]
+    workers = min(workers or os.cpu_count() or 1, len(arrays))
+    outfiles = [None] * len(arrays)
+    running = {}
+    # spawn rather than fork, which is unsafe when the caller has threads running (e.g. a GUI)
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        try:
+            for i, (ar, out, h) in enumerate(zip(arrays, outfiles_abspath, headers)):
+                if len(running) >= workers:
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        j, done_block = running.pop(future)
+                        outfiles[j] = _csv_collect(future, done_block)
+                block = shared_memory.SharedMemory(create=True, size=max(ar.nbytes, 1))
+                np.ndarray(ar.shape, dtype=ar.dtype, buffer=block.buf)[...] = ar
+                running[pool.submit(_csv_shared, block.name, ar.shape, ar.dtype.str, out, h, kwargs)] = (i, block)
+            for future in concurrent.futures.as_completed(list(running)):
+                j, done_block = running.pop(future)
+                outfiles[j] = _csv_collect(future, done_block)
+        finally:
+            for future, (i, block) in running.items():
+                future.cancel()
+                concurrent.futures.wait([future])
+                block.close()
+                block.unlink()
+    return outfiles
+
+def _csv_collect(future, block):
+    # result of a csv_many() worker, freeing its block either way
+    try:
+        return future.result()
+    finally:
+        block.close()
+        block.unlink()
+
+def _csv_shared(name, shape, dtype, outfile_abspath, header, kwargs):
+    # worker side of csv_many(): attach to the array's block by name and write it
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(name=name)
+    ar = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    try:
+        return csv(ar, outfile_abspath, header=header, **kwargs)
+    finally:
+        del ar
+        block.close()
 
 def numpy(ar, outfile_abspath, header=None, verbose=False):
     """
@@ -62,6 +153,27 @@ def numpy(ar, outfile_abspath, header=None, verbose=False):
     if header:
         json_header(header=header, outfile_abspath=outfile_abspath, verbose=verbose)
 
+def h5(ar, outfile_abspath, header, verbose=False, filters=None, mode='w'):
+    """
+    Output to an HDF5 survey container (see :py:class:`readgssi.h5.SurveyWriter`). The profile is named after the input file. With :code:`mode='a'` the profile is added to an existing container, so a whole survey can go into one file.
+
+    :param numpy.ndarray ar: Radar array
+    :param str outfile_abspath: Output file path, without extension
+    :param dict header: File header dictionary
+    :param bool verbose: Verbose, defaults to False
+    :param filters: JSON-serializable record of the filters applied, or None
+    :param str mode: 'w' to create the container, 'a' to add to it
+    :rtype: str (the output file)
+    """
+    from readgssi.h5 import SurveyWriter
+    outfile = '%s.h5' % outfile_abspath
+    name = os.path.splitext(os.path.basename(str(header.get('infile') or outfile_abspath)))[0]
+    if verbose:
+        fx.printmsg('output format is hdf5. writing profile %s to: %s' % (name, outfile))
+    with SurveyWriter(outfile, mode=mode) as w:
+        w.write_profile(name, ar, header, filters=filters, verbose=verbose)
+    return outfile
+
 def writetime(d):
     '''
     Function to write dates to :code:`rfDateByte` binary objects in DZT headers.
@@ -99,9 +211,62 @@ def writetime(d):
     # return a byte array
     return bytes([byt0, byt1, byt2, byt3])
 
-def dzt(ar, outfile_abspath, header, verbose=False):
+# fixed 128-byte part of each channel header (see readgssi.dzt.readdzt for the field meanings)
+DZT_HEADER = struct.Struct('<5h5fh4s4s7h3f3f3xB3h2f1s1s14s1s1s12s2s')
+DZT_BLOCK = 4096 # traces per block when writing DZT data
+
+def dzt_channels(ar, header):
+    """
+    Split the array(s) given to :py:func:`dzt` into channels and the number of zeroed time-zero rows to restore above each.
+
+    :param ar: A list of per-channel arrays with their time-zero rows removed (zero rows are restored from :code:`header['timezero']`), or a single array as read by :py:func:`readgssi.dzt.readdzt` (channels stacked vertically, :code:`rh_nchan * rh_nsamp` rows, nothing restored). A single array with any other number of rows is taken as the only channel with rows cropped from its top: :code:`header['cropped']` of them if the header records a crop, else :code:`header['timezero']`.
+    :param dict header: File header dictionary
+    :rtype: list of (array, padding rows) tuples
     """
-    .. warning:: DZT output is only currently compatible with single-channel files.
+    nchan = header['rh_nchan']
+    if isinstance(ar, np.ndarray) and (ar.ndim == 2):
+        if ar.shape[0] == nchan * header['rh_nsamp']:
+            n = header['rh_nsamp']
+            return [(ar[i * n:(i + 1) * n], 0) for i in range(nchan)]
+        if nchan != 1:
+            raise ValueError('array has %d rows; a %d-channel DZT needs %d, or pass a list of channel arrays'
+                             % (ar.shape[0], nchan, nchan * header['rh_nsamp']))
+        if header.get('cropped') is not None:
+            return [(ar, int(header['cropped']))]
+        ar = [ar]
+    if len(ar) != nchan:
+        raise ValueError('got %d channel arrays for a %d-channel header' % (len(ar), nchan))
+    return [(ar[i], int(header['timezero'][i] or 0)) for i in range(nchan)]
+
+def dzt_header(header, chan, nsamp):
+    """
+    Pack one channel's header (:py:data:`readgssi.constants.MINHEADSIZE` bytes) in a single :py:func:`struct.pack`.
+
+    :param dict header: File header dictionary
+    :param int chan: Channel number
+    :param int nsamp: Samples per trace per channel in the output
+    :rtype: bytes
+    """
+    fixed = DZT_HEADER.pack(
+        header['rh_tag'], header['rh_data'], nsamp,
+        32, # rh_bits - for simplicity, just hard-coding 32 bit
+        header['rh_zero'],
+        header['rhf_sps'], header['rhf_spm'], header['rhf_mpm'], header['rhf_position'], header['rhf_range'],
+        header['rh_npass'],
+        writetime(header['rhb_cdt']), writetime(datetime.now()), # creation, modification date/time
+        header['rh_rgain'], header['rh_nrgain'], header['rh_text'], header['rh_ntext'],
+        header['rh_proc'], header['rh_nproc'], header['rh_nchan'],
+        header['rhf_epsr'], header['rhf_top'], header['rhf_depth'],
+        header['rh_xstart'], header['rh_xend'], header['rhf_servo_level'], # part of rh_coordx
+        header['rh_accomp'], header['rh_sconfig'], header['rh_spp'], header['rh_linenum'],
+        header['rh_ystart'], header['rh_yend'], # part of rh_coordy
+        header['rh_96'], header['rh_dtype'], header['dzt_ant'][chan], header['rh_112'],
+        header['vsbyte'], header['rh_name'], header['rh_chksum'])
+    return fixed + header['INFOAREA'] + header['rh_RGPS0'] + header['rh_RGPS1']
+
+def dzt(ar, outfile_abspath, header, verbose=False, block=DZT_BLOCK):
+    """
+    Output a RADAN-compatible DZT file, single- or multi-channel.
 
     This function will output a RADAN-compatible DZT file after processing.
     This is useful to circumvent RADAN's distance-normalization bug
@@ -128,101 +293,200 @@ def dzt(ar, outfile_abspath, header, verbose=False):
 
     This will output :code:`FILE__001-DnS10.DZT` as a distance-normalized DZT.
 
-    :param numpy.ndarray ar: Radar array
-    :param str infile_basename: Input file basename
+    The header of each channel is packed in one go (:py:func:`dzt_header`). The data is then streamed a block of traces at a time. Each block is rounded to the 32-bit signed integers RADAN reads. Channels are interleaved trace by trace, and the zeroed time-zero rows are restored in place. So writing takes one block of memory, however long the line.
+
+    :param ar: Radar array(s); see :py:func:`dzt_channels` for the accepted layouts
     :param str outfile_abspath: Output file path
-    :param dict header: File header dictionary to write, if desired. Defaults to None.
+    :param dict header: File header dictionary
     :param bool verbose: Verbose, defaults to False
+    :param int block: Traces per block
+    :rtype: str (the output file)
     """
 
     '''
     Assumptions:
     - constant velocity or distance between marks (may be possible to add a check)
     '''
-    if len(ar) > 1:
+    channels = dzt_channels(ar, header)
+    if (not isinstance(ar, np.ndarray)) and (len(ar) > 1):
         outfile_abspath = outfile_abspath.replace('c1', '')
     if not outfile_abspath.endswith(('.DZT', '.dzt')):
         outfile_abspath = outfile_abspath + '.DZT'
-    
-    outfile = open(outfile_abspath, 'wb')
-    fx.printmsg('writing to: %s' % outfile.name)
-
-    for i in range(header['rh_nchan']):
-        fx.printmsg('writing DZT header for channel %s' % (i))
-        # header should read all values per-channel no matter what
-        outfile.write(struct.pack('<h', header['rh_tag']))
-        outfile.write(struct.pack('<h', header['rh_data']))
-        outfile.write(struct.pack('<h', header['rh_nsamp']))
-        outfile.write(struct.pack('<h', 32)) # rhf_bits - for simplicity, just hard-coding 32 bit
-        outfile.write(struct.pack('<h', header['rh_zero']))
-        # byte 10
-        outfile.write(struct.pack('<f', header['rhf_sps']))
-        outfile.write(struct.pack('<f', header['rhf_spm'])) # dzt.py ln 94-97
-        outfile.write(struct.pack('<f', header['rhf_mpm']))
-        outfile.write(struct.pack('<f', header['rhf_position']))
-        outfile.write(struct.pack('<f', header['rhf_range']))
-        outfile.write(struct.pack('<h', header['rh_npass']))
-        # byte 32
-        outfile.write(writetime(header['rhb_cdt']))
-        outfile.write(writetime(datetime.now())) # modification date/time
-        # byte 40
-        outfile.write(struct.pack('<h', header['rh_rgain']))
-        outfile.write(struct.pack('<h', header['rh_nrgain']))
-        outfile.write(struct.pack('<h', header['rh_text']))
-        outfile.write(struct.pack('<h', header['rh_ntext']))
-        outfile.write(struct.pack('<h', header['rh_proc']))
-        outfile.write(struct.pack('<h', header['rh_nproc']))
-        outfile.write(struct.pack('<h', header['rh_nchan']))
-        outfile.write(struct.pack('<f', header['rhf_epsr'])) # dzt.py ln 121-126
-        outfile.write(struct.pack('<f', header['rhf_top']))
-        outfile.write(struct.pack('<f', header['rhf_depth']))
-        # byte 66
-        outfile.write(struct.pack('<f', header['rh_xstart'])) # part of rh_coordx
-        outfile.write(struct.pack('<f', header['rh_xend'])) # part of rh_coordx
-        outfile.write(struct.pack('<f', header['rhf_servo_level']))
-        outfile.write(bytes(3)) # "reserved"
-        outfile.write(struct.pack('B', header['rh_accomp']))
-        outfile.write(struct.pack('<h', header['rh_sconfig']))
-        outfile.write(struct.pack('<h', header['rh_spp']))
-        outfile.write(struct.pack('<h', header['rh_linenum']))
-        # byte 88
-        outfile.write(struct.pack('<f', header['rh_ystart'])) # part of rh_coordy
-        outfile.write(struct.pack('<f', header['rh_yend'])) # part of rh_coordy
-        outfile.write(header['rh_96'])
-        outfile.write(struct.pack('c', header['rh_dtype']))
-        outfile.write(header['dzt_ant'][i])
-        outfile.write(header['rh_112'])
-        # byte 113
-        outfile.write(header['vsbyte'])
-        outfile.write(header['rh_name'])
-        outfile.write(header['rh_chksum'])
-        # byte 128
-        outfile.write(header['INFOAREA'])
-        outfile.write(header['rh_RGPS0'])
-        outfile.write(header['rh_RGPS1'])
-        i += 1
-
-    outfile.write(header['header_extra'])
-
-    stack = []
-    i = 0
-    for i in range(header['rh_nchan']):
-        # replace zeroed rows
-        stack.append(np.zeros((header['timezero'][i], ar[i].shape[1]),
-                                    dtype=np.int32))
-        stack.append(ar[i])
-        i += 1
-
-    writestack = np.vstack(tuple(stack))
-    sh = writestack.shape
-    writestack = writestack.T.reshape(-1)
-    fx.printmsg('writing %s data samples for %s channels (%s x %s)'
-          % (writestack.shape[0],
-             int(len(stack)/2),
-             sh[0], sh[1]))
-
-    # hard coded to write 32 bit signed ints to keep lossiness to a minimum
-    outfile.write(writestack.round().astype(np.int32, casting='unsafe').tobytes(order='C'))
-
-    outfile.close()
+    nsamp = set(ch.shape[0] + pad for ch, pad in channels)
+    ntr = set(ch.shape[1] for ch, pad in channels)
+    if (len(nsamp) != 1) or (len(ntr) != 1):
+        raise ValueError('channels differ in samples (with time-zero rows) or traces: %s, %s' % (sorted(nsamp), sorted(ntr)))
+    nsamp, ntr = nsamp.pop(), ntr.pop()
+
+    with open(outfile_abspath, 'wb') as outfile:
+        fx.printmsg('writing to: %s' % outfile.name)
+        outfile.write(b''.join(dzt_header(header, i, nsamp) for i in range(header['rh_nchan'])))
+        outfile.write(header['header_extra'])
+        fx.printmsg('writing %s data samples for %s channels (%s x %s)'
+              % (nsamp * len(channels) * ntr, len(channels), nsamp * len(channels), ntr))
+        # one row per trace: every channel's samples in turn; padding rows are never written to, so stay zero
+        buf = np.zeros((min(block, max(ntr, 1)), nsamp * len(channels)), dtype=np.int32)
+        for a in range(0, ntr, block):
+            b = min(a + block, ntr)
+            for i, (ch, pad) in enumerate(channels):
+                lo = i * nsamp + pad
+                part = ch[:, a:b]
+                if not np.issubdtype(part.dtype, np.integer):
+                    # hard coded to write 32 bit signed ints to keep lossiness to a minimum
+                    part = np.rint(part)
+                buf[:b - a, lo:lo + ch.shape[0]] = part.T
+            outfile.write(buf[:b - a].data)
+            if verbose:
+                fx.printmsg('wrote traces %s-%s of %s' % (a, b, ntr))
+    return outfile_abspath
+
+
+# SEG-Y rev 1 trace header fields written (byte offsets from the start of the 240-byte header, big-endian)
+SEGY_TRACE_HEADER = np.dtype({
+    'names': ['tracl', 'tracr', 'fldr', 'tracf', 'trid', 'duse', 'scalco', 'sx', 'sy', 'gx', 'gy', 'counit',
+              'ns', 'dt', 'year', 'day', 'hour', 'minute', 'sec', 'timbas', 'cdpx', 'cdpy'],
+    'formats': ['>i4', '>i4', '>i4', '>i4', '>i2', '>i2', '>i2', '>i4', '>i4', '>i4', '>i4', '>i2',
+                '>u2', '>u2', '>i2', '>i2', '>i2', '>i2', '>i2', '>i2', '>i4', '>i4'],
+    'offsets': [0, 4, 8, 12, 28, 34, 70, 72, 76, 80, 84, 88,
+                114, 116, 156, 158, 160, 162, 164, 166, 180, 184],
+    'itemsize': 240,
+})
+SEGY_BLOCK = 4096 # traces per block when writing SEG-Y data
+
+def _fields(records):
+    # column names of a DataFrame or field names of a structured array
+    return list(records.columns) if hasattr(records, 'columns') else list(records.dtype.names or ())
+
+def segy_coordinates(gps, traces, spm):
+    """
+    Coordinates of a range of traces for the SEG-Y trace headers, scaled to integers.
+
+    With GPS records that have :code:`longitude` and :code:`latitude`, positions are linearly interpolated between fixes by trace number (the :code:`trace` column, if present; otherwise the records are taken as one per trace) and stored in arc seconds. Without GPS, the distance along the line from :code:`rhf_spm` is stored as an x coordinate in metres.
+
+    :param gps: GPS records (:py:class:`pandas.DataFrame` or structured array), or None
+    :param numpy.ndarray traces: Zero-based trace numbers
+    :param float spm: Traces per metre
+    :rtype: x (:py:class:`numpy.ndarray`), y (:py:class:`numpy.ndarray`), SEG-Y coordinate units code (int)
+    """
+    # all coordinates carry the scalar -100, i.e. they are hundredths of the unit
+    if (gps is not None) and len(gps) and all(c in _fields(gps) for c in ('longitude', 'latitude')):
+        fixes = np.asarray(gps['trace'], dtype=float) if 'trace' in _fields(gps) else np.arange(len(gps), dtype=float)
+        lon = np.interp(traces, fixes, np.asarray(gps['longitude'], dtype=float))
+        lat = np.interp(traces, fixes, np.asarray(gps['latitude'], dtype=float))
+        return np.rint(lon * 360000), np.rint(lat * 360000), 2 # arc seconds
+    x = traces / spm if spm else np.zeros(len(traces))
+    return np.rint(x * 100), np.zeros(len(traces)), 1 # metres
+
+def segy_text(header, nsamp, ntr, ps, units):
+    """
+    The 3200-byte textual file header, 40 card images of 80 EBCDIC characters.
+
+    :param dict header: File header dictionary
+    :param int nsamp: Samples per trace
+    :param int ntr: Number of traces
+    :param float ps: Exact sample interval in picoseconds
+    :param int units: SEG-Y coordinate units code, from :py:func:`segy_coordinates`
+    :rtype: bytes
+    """
+    from readgssi import __version__
+    lines = [
+        'GROUND PENETRATING RADAR DATA WRITTEN BY READGSSI %s' % __version__,
+        'SOURCE FILE %s' % os.path.basename(str(header.get('infile', ''))),
+        'ANTENNA %s' % (header.get('dzt_ant') or ['unknown'])[0],
+        'COLLECTED %s' % header['rhb_cdt'] if isinstance(header.get('rhb_cdt'), datetime) else 'COLLECTED UNKNOWN',
+        'SAMPLES PER TRACE %d  TRACES %d  DATA FORMAT 5 (IEEE FLOAT32)' % (nsamp, ntr),
+        'TIME RANGE %s NS  SAMPLES PER SECOND %s  TRACES PER METRE %s'
+        % (header.get('rhf_range'), header.get('rhf_sps'), header.get('rhf_spm')),
+        'SAMPLE INTERVAL (BYTES 3217 AND 117) IS IN PICOSECONDS, NOT MICROSECONDS',
+        'EXACT SAMPLE INTERVAL %.6g PS' % ps,
+        'RELATIVE PERMITTIVITY %s' % header.get('rhf_epsr'),
+        'COORDINATES SCALED BY 1/100, %s' % ('ARC SECONDS FROM GPS' if units == 2 else 'DISTANCE ALONG LINE IN METRES (X)'),
+    ]
+    cards = ['C%2d %-76s' % (i + 1, line.upper()[:76]) for i, line in enumerate(lines)]
+    cards += ['C%2d %-76s' % (i + 1, '') for i in range(len(cards), 39)]
+    cards.append('C40 END TEXTUAL HEADER'.ljust(80))
+    return ''.join(cards).encode('cp037')
+
+def segy_binary(nsamp, dt_ps):
+    """
+    The 400-byte binary file header.
+
+    :param int nsamp: Samples per trace
+    :param int dt_ps: Sample interval in picoseconds
+    :rtype: bytes
+    """
+    binary = np.zeros(200, dtype='>i2') # 2-byte words; offsets below are (byte - 3201) / 2
+    binary[[6, 8, 10, 12]] = 1, dt_ps, nsamp, 5 # traces per ensemble, interval, samples, format
+    binary[14] = 1 # ensemble sorting: as recorded
+    binary[27] = 1 # measurement system: metres
+    binary[[150, 151, 152]] = 0x0100, 1, 0 # revision 1.0, fixed trace length, no extended text headers
+    return binary.tobytes()
+
+def segy(ar, outfile_abspath, header, gps=None, verbose=False, block=SEGY_BLOCK):
+    """
+    Output a SEG-Y (rev 1) file for seismic interpretation software.
 
+    The file holds the textual and binary file headers, then a 240-byte header and the 32-bit IEEE float samples of each trace. The trace headers of a block of traces are filled in at once as a NumPy structured array (:py:data:`SEGY_TRACE_HEADER`). They are interleaved with the samples in one record array and written in a single call per block, so a long line costs no per-trace Python work.
+
+    .. note:: SEG-Y stores the sample interval as a whole number of microseconds, which is zero for radar data. As GPR software commonly does, the interval is written in picoseconds (from :code:`header['ns_per_zsample']`, rounded to the nearest picosecond) and the textual header says so, along with the exact interval. Multiply times read by other software by 1e-6.
+
+    :param numpy.ndarray ar: Radar array of one channel (samples x traces)
+    :param str outfile_abspath: Output file path
+    :param dict header: File header dictionary
+    :param gps: GPS records with longitude and latitude, or None (see :py:func:`segy_coordinates`)
+    :param bool verbose: Verbose, defaults to False
+    :param int block: Traces per block
+    :rtype: str (the output file)
+    """
+    if not outfile_abspath.endswith(('.sgy', '.segy', '.SGY', '.SEGY')):
+        outfile_abspath = outfile_abspath + '.sgy'
+    nsamp, ntr = ar.shape
+    if nsamp > 65535:
+        raise ValueError('SEG-Y traces hold at most 65535 samples, got %d' % nsamp)
+    # despite its name, readdzt gives ns_per_zsample in seconds
+    ps = (header.get('ns_per_zsample') or header['rhf_range'] * 1e-9 / header['rh_nsamp']) * 1e12
+    dt_ps = int(round(ps))
+    if not 0 < dt_ps <= 65535:
+        raise ValueError('sample interval of %s ps does not fit a SEG-Y header' % ps)
+    spm = header.get('rhf_spm') or 0
+    sps = header.get('rhf_sps') or 0
+    start = np.datetime64(header['rhb_cdt'].replace(tzinfo=None), 'us') if isinstance(header.get('rhb_cdt'), datetime) else None
+
+    record = np.dtype([('header', SEGY_TRACE_HEADER), ('data', '>f4', (nsamp,))])
+    buf = np.zeros(min(block, max(ntr, 1)), dtype=record)
+    # fields that are the same for every trace
+    buf['header']['trid'] = 1 # seismic data
+    buf['header']['duse'] = 1 # production
+    buf['header']['scalco'] = -100
+    buf['header']['ns'] = nsamp
+    buf['header']['dt'] = dt_ps
+    buf['header']['timbas'] = 1 # local time
+    with open(outfile_abspath, 'wb') as outfile:
+        if verbose:
+            fx.printmsg('output format is SEG-Y. writing %s traces of %s samples to: %s' % (ntr, nsamp, outfile.name))
+        units = segy_coordinates(gps, np.zeros(0), spm)[2]
+        outfile.write(segy_text(header, nsamp, ntr, ps, units))
+        outfile.write(segy_binary(nsamp, dt_ps))
+        for a in range(0, ntr, block):
+            b = min(a + block, ntr)
+            rec = buf[:b - a]
+            h = rec['header']
+            traces = np.arange(a, b)
+            h['tracl'] = h['tracr'] = h['tracf'] = traces + 1
+            h['fldr'] = 1
+            x, y, h['counit'] = segy_coordinates(gps, traces, spm)
+            h['sx'] = h['gx'] = h['cdpx'] = x
+            h['sy'] = h['gy'] = h['cdpy'] = y
+            if start is not None:
+                t = start + (traces / sps * 1e6).astype('timedelta64[us]') if sps else np.full(len(traces), start)
+                days = t.astype('datetime64[D]')
+                years = t.astype('datetime64[Y]')
+                secs = (t - days).astype('timedelta64[s]').astype(np.int64)
+                h['year'] = years.astype(np.int64) + 1970
+                h['day'] = (days - years).astype(np.int64) + 1
+                h['hour'], h['minute'], h['sec'] = secs // 3600, secs // 60 % 60, secs % 60
+            rec['data'] = ar[:, a:b].T
+            outfile.write(rec.data)
+            if verbose:
+                fx.printmsg('wrote traces %s-%s of %s' % (a, b, ntr))
+    return outfile_abspath
@@ -0,0 +1,80 @@
+import collections
+import hashlib
+import json
+import os
+
+RECIPE_VERSION = 1
+CONTRASTS = ('sigma', 'percentile')
+
+
+#------------- FILTER RECIPES ------------------#
+def make_recipe(active_filters, contrast='sigma', cmap='gray'):
+    """
+    Build a recipe: the filter chain of a tab (in the order it is applied) plus how the result is displayed. Recipes are plain JSON so they can be saved from the GUI and replayed by :py:mod:`batch`.
+
+    :param dict active_filters: Filter names mapped to their parameter lists, as built by the GUI
+    :param str contrast: 'sigma' or 'percentile', as in :py:func:`stats.clim`
+    :param str cmap: The colormap name
+    :rtype: :py:class:`dict`
+    """
+    if contrast not in CONTRASTS:
+        raise ValueError('unknown contrast "%s" (choose from %s)' % (contrast, ', '.join(CONTRASTS)))
+    return {
+        'version': RECIPE_VERSION,
+        # a list of pairs rather than an object, so the order survives any JSON tool
+        'filters': [[filt, params] for filt, params in active_filters.items()],
+        'contrast': contrast,
+        'cmap': cmap,
+    }
+
+
+def recipe_filters(recipe):
+    """
+    The filter chain of a recipe in the form :py:func:`backend.dzt_filters` takes.
+
+    :param dict recipe: The recipe
+    :rtype: :py:class:`collections.OrderedDict`
+    """
+    return collections.OrderedDict((filt, params) for filt, params in recipe['filters'])
+
+
+def recipe_hash(recipe):
+    """
+    Short stable hash of a recipe, used to tell whether an output was made with it.
+
+    :param dict recipe: The recipe
+    :rtype: str
+    """
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def save_recipe(path, recipe):
+    """
+    Write a recipe to a JSON file.
+
+    :param str path: Output file
+    :param dict recipe: The recipe
+    :rtype: str
+    """
+    with open(path, 'w') as f:
+        json.dump(recipe, f, indent=2)
+    return path
+
+
+def load_recipe(path=None):
+    """
+    Read a recipe from a JSON file, filling in display defaults for keys it leaves out.
+
+    :param str path: The recipe file. Defaults to None, which gives the empty recipe (no filters).
+    :rtype: :py:class:`dict`
+    """
+    if path is None:
+        return make_recipe({})
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or not isinstance(data.get('filters', []), list):
+        raise ValueError('%s is not a filter recipe' % os.path.basename(path))
+    if data.get('version', RECIPE_VERSION) > RECIPE_VERSION:
+        raise ValueError('%s was saved by a newer version (recipe version %s)' % (os.path.basename(path), data['version']))
+    return make_recipe(collections.OrderedDict((filt, params) for filt, params in data.get('filters', [])),
+                       contrast=data.get('contrast', 'sigma'), cmap=data.get('cmap', 'gray'))
@@ -0,0 +1,234 @@
+import collections
+import concurrent.futures
+import itertools
+import threading
+import numpy as np
+import matplotlib
+
+TILE = 256 # tile edge in display columns / samples
+CACHE_BYTES = 256 * 2**20 # default bound on cached RGBA tiles, shared by every renderer
+
+_ids = itertools.count()
+
+
+#------------- COLOUR MAPPING ------------------#
+def colormap_lut(cmap='gray', n=256):
+    """
+    Lookup table of RGBA bytes for a matplotlib colormap.
+
+    :param str cmap: The colormap name
+    :param int n: Number of entries
+    :rtype: :py:class:`numpy.ndarray` of shape (n, 4) and dtype uint8
+    """
+    return (matplotlib.colormaps[cmap].resampled(n)(np.linspace(0, 1, n)) * 255).round().astype(np.uint8)
+
+
+def lut_index(ar, clim, n=256):
+    """
+    Scale and clip values to LUT indices in one vectorized pass.
+
+    :param numpy.ndarray ar: The values
+    :param tuple clim: Values mapped to the first and last LUT entries
+    :param int n: Number of LUT entries
+    :rtype: :py:class:`numpy.ndarray` of dtype uint8 (or uint16 for n > 256)
+    """
+    lo, hi = float(clim[0]), float(clim[1])
+    scale = (n - 1) / (hi - lo) if hi != lo else 0.
+    idx = (np.asarray(ar, dtype=np.float32) - lo) * scale
+    np.clip(idx, 0, n - 1, out=idx)
+    return idx.round().astype(np.uint8 if n <= 256 else np.uint16)
+
+
+def apply_lut(ar, lut, clim):
+    """
+    Map values to RGBA bytes through a colormap LUT.
+
+    :param numpy.ndarray ar: The values
+    :param numpy.ndarray lut: Output of :py:func:`colormap_lut`
+    :param tuple clim: Colour limits
+    :rtype: :py:class:`numpy.ndarray` of shape ar.shape + (4,) and dtype uint8
+    """
+    return lut[lut_index(ar, clim, n=lut.shape[0])]
+
+
+#------------- TILE CACHE ------------------#
+class TileCache(object):
+    """
+    Thread-safe LRU cache of rendered tiles, bounded by the total number of bytes held.
+
+    :param int max_bytes: Upper bound on the bytes of cached tiles
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key, tile):
+        with self.lock:
+            if key in self.tiles:
+                return
+            self.tiles[key] = tile
+            self.nbytes += tile.nbytes
+            while (self.nbytes > self.max_bytes) and (len(self.tiles) > 1):
+                old_key, old = self.tiles.popitem(last=False)
+                self.nbytes -= old.nbytes
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.tiles
+
+    def discard(self, owner):
+        """
+        Drop every tile belonging to one renderer.
+
+        :param int owner: The renderer's :code:`uid`
+        """
+        with self.lock:
+            for key in [k for k in self.tiles if k[0] == owner]:
+                self.nbytes -= self.tiles.pop(key).nbytes
+
+
+tile_cache = TileCache()
+
+
+#------------- TILE RENDERER ------------------#
+class TileRenderer(object):
+    """
+    Renders a :py:class:`pyramid.DisplayPyramid` as colormapped RGBA tiles addressed by :code:`(level, tile_x, tile_z)`, where tiles are :py:data:`TILE` display columns wide and :py:data:`TILE` samples high. Tiles are kept in a shared byte-bounded :py:class:`TileCache`; changing the data version, colormap or colour limits invalidates this renderer's tiles. A background thread prefetches the tiles either side of each viewport so panning usually finds them ready.
+
+    :param pyramid.DisplayPyramid pyramid: The display pyramid
+    :param str cmap: The colormap name
+    :param tuple clim: Colour limits
+    :param int version: The data version the pyramid was built from
+    :param TileCache cache: Cache to use; defaults to the module-wide :py:data:`tile_cache`
+    """
+    prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def __init__(self, pyramid, cmap='gray', clim=(0., 1.), version=0, cache=None):
+        self.uid = next(_ids)
+        self.cache = tile_cache if cache is None else cache
+        self.pyramid = pyramid
+        self.version = version
+        self.cmap = cmap
+        self.lut = colormap_lut(cmap)
+        self.clim = tuple(clim)
+        self.style = 0 # bumped whenever the colormap or colour limits change; part of every tile key
+        self.pending = set()
+
+    def set_style(self, cmap=None, clim=None):
+        """
+        Change the colormap and/or colour limits, dropping tiles rendered with the old ones.
+
+        :param str cmap: The colormap name
+        :param tuple clim: Colour limits
+        """
+        changed = False
+        if (cmap is not None) and (cmap != self.cmap):
+            self.cmap = cmap
+            self.lut = colormap_lut(cmap)
+            changed = True
+        if (clim is not None) and (tuple(clim) != self.clim):
+            self.clim = tuple(clim)
+            changed = True
+        if changed:
+            # bumped after the new LUT and limits are in place, so a tile keyed with the new style is never drawn with the old one
+            self.style += 1
+            self.cache.discard(self.uid)
+
+    def set_data(self, pyramid, version):
+        """
+        Point the renderer at a new pyramid; tiles from another data version are dropped.
+
+        :param pyramid.DisplayPyramid pyramid: The display pyramid
+        :param version: The data version it was built from
+        """
+        self.pyramid = pyramid
+        if version != self.version:
+            self.version = version
+            self.cache.discard(self.uid)
+
+    def ntiles(self, level):
+        """
+        Number of tiles across and down a level.
+
+        :param int level: The level index
+        :rtype: tuple of int
+        """
+        cols = self.pyramid.columns(level)
+        rows = self.pyramid.shape[0]
+        return -(-cols // TILE), -(-rows // TILE)
+
+    def tile(self, level, tx, tz):
+        """
+        RGBA bytes for one tile, from the cache or freshly rendered. A tile whose style or data version changed while it was being rendered (e.g. in the prefetch thread) is returned but not cached.
+
+        :param int level: The level index
+        :param int tx: Tile column
+        :param int tz: Tile row
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        key = self._key(level, tx, tz)
+        rgba = self.cache.get(key)
+        if rgba is None:
+            lut, clim, pyramid = self.lut, self.clim, self.pyramid
+            j1 = min((tx + 1) * TILE, pyramid.columns(level))
+            data = pyramid.level_data(level, tx * TILE, j1)[tz * TILE:(tz + 1) * TILE]
+            rgba = apply_lut(data, lut, clim)
+            if self._key(level, tx, tz) == key:
+                self.cache.put(key, rgba)
+        return rgba
+
+    def _key(self, level, tx, tz):
+        return (self.uid, self.version, self.style, level, tx, tz)
+
+    def viewport(self, c0, c1, pixels):
+        """
+        Composite the tiles covering traces :code:`c0` to :code:`c1` at the level matching the screen width, then queue the neighbouring tiles for prefetching.
+
+        :param int c0: First visible trace
+        :param int c1: Last visible trace (exclusive)
+        :param int pixels: Width of the view in screen pixels
+        :rtype: RGBA image (:py:class:`numpy.ndarray`), first trace covered (:py:class:`int`), last trace covered (:py:class:`int`, exclusive), level (:py:class:`int`)
+        """
+        p = self.pyramid
+        c0 = int(min(max(c0, 0), p.ntraces - 1))
+        c1 = int(min(max(c1, c0 + 1), p.ntraces))
+        level = p.level_for(c0, c1, pixels)
+        scale = p.traces_per_column(level)
+        j0 = c0 // scale
+        j1 = min(-(-c1 // scale), p.columns(level))
+        tx0, tx1 = j0 // TILE, (j1 - 1) // TILE
+        ntx, ntz = self.ntiles(level)
+        out = np.empty((p.shape[0], j1 - j0, 4), dtype=np.uint8)
+        for tx in range(tx0, tx1 + 1):
+            a = max(tx * TILE, j0)
+            b = min((tx + 1) * TILE, j1)
+            for tz in range(ntz):
+                out[tz * TILE:(tz + 1) * TILE, a - j0:b - j0] = self.tile(level, tx, tz)[:, a - tx * TILE:b - tx * TILE]
+        self.prefetch(level, [tx for tx in (tx0 - 1, tx1 + 1) if 0 <= tx < ntx], range(ntz))
+        return out, j0 * scale, min(j1 * scale, p.ntraces), level
+
+    def prefetch(self, level, txs, tzs):
+        """
+        Render tiles in the background thread if they are not cached or already queued.
+
+        :param int level: The level index
+        :param list txs: Tile columns
+        :param list tzs: Tile rows
+        """
+        for tx in txs:
+            for tz in tzs:
+                key = self._key(level, tx, tz)
+                if (key in self.pending) or (key in self.cache):
+                    continue
+                self.pending.add(key)
+                future = self.prefetcher.submit(self.tile, level, tx, tz)
+                future.add_done_callback(lambda f, key=key: self.pending.discard(key))
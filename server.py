@@ -0,0 +1,417 @@
+"""
+Local processing server shared by several GUI windows on one machine.
+
+The server owns decoding, filtering and a cache of results on disk. A client
+sends the files and the filter chains it wants; the server computes what is
+not cached yet (once, however many clients ask at the same time) and answers
+with the path of a .npy file and the header, and the client memory-maps the
+file copy-on-write. Arrays never go through the socket.
+
+Start it, then point the GUI at it with the address it prints:
+
+    python server.py --address localhost:52490
+    GPR_SERVER=localhost:52490 python dzt_visualizer.py
+
+The address is a host:port pair or a Unix socket (or Windows pipe) path.
+Requests are pickled, so only clients holding the shared key may connect:
+the server creates a random key in a file readable by the user alone (or
+takes GPR_SERVER_KEY), and listens on loopback addresses only unless
+started with --allow-remote.
+"""
+import argparse
+import collections
+import copy
+import hashlib
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import stat
+import sys
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client as _Connect, Listener
+import numpy as np
+import instrument
+
+ADDRESS_ENV = 'GPR_SERVER' # environment variable the GUI reads the server address from
+AUTHKEY_ENV = 'GPR_SERVER_KEY' # shared secret, instead of the key file
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.gpr-server-key') # created by the server, readable by the user alone
+DEFAULT_ADDRESS = 'localhost:52490'
+DEFAULT_CACHE_GB = 20.
+
+
+class ServerUnavailable(ConnectionError):
+    """
+    The server could not be reached or went away; the client should process locally.
+    """
+
+
+class ServerError(RuntimeError):
+    """
+    A request failed on the server (e.g. a filter raised).
+    """
+
+
+def parse_address(address):
+    """
+    :param str address: 'host:port', or a socket or pipe path
+    :rtype: tuple (host, port) or str
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and (os.path.sep not in address):
+        return host or 'localhost', int(port)
+    return address
+
+
+def is_loopback(address):
+    """
+    Whether an address can only be reached from this machine: a socket or pipe path, or a host that resolves to loopback addresses only.
+
+    :param address: As :py:func:`parse_address` returns it
+    :rtype: bool
+    """
+    if not isinstance(address, tuple):
+        return True
+    try:
+        infos = socket.getaddrinfo(address[0], address[1], proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0].split('%')[0]).is_loopback for info in infos)
+
+
+def authkey(create=False):
+    """
+    The key shared by the server and its clients: the :py:data:`AUTHKEY_ENV` environment variable if set, otherwise the contents of :py:data:`KEY_FILE`. The server creates the file with a random key the first time; a key file other users can read is refused.
+
+    :param bool create: Create the key file if it does not exist (the server does, clients do not)
+    :rtype: bytes
+    :raises ServerUnavailable: if there is no key, or the key file is not private
+    """
+    key = os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode('utf-8')
+    if create and not os.path.exists(KEY_FILE):
+        try:
+            fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass # another server got there first
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    try:
+        st = os.stat(KEY_FILE)
+        if (os.name == 'posix') and ((st.st_uid != os.getuid()) or (st.st_mode & (stat.S_IRWXG | stat.S_IRWXO))):
+            raise ServerUnavailable('%s must belong to you and be private (chmod 600)' % KEY_FILE)
+        with open(KEY_FILE) as f:
+            key = f.read().strip()
+    except FileNotFoundError:
+        raise ServerUnavailable('no server key: start the server first or set %s' % AUTHKEY_ENV)
+    if not key:
+        raise ServerUnavailable('%s is empty' % KEY_FILE)
+    return key.encode('utf-8')
+
+
+#------------- RESULT CACHE ------------------#
+class ResultCache(object):
+    """
+    Decoded and filtered arrays on disk, one :code:`<key>.npy` plus a :code:`<key>.json` header per result, evicted least recently used first when the directory grows past its limit. A result is keyed by the source file, its size and modification time (and those of its DZX and DZG) and the filter chains applied, so a changed file is never served stale.
+
+    :param str directory: Cache directory, created if missing
+    :param float max_bytes: Size limit of the directory
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.computing = {} # key -> lock held while the result is computed
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(infile, history):
+        """
+        :param str infile: The DZT file location
+        :param list history: Filter chains applied in turn, each a list of [filter, params] pairs
+        :rtype: str
+        """
+        from decoded import source_signature
+        text = json.dumps([os.path.abspath(infile), source_signature(infile), history], sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """
+        :rtype: .npy path (str), header (dict); or None if not cached
+        """
+        from readgssi.h5 import decode_header
+        path = self.path(key)
+        try:
+            with open(os.path.join(self.directory, key + '.json')) as f:
+                header = decode_header(f.read())
+            if 'shape' in header:
+                header['shape'] = tuple(header['shape']) # as readdzt gives it; JSON has made it a list
+            os.utime(path) # recently used
+        except OSError:
+            return None
+        return path, header
+
+    def put(self, key, ar, header):
+        """
+        Store a result and evict old ones if the cache is over its limit.
+
+        :rtype: .npy path (str)
+        """
+        from readgssi.h5 import encode_header
+        path = self.path(key)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, ar, allow_pickle=False)
+        os.replace(path + '.tmp', path)
+        # the header goes last: a result counts as cached once it is there
+        with open(os.path.join(self.directory, key + '.json.tmp'), 'w') as f:
+            f.write(encode_header(header))
+        os.replace(os.path.join(self.directory, key + '.json.tmp'), os.path.join(self.directory, key + '.json'))
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name[:-4]))
+        total = sum(e[1] for e in entries)
+        for mtime, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                # header first, so the entry stops counting as cached before its data goes
+                os.remove(os.path.join(self.directory, key + '.json'))
+                os.remove(self.path(key))
+            except OSError:
+                continue # e.g. still mapped by a client on Windows
+            total -= size
+
+    def lookup(self, key, compute):
+        """
+        The cached result for :code:`key`, computed with :code:`compute()` (which returns an array and a header) if missing. Concurrent requests for the same key wait for the first one instead of computing it again.
+
+        :rtype: .npy path (str), header (dict)
+        """
+        with self.lock:
+            pending = self.computing.setdefault(key, threading.Lock())
+        with pending:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            ar, header = compute()
+            path = self.put(key, ar, header)
+        with self.lock:
+            self.computing.pop(key, None)
+        return path, header
+
+
+#------------- SERVER ------------------#
+class ProcessingServer(object):
+    """
+    Answers client requests on a :py:class:`multiprocessing.connection.Listener`, one thread per connected client. Requests are tuples:
+
+    * :code:`('load', paths)` -- the decoded files
+    * :code:`('filter', paths, history)` -- the files with the filter chains in :code:`history` applied in turn, the way a tab applies them
+    * :code:`('status',)` -- cache statistics
+
+    and are answered with :code:`('ok', result)` or :code:`('error', message)`. Files and filter results are answered as lists of :code:`(npy path, header)` pairs.
+
+    :param address: Listening address (see :py:func:`parse_address`)
+    :param ResultCache cache: The result cache
+    :param bool allow_remote: Allow listening on an address other machines can reach. Requests are unpickled, so anyone with the key can run code in the server.
+    """
+    def __init__(self, address, cache, allow_remote=False):
+        if not (allow_remote or is_loopback(address)):
+            raise ValueError('%s is not a loopback address; listen on it with --allow-remote (allow_remote=True) only if every machine that can reach it is trusted' % (address,))
+        self.address = address
+        self.cache = cache
+        self.clients = 0
+
+    def load(self, infile):
+        """
+        A decoded file.
+
+        :rtype: .npy path (str), header (dict)
+        """
+        import decoded
+        from backend import dzt_func
+        def compute():
+            data, headers = dzt_func([infile])
+            return data[0], headers[0]
+        # an up-to-date decode cache from the watch command of batch.py is served as it is
+        cached = decoded.open_decoded(infile)
+        if cached is not None:
+            return decoded.decoded_path(infile), cached[1]
+        return self.cache.lookup(self.cache.key(infile, []), compute)
+
+    def result(self, infile, history):
+        """
+        A file with filter chains applied, starting from the longest prefix of :code:`history` already cached.
+
+        :rtype: .npy path (str), header (dict)
+        """
+        from backend import dzt_filters
+        if not history:
+            return self.load(infile)
+        def compute():
+            path, header = self.result(infile, history[:-1])
+            # the filters update the header; the one given may be on its way to another client
+            ar, header = np.load(path, mmap_mode='c'), copy.deepcopy(header)
+            chain = collections.OrderedDict((filt, params) for filt, params in history[-1])
+            return dzt_filters([ar], [header], chain, workers=os.cpu_count() or 1)[0], header
+        return self.cache.lookup(self.cache.key(infile, history), compute)
+
+    def handle(self, request):
+        op = request[0]
+        if op == 'load':
+            return [self.load(infile) for infile in request[1]]
+        if op == 'filter':
+            return [self.result(infile, request[2]) for infile in request[1]]
+        if op == 'status':
+            return {'clients': self.clients, 'hits': self.cache.hits, 'misses': self.cache.misses, 'directory': self.cache.directory}
+        raise ValueError('unknown request "%s"' % op)
+
+    def serve_client(self, conn):
+        self.clients += 1
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = ('ok', self.handle(request))
+                except Exception as e:
+                    reply = ('error', '%s: %s' % (type(e).__name__, e))
+                conn.send(reply)
+        finally:
+            self.clients -= 1
+            conn.close()
+
+    def serve_forever(self):
+        with Listener(self.address, authkey=authkey(create=True)) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    # a client that failed the handshake
+                    print('refused a connection: %s' % e)
+                    continue
+                threading.Thread(target=self.serve_client, args=(conn,), daemon=True).start()
+
+
+#------------- CLIENT ------------------#
+class ProcessingClient(object):
+    """
+    Connection to a :py:class:`ProcessingServer`. Safe to share between threads; requests are sent one at a time.
+
+    :param address: Server address (see :py:func:`parse_address`)
+    """
+    def __init__(self, address):
+        self.lock = threading.Lock()
+        key = authkey()
+        try:
+            self.conn = _Connect(address, authkey=key)
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ServerUnavailable('no processing server at %s (%s)' % (address, e))
+
+    def request(self, *request):
+        with self.lock:
+            try:
+                self.conn.send(request)
+                status, result = self.conn.recv()
+            except (OSError, EOFError) as e:
+                raise ServerUnavailable('lost the processing server (%s)' % e)
+        if status == 'error':
+            raise ServerError(result)
+        return result
+
+    @staticmethod
+    def _open(results):
+        return [np.load(path, mmap_mode='c') for path, header in results], [header for path, header in results]
+
+    def load(self, paths):
+        """
+        Decoded files, in the form :py:func:`backend.dzt_func` returns.
+
+        :param list paths: The DZT file locations
+        :rtype: list of arrays (copy-on-write :py:class:`numpy.memmap`), list of header dictionaries
+        """
+        with instrument.stage('server', 'load', None, files=len(paths)) as s:
+            data, headers = self._open(self.request('load', list(paths)))
+            s.out(data)
+        return data, headers
+
+    def filter(self, paths, history):
+        """
+        Files with filter chains applied in turn.
+
+        :param list paths: The DZT file locations
+        :param list history: Filter chains, oldest first, each a list of [filter, params] pairs (see :py:func:`recipes.make_recipe`)
+        :rtype: list of arrays, list of header dictionaries
+        """
+        with instrument.stage('server', 'filter', None, files=len(paths), chains=len(history)) as s:
+            data, headers = self._open(self.request('filter', list(paths), history))
+            s.out(data)
+        return data, headers
+
+    def close(self):
+        self.conn.close()
+
+
+def connect(address=None):
+    """
+    Connect to the processing server named by :code:`address` or the :py:data:`ADDRESS_ENV` environment variable.
+
+    :param str address: Server address. Defaults to None, which uses the environment variable.
+    :rtype: :py:class:`ProcessingClient`, or None if no server is configured or reachable
+    """
+    address = address or os.environ.get(ADDRESS_ENV)
+    if not address:
+        return None
+    try:
+        return ProcessingClient(parse_address(address))
+    except ServerUnavailable as e:
+        print('%s; processing locally' % e)
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode, filter and cache DZT files for the GUIs on this machine.')
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help='host:port or socket path to listen on (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=os.path.join(tempfile.gettempdir(), 'gpr-server-cache'), help='result cache directory (default: %(default)s)')
+    parser.add_argument('--cache-gb', type=float, default=DEFAULT_CACHE_GB, help='cache size limit in GB (default: %(default)s)')
+    parser.add_argument('--allow-remote', action='store_true', help='listen on a non-loopback address; anyone holding the key can then run code as you')
+    args = parser.parse_args(argv)
+    instrument.enable(os.environ.get(instrument.LOG_ENV))
+    try:
+        server = ProcessingServer(parse_address(args.address), ResultCache(args.cache_dir, args.cache_gb * 2**30), allow_remote=args.allow_remote)
+        authkey(create=True)
+    except (ValueError, ServerUnavailable) as e:
+        parser.error(str(e))
+    print('serving on %s, caching in %s; start the GUI with %s=%s' % (args.address, args.cache_dir, ADDRESS_ENV, args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
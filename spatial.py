@@ -0,0 +1,522 @@
+"""
+Spatial index over the GPS positions of survey lines.
+
+Positions come from the DZG file recorded with each DZT: a $GSSIS record
+giving the trace number, followed by the NMEA fix taken at that trace.
+Fixes are projected to metres on a local plane and consecutive fixes of a
+line form segments, traces being interpolated linearly along each one. Every
+segment is registered in the cells of a regular grid that its bounding box
+touches; the (cell, segment) pairs are kept sorted by cell, so the segments
+near a point are found with a binary search instead of opening any file.
+
+The index is saved as one .npz file and updated in place as lines are added,
+changed or removed. Queries:
+
+    python spatial.py build processed/catalog.sqlite
+    python spatial.py nearest -68.6821 45.2431 --radius 25
+    python spatial.py bbox -68.69 45.24 -68.68 45.25
+    python spatial.py cross -68.69 45.24 -68.68 45.25
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+INDEX = 'spatial.npz'
+EARTH_RADIUS = 6371008.8 # metres
+DEFAULT_CELL = 10. # grid cell size in metres
+MAX_JUMP = 200. # metres; longer steps between fixes are GPS dropouts and are not indexed
+QUERY_BLOCK = 2**20 # candidate pairs looked up at a time for a query polyline
+FIX_DTYPE = np.dtype([('trace', 'f8'), ('longitude', 'f8'), ('latitude', 'f8')])
+
+
+#------------- DZG FILES ------------------#
+def dzg_path(infile):
+    """
+    :param str infile: The DZT file location
+    :rtype: str (the DZG file recorded with it)
+    """
+    return os.path.splitext(infile)[0] + '.DZG'
+
+
+def _nmea_degrees(value, hemisphere):
+    # ddmm.mmmm (or dddmm.mmmm) to signed decimal degrees
+    value = float(value)
+    degrees = (value // 100) + (value % 100) / 60.
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def read_dzg(path):
+    """
+    Read the GPS fixes of a DZG file: the first GGA (or, failing that, RMC) position after each $GSSIS trace record. Fixes without a position or without satellite lock are skipped.
+
+    :param str path: The DZG file
+    :rtype: :py:class:`numpy.ndarray` of :py:data:`FIX_DTYPE` records, sorted by trace
+    """
+    fixes = []
+    trace = None
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('$GSSIS'):
+                try:
+                    trace = float(line.split(',')[1])
+                except (IndexError, ValueError):
+                    trace = None
+                continue
+            if (trace is None) or not line.startswith('$'):
+                continue
+            p = line.split('*')[0].split(',')
+            try:
+                if (p[0][3:6] == 'GGA') and p[2] and p[4] and (p[6] != '0'):
+                    fixes.append((trace, _nmea_degrees(p[4], p[5]), _nmea_degrees(p[2], p[3])))
+                elif (p[0][3:6] == 'RMC') and (p[2] == 'A') and p[3] and p[5]:
+                    fixes.append((trace, _nmea_degrees(p[5], p[6]), _nmea_degrees(p[3], p[4])))
+                else:
+                    continue
+            except (IndexError, ValueError):
+                continue
+            trace = None
+    fixes = np.array(fixes, dtype=FIX_DTYPE)
+    fixes = fixes[np.argsort(fixes['trace'], kind='stable')]
+    # a trace fixed twice keeps its first position
+    return fixes[np.concatenate(([True], np.diff(fixes['trace']) > 0))] if len(fixes) else fixes
+
+
+def dzg_signature(infile):
+    """
+    Size and modification time of the DZG of a line, or None if it has none.
+
+    :rtype: list or None
+    """
+    try:
+        st = os.stat(dzg_path(infile))
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def local_xy(lon, lat, origin):
+    """
+    Longitude and latitude to metres east and north of an origin (equirectangular, which is accurate enough over the extent of a survey).
+
+    :param lon: Longitudes
+    :param lat: Latitudes
+    :param origin: (longitude, latitude) of the origin
+    :rtype: x, y (:py:class:`numpy.ndarray`)
+    """
+    lon0, lat0 = origin
+    x = np.radians(np.asarray(lon, dtype=float) - lon0) * EARTH_RADIUS * np.cos(np.radians(lat0))
+    y = np.radians(np.asarray(lat, dtype=float) - lat0) * EARTH_RADIUS
+    return x, y
+
+
+#------------- GRID ------------------#
+def _expand(counts):
+    # for ranges of the given lengths: which range each element belongs to, and its offset in it
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offset = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, offset
+
+
+def _pack(ix, iy):
+    return ((ix.astype(np.int64) + 2**31) << 32) | (iy.astype(np.int64) + 2**31)
+
+
+class SpatialIndex(object):
+    """
+    Grid-hash index of line segments. Fix arrays (:code:`x`, :code:`y` in metres and :code:`trace`) hold every line's fixes one line after the other, line :code:`i` owning :code:`line_start[i]:line_start[i+1]`. A segment is named by the index of its first fix, and :code:`keys`/:code:`segs` list each segment once for every grid cell it touches, sorted by cell key.
+
+    :param float cell: Grid cell size in metres
+    :param float max_jump: Steps between fixes longer than this (in metres) are not indexed
+    """
+    def __init__(self, cell=DEFAULT_CELL, max_jump=MAX_JUMP):
+        self.cell = float(cell)
+        self.max_jump = float(max_jump)
+        self.origin = None # (longitude, latitude) of the projection centre, set by the first line
+        self.paths = []
+        self.signatures = []
+        self.line_start = np.zeros(1, dtype=np.int64)
+        self.x = np.empty(0)
+        self.y = np.empty(0)
+        self.trace = np.empty(0)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.segs = np.empty(0, dtype=np.int64)
+
+    #------------- STORAGE ------------------#
+    @classmethod
+    def load(cls, path):
+        """
+        :param str path: An index saved with :py:meth:`save`
+        :rtype: :py:class:`SpatialIndex`
+        """
+        with np.load(path) as f:
+            meta = json.loads(str(f['meta']))
+            index = cls(cell=meta['cell'], max_jump=meta['max_jump'])
+            index.origin = meta['origin']
+            index.paths = f['paths'].tolist()
+            index.signatures = meta['signatures']
+            for name in ('line_start', 'x', 'y', 'trace', 'keys', 'segs'):
+                setattr(index, name, f[name])
+        return index
+
+    @classmethod
+    def open(cls, path, cell=DEFAULT_CELL):
+        """
+        Load the index at :code:`path`, or start an empty one if there is none yet.
+
+        :rtype: :py:class:`SpatialIndex`
+        """
+        return cls.load(path) if os.path.isfile(path) else cls(cell=cell)
+
+    def save(self, path):
+        """
+        Write the index, under a temporary name first so readers never see a partial file.
+
+        :param str path: Output file
+        """
+        meta = {'cell': self.cell, 'max_jump': self.max_jump, 'origin': self.origin, 'signatures': self.signatures}
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), paths=np.array(self.paths, dtype=str),
+                     line_start=self.line_start, x=self.x, y=self.y, trace=self.trace, keys=self.keys, segs=self.segs)
+        os.replace(tmp, path)
+
+    #------------- PROJECTION ------------------#
+    def project(self, lon, lat):
+        """
+        Longitude and latitude to metres east and north of the index origin (see :py:func:`local_xy`).
+
+        :rtype: x, y (:py:class:`numpy.ndarray`)
+        """
+        return local_xy(lon, lat, self.origin)
+
+    def unproject(self, x, y):
+        lon0, lat0 = self.origin
+        lon = lon0 + np.degrees(np.asarray(x) / (EARTH_RADIUS * np.cos(np.radians(lat0))))
+        lat = lat0 + np.degrees(np.asarray(y) / EARTH_RADIUS)
+        return lon, lat
+
+    def _box_cells(self, x0, y0, x1, y1):
+        # every grid cell touched by each box: (box number, cell key) pairs
+        ix0, iy0 = np.floor(x0 / self.cell).astype(np.int64), np.floor(y0 / self.cell).astype(np.int64)
+        nx = np.floor(x1 / self.cell).astype(np.int64) - ix0 + 1
+        ny = np.floor(y1 / self.cell).astype(np.int64) - iy0 + 1
+        owner, offset = _expand(nx * ny)
+        return owner, _pack(ix0[owner] + offset % nx[owner], iy0[owner] + offset // nx[owner])
+
+    #------------- UPDATING ------------------#
+    def _segments(self, start, stop):
+        # indexable segments among fixes start:stop (consecutive fixes of one line, no dropout)
+        s = np.arange(start, stop - 1)
+        step = np.hypot(self.x[s + 1] - self.x[s], self.y[s + 1] - self.y[s])
+        return s[step <= self.max_jump]
+
+    def _register(self, segs):
+        # add the (cell, segment) pairs of new segments, keeping the pairs sorted by cell
+        a, b = segs, segs + 1
+        owner, keys = self._box_cells(np.minimum(self.x[a], self.x[b]), np.minimum(self.y[a], self.y[b]),
+                                      np.maximum(self.x[a], self.x[b]), np.maximum(self.y[a], self.y[b]))
+        keys = np.concatenate((self.keys, keys))
+        segs = np.concatenate((self.segs, segs[owner]))
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.segs = keys[order], segs[order]
+
+    def remove(self, infile):
+        """
+        Drop a line from the index.
+
+        :param str infile: The DZT file location
+        """
+        i = self.paths.index(infile)
+        a, b = self.line_start[i], self.line_start[i + 1]
+        keep = np.ones(len(self.x), dtype=bool)
+        keep[a:b] = False
+        # fix numbers after the line move down by its length
+        renumber = np.cumsum(keep) - 1
+        pairs = (self.segs < a) | (self.segs >= b)
+        self.keys, self.segs = self.keys[pairs], renumber[self.segs[pairs]]
+        self.x, self.y, self.trace = self.x[keep], self.y[keep], self.trace[keep]
+        self.line_start = np.concatenate((self.line_start[:i + 1], self.line_start[i + 2:] - (b - a)))
+        del self.paths[i], self.signatures[i]
+
+    def add(self, infile, fixes, signature=None):
+        """
+        Add (or replace) a line.
+
+        :param str infile: The DZT file location
+        :param numpy.ndarray fixes: Its fixes, as :py:func:`read_dzg` returns them
+        :param signature: Recorded to tell later whether the line changed
+        """
+        if infile in self.paths:
+            self.remove(infile)
+        if self.origin is None and len(fixes):
+            self.origin = [float(np.mean(fixes['longitude'])), float(np.mean(fixes['latitude']))]
+        start = len(self.x)
+        if len(fixes):
+            x, y = self.project(fixes['longitude'], fixes['latitude'])
+            self.x, self.y = np.concatenate((self.x, x)), np.concatenate((self.y, y))
+            self.trace = np.concatenate((self.trace, fixes['trace']))
+        self.paths.append(infile)
+        self.signatures.append(signature)
+        self.line_start = np.append(self.line_start, len(self.x))
+        if len(self.x) - start > 1:
+            self._register(self._segments(start, len(self.x)))
+
+    def update(self, infiles):
+        """
+        Bring the index up to date with a set of lines: new lines and lines whose DZG changed are (re)read, and lines that lost their DZG are dropped. Lines already indexed but not in :code:`infiles` are left alone.
+
+        :param list infiles: DZT file locations
+        :rtype: number of lines read or dropped (int)
+        """
+        changed = 0
+        for infile in infiles:
+            signature = dzg_signature(infile)
+            known = infile in self.paths
+            if known and (self.signatures[self.paths.index(infile)] == signature):
+                continue
+            if signature is None:
+                if known:
+                    self.remove(infile)
+                    changed += 1
+                continue
+            self.add(infile, read_dzg(dzg_path(infile)), signature)
+            changed += 1
+        return changed
+
+    #------------- QUERIES ------------------#
+    def _line_of(self, fix):
+        return np.searchsorted(self.line_start, fix, side='right') - 1
+
+    def _cell_counts(self, x0, y0, x1, y1):
+        return (np.floor(x1 / self.cell) - np.floor(x0 / self.cell) + 1) * (np.floor(y1 / self.cell) - np.floor(y0 / self.cell) + 1)
+
+    def _candidates(self, x0, y0, x1, y1):
+        # segments near each box: (box number, segment) pairs, each pair once. The segments of a box are looked up in
+        # the cells it covers, unless it covers more cells than there are pairs; that is cheaper to answer with every segment
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        x0, y0, x1, y1 = (np.atleast_1d(np.asarray(v, dtype=float)) for v in (x0, y0, x1, y1))
+        big = self._cell_counts(x0, y0, x1, y1) > len(self.keys)
+        parts = []
+        if big.any():
+            every, boxes = np.unique(self.segs), np.flatnonzero(big)
+            parts.append(np.stack((np.repeat(boxes, len(every)), np.tile(every, len(boxes))), axis=1))
+        small = np.flatnonzero(~big)
+        if len(small):
+            owner, keys = self._box_cells(x0[small], y0[small], x1[small], y1[small])
+            lo = np.searchsorted(self.keys, keys, side='left')
+            hi = np.searchsorted(self.keys, keys, side='right')
+            pick, offset = _expand(hi - lo)
+            parts.append(np.stack((small[owner[pick]], self.segs[lo[pick] + offset]), axis=1))
+        pairs = np.unique(np.concatenate(parts), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def _box_segments(self, x0, y0, x1, y1):
+        # segments near one box
+        return self._candidates(x0, y0, x1, y1)[1]
+
+    def _hit(self, line, trace, x, y, **extra):
+        lon, lat = self.unproject(x, y)
+        hit = {'path': self.paths[line], 'trace': int(round(trace)), 'longitude': float(lon), 'latitude': float(lat)}
+        hit.update(extra)
+        return hit
+
+    def nearest(self, lon, lat, radius=50.):
+        """
+        The nearest trace of every line passing within :code:`radius` metres of a point.
+
+        :param float lon: Longitude
+        :param float lat: Latitude
+        :param float radius: Search radius in metres
+        :rtype: list of dict (path, trace, longitude, latitude, distance in metres), nearest first
+        """
+        if self.origin is None:
+            return []
+        px, py = self.project(lon, lat)
+        s = self._box_segments(px - radius, py - radius, px + radius, py + radius)
+        if not len(s):
+            return []
+        ax, ay, dx, dy = self.x[s], self.y[s], self.x[s + 1] - self.x[s], self.y[s + 1] - self.y[s]
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(length2 > 0, ((px - ax) * dx + (py - ay) * dy) / length2, 0.)
+        t = np.clip(t, 0., 1.)
+        cx, cy = ax + t * dx, ay + t * dy
+        dist = np.hypot(cx - px, cy - py)
+        lines = self._line_of(s)
+        order = np.lexsort((dist, lines))
+        first = order[np.unique(lines[order], return_index=True)[1]] # the closest segment of each line
+        first = first[dist[first] <= radius]
+        trace = self.trace[s] + t * (self.trace[s + 1] - self.trace[s])
+        hits = [self._hit(lines[k], trace[k], cx[k], cy[k], distance=float(dist[k])) for k in first]
+        return sorted(hits, key=lambda h: h['distance'])
+
+    def bbox(self, lon_min, lat_min, lon_max, lat_max):
+        """
+        The trace ranges of every line inside a longitude/latitude box. A line that leaves and re-enters the box gives one range per pass.
+
+        :rtype: list of dict (path, first, last trace)
+        """
+        if self.origin is None:
+            return []
+        (x0, x1), (y0, y1) = self.project([lon_min, lon_max], [lat_min, lat_max])
+        s = self._box_segments(x0, y0, x1, y1)
+        if not len(s):
+            return []
+        ax, ay, dx, dy = self.x[s], self.y[s], self.x[s + 1] - self.x[s], self.y[s + 1] - self.y[s]
+        # Liang-Barsky clipping of every segment at once
+        t0, t1 = np.zeros(len(s)), np.ones(len(s))
+        inside = np.ones(len(s), dtype=bool)
+        for p, q in ((-dx, ax - x0), (dx, x1 - ax), (-dy, ay - y0), (dy, y1 - ay)):
+            parallel = p == 0
+            inside &= ~(parallel & (q < 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+        inside &= t0 <= t1
+        s, t0, t1 = s[inside], t0[inside], t1[inside]
+        span = self.trace[s + 1] - self.trace[s]
+        enter, leave = self.trace[s] + t0 * span, self.trace[s] + t1 * span
+        lines = self._line_of(s)
+        ranges = []
+        for k in np.lexsort((enter, lines)):
+            first, last = int(np.floor(enter[k])), int(np.ceil(leave[k]))
+            if ranges and (ranges[-1]['path'] == self.paths[lines[k]]) and (first <= ranges[-1]['last'] + 1):
+                ranges[-1]['last'] = max(ranges[-1]['last'], last)
+            else:
+                ranges.append({'path': self.paths[lines[k]], 'first': first, 'last': last})
+        return ranges
+
+    def _intersect(self, qx, qy, exclude=None):
+        # crossings of the polyline (qx, qy) with the indexed segments. Candidates are looked up a block of query segments
+        # at a time, so a long polyline over a fine grid never expands more than about QUERY_BLOCK cells or pairs at once
+        qx, qy = np.asarray(qx, dtype=float), np.asarray(qy, dtype=float)
+        boxes = (np.minimum(qx[:-1], qx[1:]), np.minimum(qy[:-1], qy[1:]), np.maximum(qx[:-1], qx[1:]), np.maximum(qy[:-1], qy[1:]))
+        cost = np.cumsum(np.minimum(self._cell_counts(*boxes), len(self.segs)))
+        parts, a = [], 0
+        while a < len(cost):
+            b = max(a + 1, int(np.searchsorted(cost, (cost[a - 1] if a else 0) + QUERY_BLOCK, side='right')))
+            q, s = self._candidates(*(v[a:b] for v in boxes))
+            parts.append((q + a, s))
+            a = b
+        if not parts:
+            return []
+        q, s = np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
+        if exclude is not None:
+            keep = (s < self.line_start[exclude]) | (s >= self.line_start[exclude + 1])
+            q, s = q[keep], s[keep]
+        px, py, rx, ry = self.x[s], self.y[s], self.x[s + 1] - self.x[s], self.y[s + 1] - self.y[s]
+        cx, cy, ux, uy = qx[q], qy[q], qx[q + 1] - qx[q], qy[q + 1] - qy[q]
+        denom = rx * uy - ry * ux
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((cx - px) * uy - (cy - py) * ux) / denom
+            u = ((cx - px) * ry - (cy - py) * rx) / denom
+        hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        s, q, t, u = s[hit], q[hit], t[hit], u[hit]
+        x, y = px[hit] + t * rx[hit], py[hit] + t * ry[hit]
+        trace = self.trace[s] + t * (self.trace[s + 1] - self.trace[s])
+        lines = self._line_of(s)
+        order = np.lexsort((q + u, lines))
+        return [self._hit(lines[k], trace[k], x[k], y[k], at=float(q[k] + u[k])) for k in order]
+
+    def intersect(self, lons, lats):
+        """
+        Where indexed lines cross a polyline.
+
+        :param list lons: Longitudes of the polyline vertices
+        :param list lats: Latitudes of the polyline vertices
+        :rtype: list of dict (path, trace, longitude, latitude, and :code:`at`: the position along the polyline as vertex number plus fraction)
+        """
+        if self.origin is None:
+            return []
+        return self._intersect(*self.project(lons, lats))
+
+    def crossings(self, infile):
+        """
+        Where other indexed lines cross an indexed line.
+
+        :param str infile: The DZT file location
+        :rtype: list of dict, as :py:meth:`intersect` (:code:`at` counts fixes of :code:`infile`)
+        """
+        i = self.paths.index(infile)
+        a, b = self.line_start[i], self.line_start[i + 1]
+        if b - a < 2:
+            return []
+        return self._intersect(self.x[a:b], self.y[a:b], exclude=i)
+
+
+def trace_window(trace, margin, ntraces=None):
+    """
+    The trace range around a hit, as the :code:`start_scan` and :code:`num_scans` arguments of :py:func:`readgssi.readgssi.readgssi`, so only that part of the line is read.
+
+    :param int trace: The trace
+    :param int margin: Traces either side
+    :param int ntraces: Traces in the file, if known
+    :rtype: start_scan (int), num_scans (int)
+    """
+    start = max(0, trace - margin)
+    stop = trace + margin + 1 if ntraces is None else min(ntraces, trace + margin + 1)
+    return start, stop - start
+
+
+def catalog_lines(catalog_path):
+    """
+    DZT files of a catalog (see :py:mod:`catalog`) that were ingested and have a DZG.
+
+    :param str catalog_path: The catalog database
+    :rtype: list of str
+    """
+    from catalog import Catalog
+    with Catalog(catalog_path) as c:
+        return [row['path'] for row in c.rows("status = 'ok' AND has_dzg = 1")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build and query the spatial index of survey lines.')
+    parser.add_argument('--index', default=os.path.join('processed', INDEX), help='index file (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='add new and changed lines to the index')
+    build.add_argument('sources', nargs='+', help='catalog databases, directories and/or glob patterns of DZT files')
+    build.add_argument('--cell', type=float, default=DEFAULT_CELL, help='grid cell size in metres for a new index (default: %(default)s)')
+    nearest = commands.add_parser('nearest', help='nearest trace of each line near a point')
+    nearest.add_argument('lon', type=float)
+    nearest.add_argument('lat', type=float)
+    nearest.add_argument('--radius', type=float, default=50., help='search radius in metres (default: %(default)s)')
+    box = commands.add_parser('bbox', help='trace ranges inside a box')
+    cross = commands.add_parser('cross', help='crossings with a polyline (lon lat pairs) or, with --line, another line')
+    for p in (box, cross):
+        p.add_argument('coords', nargs='*', type=float, help='lon_min lat_min lon_max lat_max' if p is box else 'lon lat lon lat ...')
+    cross.add_argument('--line', default=None, help='an indexed DZT file to find the crossings of')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        from batch import find_inputs
+        index = SpatialIndex.open(args.index, cell=args.cell)
+        infiles = []
+        for source in args.sources:
+            infiles += catalog_lines(source) if source.endswith(('.sqlite', '.db')) else find_inputs([source])
+        changed = index.update(infiles)
+        os.makedirs(os.path.dirname(os.path.abspath(args.index)), exist_ok=True)
+        index.save(args.index)
+        print('%d line(s) updated; %d indexed, %d segment cells' % (changed, len(index.paths), len(index.keys)))
+        return 0
+    index = SpatialIndex.load(args.index)
+    if args.command == 'nearest':
+        results = index.nearest(args.lon, args.lat, radius=args.radius)
+    elif args.command == 'bbox':
+        results = index.bbox(*args.coords)
+    elif args.line:
+        results = index.crossings(os.path.abspath(args.line))
+    else:
+        results = index.intersect(args.coords[0::2], args.coords[1::2])
+    for r in results:
+        print(json.dumps(r))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import argparse
+import os
+import sys
+import numpy as np
+import instrument
+from backend import dzt_func, filter_args, triangular_taps
+
+# Frequency content of radar lines, for choosing bandpass corners: the mean
+# power spectrum of a line's traces by Welch's method (every trace, or a random
+# subset of a long line, in one call along the time axis), the spectrogram of a
+# single trace, and the response of the triangular bandpass to compare them
+# with. scipy is imported when a spectrum is computed.
+
+MAX_TRACES = 4096 # traces averaged into a line spectrum; longer lines are sampled
+SEGMENT = 128 # samples per Welch segment (at most the trace length)
+SPECGRAM_SEGMENT = 32 # samples per spectrogram window
+BAND_DB = 6 # the band reported around the peak is where power is within this many dB of it
+
+
+#------------- SPECTRA ------------------#
+def trace_subset(ntraces, max_traces=MAX_TRACES, seed=0):
+    """
+    The traces a line spectrum is averaged over: all of them, or :code:`max_traces` drawn at random (without replacement, in order, and the same on every call).
+
+    :param int ntraces: Number of traces in the line
+    :param int max_traces: Maximum number of traces
+    :param int seed: Random seed
+    :rtype: :py:class:`slice` or :py:class:`numpy.ndarray` of trace indices
+    """
+    if ntraces <= max_traces:
+        return slice(None)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(ntraces, size=max_traces, replace=False))
+
+
+def line_spectrum(ar, header, max_traces=MAX_TRACES, nperseg=SEGMENT, seed=0):
+    """
+    Mean power spectral density of the traces of a line. :py:func:`scipy.signal.welch` runs once along axis 0 of the selected traces, and the per-trace spectra are averaged.
+
+    :param numpy.ndarray ar: The radar array (samples x traces)
+    :param dict header: The file header dictionary
+    :param int max_traces: Traces averaged at most (see :py:func:`trace_subset`)
+    :param int nperseg: Samples per Welch segment
+    :param int seed: Random seed for the trace subset
+    :rtype: :py:class:`dict` with 'freqs' (Hz), 'power' (per Hz) and 'traces' (number averaged)
+    """
+    from scipy.signal import welch
+    cols = trace_subset(ar.shape[1], max_traces, seed)
+    traces = np.asarray(ar[:, cols], dtype=np.float32)
+    freqs, power = welch(traces, fs=header['samp_freq'], nperseg=min(nperseg, ar.shape[0]), axis=0)
+    return {'freqs': freqs, 'power': power.mean(axis=1), 'traces': traces.shape[1]}
+
+
+def trace_spectrogram(ar, header, trace, nperseg=SPECGRAM_SEGMENT):
+    """
+    Spectrogram of one trace, in Hann windows overlapping by seven eighths.
+
+    :param numpy.ndarray ar: The radar array (samples x traces)
+    :param dict header: The file header dictionary
+    :param int trace: The trace
+    :param int nperseg: Samples per window
+    :rtype: :py:class:`dict` with 'freqs' (Hz), 'times' (s from the first sample) and 'power' (freqs x times)
+    """
+    from scipy.signal import spectrogram
+    nperseg = min(nperseg, ar.shape[0])
+    freqs, times, power = spectrogram(np.asarray(ar[:, trace], dtype=np.float32), fs=header['samp_freq'],
+                                      nperseg=nperseg, noverlap=nperseg * 7 // 8)
+    return {'freqs': freqs, 'times': times, 'power': power}
+
+
+def band(freqs, power, db=BAND_DB):
+    """
+    Peak of a spectrum and the band around it where power stays within :code:`db` decibels of the peak, a starting point for the bandpass corners.
+
+    :param numpy.ndarray freqs: Frequencies
+    :param numpy.ndarray power: Power at each frequency
+    :param float db: Drop from the peak that ends the band
+    :rtype: peak, lower edge, upper edge (in the units of :code:`freqs`)
+    """
+    peak = int(np.argmax(power[1:])) + 1 # ignoring DC
+    above = power >= power[peak] * 10 ** (-db / 10.)
+    lo = peak
+    while (lo > 1) and above[lo - 1]:
+        lo -= 1
+    hi = peak
+    while (hi < len(power) - 1) and above[hi + 1]:
+        hi += 1
+    return freqs[peak], freqs[lo], freqs[hi]
+
+
+def filter_response(active_filters, header, freqs):
+    """
+    Power gain of the frequency-selective filters in a filter chain, to overlay on a spectrum. Only the triangular bandpass qualifies; it runs forwards and backwards, so its gain is the squared magnitude of its response.
+
+    :param dict active_filters: Filter names mapped to their parameter lists, as built by the GUI
+    :param dict header: The file header dictionary
+    :param numpy.ndarray freqs: Frequencies in Hz
+    :rtype: :py:class:`numpy.ndarray`, or None if no filter in the chain shapes the spectrum
+    """
+    from scipy.signal import freqz
+    params = active_filters.get('Vertical triangular FIR bandpass')
+    if not params:
+        return None
+    freqmin, freqmax = filter_args(params)
+    w, h = freqz(triangular_taps(header, freqmin, freqmax), worN=freqs, fs=header['samp_freq'])
+    return np.abs(h) ** 2
+
+
+#------------- COMMAND LINE ------------------#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the peak frequency and bandwidth of DZT files, to choose bandpass corners from.')
+    parser.add_argument('inputs', nargs='+', help='DZT files')
+    parser.add_argument('--traces', type=int, default=MAX_TRACES, help='traces averaged per file at most (default: %(default)s)')
+    parser.add_argument('--db', type=float, default=BAND_DB, help='band edges are this many dB below the peak (default: %(default)s)')
+    args = parser.parse_args(argv)
+    instrument.enable(os.environ.get(instrument.LOG_ENV))
+    for infile in args.inputs:
+        data, headers = dzt_func([infile])
+        with instrument.stage('spectrum', os.path.basename(infile), data[0]):
+            spec = line_spectrum(data[0], headers[0], max_traces=args.traces)
+        peak, lo, hi = band(spec['freqs'], spec['power'], db=args.db)
+        print('%s: peak %.0f MHz, -%g dB band %.0f-%.0f MHz (%d traces)' % (os.path.basename(infile), peak / 1e6, args.db, lo / 1e6, hi / 1e6, spec['traces']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import numpy as np
+
+SAMPLE_SIZE = 2**20 # arrays with more values than this are sampled for percentiles and histograms
+BLOCK = 4096 # traces per block in the streaming moments pass
+PERCENTILES = (0.5, 1, 2, 5, 95, 98, 99, 99.5)
+
+
+#------------- CACHE ------------------#
+class VersionedCache(object):
+    """
+    Small cache for products derived from arrays that change in place (filtered data). Entries are stored against a key and a data version; asking for a different version recomputes and replaces the entry.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key, version, compute):
+        """
+        Return the cached value for :code:`key` at :code:`version`, computing it with :code:`compute()` if it is missing or stale.
+
+        :param key: Any hashable key, e.g. the file index in a tab
+        :param version: The data version the value must belong to
+        :param callable compute: Function returning the value
+        """
+        entry = self.entries.get(key)
+        if (entry is None) or (entry[0] != version):
+            entry = (version, compute())
+            self.entries[key] = entry
+        return entry[1]
+
+    def clear(self):
+        self.entries.clear()
+
+
+#------------- STATISTICS ------------------#
+def moments(ar, block=BLOCK):
+    """
+    Exact count, mean, standard deviation, minimum and maximum in one streaming pass over blocks of traces. Block results are merged with Chan's parallel variance formula, so no full-size float copy of the array is made.
+
+    :param numpy.ndarray ar: The radar array
+    :param int block: Traces per block
+    :rtype: :py:class:`dict`
+    """
+    n = 0
+    mean = 0.
+    m2 = 0.
+    lo = np.inf
+    hi = -np.inf
+    for a in range(0, ar.shape[1], block):
+        b = ar[:, a:a + block].astype(np.float64)
+        nb = b.size
+        mb = b.mean()
+        m2b = np.square(b - mb).sum()
+        delta = mb - mean
+        tot = n + nb
+        mean += delta * nb / tot
+        m2 += m2b + delta ** 2 * n * nb / tot
+        n = tot
+        lo = min(lo, b.min())
+        hi = max(hi, b.max())
+    return {'count': n, 'mean': mean, 'std': np.sqrt(m2 / n) if n else 0., 'min': lo, 'max': hi}
+
+
+def sample(ar, size=SAMPLE_SIZE, seed=0):
+    """
+    Values to estimate distribution statistics from: the whole array if it is small, otherwise :code:`size` uniformly random samples (drawn with replacement, which is cheap for huge arrays and indistinguishable at this size).
+
+    :param numpy.ndarray ar: The radar array
+    :param int size: Maximum number of values
+    :param int seed: Random seed, fixed so repeated calls give the same contrast
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    if ar.size <= size:
+        return np.asarray(ar, dtype=np.float64).ravel()
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, ar.shape[0], size)
+    cols = rng.integers(0, ar.shape[1], size)
+    return ar[rows, cols].astype(np.float64)
+
+
+def display_stats(ar, size=SAMPLE_SIZE, bins=256):
+    """
+    Statistics used for display contrast and export: exact moments from :py:func:`moments` plus percentiles (:py:data:`PERCENTILES`) and a histogram from :py:func:`sample`.
+
+    :param numpy.ndarray ar: The radar array
+    :param int size: Maximum number of values used for percentiles and the histogram
+    :param int bins: Number of histogram bins
+    :rtype: :py:class:`dict`
+    """
+    stats = moments(ar)
+    values = sample(ar, size=size)
+    stats['sampled'] = values.size < ar.size
+    stats['percentiles'] = dict(zip(PERCENTILES, np.percentile(values, PERCENTILES)))
+    stats['hist'], stats['bin_edges'] = np.histogram(values, bins=bins, range=(stats['min'], stats['max']))
+    return stats
+
+
+def clim(stats, mode='sigma', sigma=3, pct=1):
+    """
+    Colour limits for a radargram.
+
+    :param dict stats: Output of :py:func:`display_stats`
+    :param str mode: 'sigma' for mean +/- :code:`sigma` standard deviations, or 'percentile' to clip the :code:`pct` percent tails on each side (:code:`pct` must be in :py:data:`PERCENTILES`)
+    :param float sigma: Number of standard deviations
+    :param float pct: Tail percentage for percentile clipping
+    :rtype: tuple of float
+    """
+    if mode == 'percentile':
+        return stats['percentiles'][pct], stats['percentiles'][100 - pct]
+    return stats['mean'] - (stats['std'] * sigma), stats['mean'] + (stats['std'] * sigma)